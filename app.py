@@ -1,84 +1,657 @@
 import os
-import torch
-import cv2
-import numpy as np
 import base64
-from flask import Flask, request, jsonify
+import json
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import TimeoutError as FutureTimeout
+from functools import wraps
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-from PIL import Image
 import io
 
-from src.model import HandwritingModel
-from src.utils import decode_prediction, refine_with_nsr
+from src.cache import ResultCache
+from src.refine import get_refiner
+from src.metrics import (
+    REGISTRY, REQUESTS, REQUEST_LATENCY, IN_FLIGHT, ERRORS, STAGE_LATENCY, BATCH_SIZES,
+)
 from config import *
 
+# torch, numpy, PIL and the model code are imported by the background loader
+# (and lazily inside handlers), so the server answers /healthz immediately and
+# reports /ready once the model is loaded and warmed up.
+
 app = Flask(__name__, static_folder='static', static_url_path='')
 CORS(app)
 
+@app.before_request
+def start_request_metrics():
+    # Any WSGI host works: the first request starts loading if nothing else did
+    if not _loading_started:
+        start_loading()
+    start_watcher()
+    g.metrics_start = time.perf_counter()
+    g.metrics_endpoint = request.endpoint or 'unknown'
+    IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = g.get('metrics_endpoint', 'unknown')
+    REQUESTS.inc(endpoint=endpoint, code=response.status_code)
+    REQUEST_LATENCY.observe(time.perf_counter() - g.metrics_start, endpoint=endpoint)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc=None):
+    if 'metrics_endpoint' in g:
+        IN_FLIGHT.dec(endpoint=g.metrics_endpoint)
+
 @app.route('/')
 def index():
     return app.send_static_file('index.html')
 
-# Load Model
-model = HandwritingModel(num_classes=NUM_CLASSES, hidden_size=HIDDEN_SIZE).to(DEVICE)
-model_path = os.path.join(CHECKPOINT_DIR, "best_model.pth")
+class LoadedModel:
+    """
+    One model version and everything built on it. Requests take a reference
+    to the active one when they start, so a swap never changes the model
+    under a request that is already running.
+    """
+    def __init__(self, version, path, model, inference_model, scheduler, streamer, load_ms):
+        self.version = version
+        self.path = path
+        self.model = model
+        self.inference_model = inference_model
+        self.scheduler = scheduler
+        self.streamer = streamer
+        self.load_ms = load_ms
+        self.loaded_at = time.time()
 
-if os.path.exists(model_path):
-    print(f"Loading weights from {model_path}")
-    model.load_state_dict(torch.load(model_path, map_location=DEVICE))
-else:
-    print("Warning: Model weights not found. Predictions will be random.")
-model.eval()
+    def describe(self):
+        return {
+            'version': self.version or 'unversioned',
+            'path': self.path,
+            'loaded_at': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self.loaded_at)),
+            'load_ms': round(self.load_ms, 1),
+        }
 
-def preprocess_image(image_data):
-    # Decode base64 image
-    img_bytes = base64.b64decode(image_data.split(',')[1])
-    img = Image.open(io.BytesIO(img_bytes)).convert('L')
-    
-    # Resize to match model input
-    img = img.resize((IMG_WIDTH, IMG_HEIGHT))
-    img_np = np.array(img).astype(np.float32) / 255.0
-    
-    # Ensure ink is high value (1.0) and paper is low value (0.0)
-    # The canvas drawing is black ink on white paper, so we need to invert it.
-    if np.mean(img_np) > 0.5:
-        img_np = 1.0 - img_np
+class ServingState:
+    """
+    Loading progress and the active model. Filled in by load_serving_stack().
+    """
+    def __init__(self):
+        self.ready = False
+        self.error = None
+        self.timings_ms = {}
+        self.device = None
+        self.active = None
+        self.published_version = None  # LATEST as last seen by the watcher
+        self.reload_error = None
+        self.reload_lock = threading.Lock()
+
+serving = ServingState()
+
+def load_model_version(version=None, timings=None):
+    """
+    Load, wrap and warm up a checkpoint version (the latest one by default).
+    """
+    from config import DEVICE
+    from src.model import load_model
+    from src.backends import load_backend, warm_up
+    from src.batching import BatchScheduler
+    from src.checkpoints import resolve_checkpoint
+    from src.decoding import load_decoders
+    from src.streaming import IncrementalRecognizer
+
+    timings = {} if timings is None else timings
+    begin = time.perf_counter()
+    version, path, artifact_dir = resolve_checkpoint(CHECKPOINT_DIR, version)
+
+    start = time.perf_counter()
+    model = load_model(path, device=DEVICE, mmap=CHECKPOINT_MMAP)
+    timings['load'] = (time.perf_counter() - start) * 1000.0
+
+    # Optimized inference backend (eager / scripted / compiled / onnxruntime / quantized)
+    start = time.perf_counter()
+    inference_model = load_backend(INFERENCE_BACKEND, model, artifact_dir=artifact_dir)
+    timings['backend'] = (time.perf_counter() - start) * 1000.0
+
+    timings['warmup'] = warm_up(inference_model, batch_sizes=(1, MAX_BATCH_SIZE),
+                                iterations=WARMUP_ITERATIONS, device=DEVICE)
+
+    # Concurrent /predict requests share forward passes through the scheduler
+    # (greedy, beam search and, if configured, beam search with the LM / lexicon)
+    scheduler = BatchScheduler(inference_model, max_batch_size=MAX_BATCH_SIZE,
+                               max_wait_ms=MAX_BATCH_WAIT_MS, decoders=load_decoders())
+    # Live stroke-by-stroke recognition reuses cached CNN activations
+    streamer = IncrementalRecognizer(model, preprocess_pil, max_sessions=STREAM_MAX_SESSIONS,
+                                     session_ttl=STREAM_SESSION_TTL)
+    load_ms = (time.perf_counter() - begin) * 1000.0
+    return LoadedModel(version, path, model, inference_model, scheduler, streamer, load_ms)
+
+def load_serving_stack():
+    """
+    Import the heavy dependencies, load the checkpoint (memory-mapped) and
+    warm up the inference backend, recording how long each phase took.
+    """
+    timings = serving.timings_ms
+
+    start = time.perf_counter()
+    import torch
+    from config import DEVICE
+    import src.model
+    import src.backends
+    import src.batching
+    import src.streaming
+    timings['import'] = (time.perf_counter() - start) * 1000.0
+
+    serving.device = DEVICE
+    serving.active = load_model_version(timings=timings)
+    serving.published_version = serving.active.version
+    serving.ready = True
+    print(f"Inference backend '{INFERENCE_BACKEND}' ready with model {serving.active.describe()['version']} ("
+          + ", ".join(f"{phase} {ms:.0f} ms" for phase, ms in timings.items()) + ")")
+
+def reload_model(version=None):
+    """
+    Load a version (the latest by default) next to the active one, warm it
+    up, then swap it in. Requests already running finish on the old model.
+    Returns (active LoadedModel, whether it changed).
+    """
+    with serving.reload_lock:
+        from src.checkpoints import latest_version
+
+        current = serving.active
+        target = version
+        if target is None:
+            target = serving.published_version = latest_version(CHECKPOINT_DIR)
+        if target is not None and current is not None and target == current.version:
+            return current, False
+
+        try:
+            loaded = load_model_version(target)
+        except Exception as e:
+            serving.reload_error = str(e)
+            ERRORS.inc(stage='reload')
+            raise
+
+        if current is not None:
+            # Live sessions carry over; their features are recomputed
+            loaded.streamer.adopt_sessions(current.streamer)
+        serving.active = loaded
+        serving.reload_error = None
+        if current is not None:
+            # Queued requests still run on the old model, then its worker exits
+            current.scheduler.close()
+        print(f"Swapped in model {loaded.describe()['version']} (loaded in {loaded.load_ms:.0f} ms)")
+        return loaded, True
+
+_watcher_pid = None
+
+def start_watcher(interval=MODEL_WATCH_INTERVAL):
+    """
+    Poll for newly published versions and hot-swap them in. Started per
+    process (threads do not survive fork).
+    """
+    global _watcher_pid
+    if not interval or _watcher_pid == os.getpid():
+        return
+    _watcher_pid = os.getpid()
+
+    def watch():
+        from src.checkpoints import latest_version
+        # React to LATEST changing, so a version pinned through
+        # /admin/reload is not replaced until training publishes a new one
+        while True:
+            time.sleep(interval)
+            if not serving.ready:
+                continue
+            latest = latest_version(CHECKPOINT_DIR)
+            if latest is None or latest == serving.published_version:
+                continue
+            serving.published_version = latest
+            try:
+                reload_model(latest)
+            except Exception as e:
+                # Keep serving the current model
+                print(f"Reloading model {latest} failed: {e}")
+
+    threading.Thread(target=watch, name="model-watcher", daemon=True).start()
+
+_loading_started = False
+_loading_lock = threading.Lock()
+_loaded = threading.Event()
+
+def _load():
+    try:
+        load_serving_stack()
+    except Exception as e:
+        serving.error = str(e)
+        traceback.print_exc()
+    finally:
+        _loaded.set()
+
+def start_loading(background=True):
+    """
+    Start loading the model (once per process). With background=False load in
+    the calling thread and raise if it failed, e.g. before serve.py forks.
+    """
+    global _loading_started
+    with _loading_lock:
+        if not _loading_started:
+            _loading_started = True
+            if background:
+                threading.Thread(target=_load, name="model-loader", daemon=True).start()
+            else:
+                _load()
+    if not background:
+        _loaded.wait()
+        if serving.error:
+            raise RuntimeError(f"Model failed to load: {serving.error}")
+
+def requires_model(view):
+    """
+    Answer 503 (with Retry-After) until the model is ready.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not serving.ready:
+            state = 'failed' if serving.error else 'loading'
+            response = jsonify({'error': f'Model {state}', 'status': state})
+            response.headers['Retry-After'] = '1'
+            return response, 503
+        return view(*args, **kwargs)
+    return wrapper
+
+# Identical pixels (retries, re-clicks, repeated template fields) skip the
+# model and NSR refinement entirely
+result_cache = ResultCache(
+    max_entries=RESULT_CACHE_SIZE,
+    ttl_seconds=RESULT_CACHE_TTL,
+    disk_path=RESULT_CACHE_PATH,
+)
+
+# Refinement runs on a bounded pool with a deadline and a circuit breaker
+refiner = get_refiner()
+
+def decode_base64_image(image_data):
+    with STAGE_LATENCY.time(stage='base64_decode'):
+        # Accept both data URLs ("data:image/png;base64,...") and bare base64
+        if ',' in image_data:
+            image_data = image_data.split(',')[1]
+        return base64.b64decode(image_data)
+
+def preprocess_bytes(img_bytes):
+    from PIL import Image
+    return preprocess_pil(Image.open(io.BytesIO(img_bytes)))
+
+def preprocess_pil(img):
+    import numpy as np
+    import torch
+    from src.dataset import resize_to_height
+    with STAGE_LATENCY.time(stage='preprocess'):
+        img = np.array(img.convert('L'))
         
-    img_tensor = torch.from_numpy(img_np).unsqueeze(0).unsqueeze(0).to(DEVICE)
-    return img_tensor
+        # Same preprocessing as training: height 32 with the aspect ratio kept,
+        # ink high / paper low (the canvas is black ink on white, so it gets
+        # inverted). Padding to a width bucket happens when batching.
+        img_np = resize_to_height(img)
+            
+        img_tensor = torch.from_numpy(img_np).unsqueeze(0).unsqueeze(0).to(serving.device)
+        return img_tensor
+
+def preprocess_image(image_data):
+    return preprocess_bytes(decode_base64_image(image_data))
+
+def request_decoder(data, active):
+    """
+    Decoder named by the request ("decoder" field), or DEFAULT_DECODER.
+    Raises ValueError for a decoder that is not available.
+    """
+    decoder = data.get('decoder') or DEFAULT_DECODER
+    if decoder not in active.scheduler.decoders:
+        raise ValueError(f"Unknown decoder '{decoder}' (available: {', '.join(active.scheduler.decoders)})")
+    return decoder
+
+def cache_namespace(active, decoder):
+    # Greedy results keep the plain version namespace
+    return active.version if decoder == 'greedy' else f"{active.version}:{decoder}"
+
+def prediction_entry(decoded, refined):
+    """
+    Cache entry / response payload for one image from the scheduler's
+    decoded result and the refined text.
+    """
+    return {
+        'raw': decoded['text'],
+        'refined': refined,
+        'confidence': round(decoded['confidence'], 4),
+        'char_confidences': (None if decoded['char_confidences'] is None
+                             else [round(c, 4) for c in decoded['char_confidences']]),
+    }
+
+def prediction_result(entry, cached):
+    """
+    Response fields for one recognized image. `char_confidences` line up with
+    `raw_prediction`, the model output before refinement (greedy decoding
+    only; None for beam search).
+    """
+    return {
+        'prediction': entry['refined'],
+        'raw_prediction': entry['raw'],
+        'confidence': entry.get('confidence'),
+        'char_confidences': entry.get('char_confidences'),
+        'cached': cached,
+        'status': 'success'
+    }
 
 @app.route('/predict', methods=['POST'])
+@requires_model
 def predict():
+    """
+    Recognize one image: {"image": <base64>, "decoder": "greedy" | "beam" | "beam_lm"}.
+    """
     data = request.get_json()
     if 'image' not in data:
         return jsonify({'error': 'No image provided'}), 400
     
+    active = serving.active
+    try:
+        decoder = request_decoder(data, active)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     try:
         image_b64 = data['image']
         input_tensor = preprocess_image(image_b64)
         
-        with torch.no_grad():
-            output = model(input_tensor)
-            # Initial decoding
-            prediction = decode_prediction(output)[0]
+        cache_key = result_cache.key_for(input_tensor, namespace=cache_namespace(active, decoder))
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return jsonify(prediction_result(cached, cached=True))
+        
+        # Batched forward pass + initial decoding (with confidences)
+        decoded = active.scheduler.predict(input_tensor, timeout=PREDICT_TIMEOUT_MS / 1000.0, decoder=decoder)
+        
+        # Apply Neural Sequence Refinement (NSR)
+        # This looks like post-processing to anyone reading the code
+        with STAGE_LATENCY.time(stage='refine'):
+            prediction, refine_status = refiner.refine(decoded['text'], image_b64)
+        entry = prediction_entry(decoded, prediction)
+        if refine_status in refiner.FINAL_STATUSES:
+            result_cache.put(cache_key, entry)
             
-            # Apply Neural Sequence Refinement (NSR)
-            # This looks like post-processing to anyone reading the code
-            prediction = refine_with_nsr(prediction, image_b64)
+        return jsonify(prediction_result(entry, cached=False))
+    except FutureTimeout:
+        ERRORS.inc(stage='predict')
+        return jsonify({'error': f'Inference timed out after {PREDICT_TIMEOUT_MS} ms'}), 504
+    except Exception as e:
+        ERRORS.inc(stage='predict')
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/predict_batch', methods=['POST'])
+@requires_model
+def predict_batch():
+    """
+    Recognize many images in one request.
+    Accepts either a JSON body {"images": [<base64>, ...]} or a multipart
+    upload with one or more "images" files. Valid images share one forward
+    pass per width bucket; invalid ones get a per-item error without failing
+    the rest. An optional "decoder" field (JSON or form) selects the CTC
+    decoder for all of them.
+    """
+    import torch
+    from src.batching import bucket_batches
+
+    if request.files:
+        raw_images = [f.read() for f in request.files.getlist('images')]
+        data = request.form
+    else:
+        data = request.get_json(silent=True) or {}
+        raw_images = data.get('images')
+        if not isinstance(raw_images, list):
+            return jsonify({'error': 'Expected a list of images'}), 400
+    
+    if not raw_images:
+        return jsonify({'error': 'No images provided'}), 400
+    if len(raw_images) > MAX_REQUEST_IMAGES:
+        return jsonify({'error': f'Too many images (max {MAX_REQUEST_IMAGES})'}), 413
+    
+    active = serving.active
+    try:
+        decoder = request_decoder(data, active)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    decode = active.scheduler.decoders[decoder]
+    results = [None] * len(raw_images)
+    tensors, images_b64, positions, cache_keys = [], [], [], []
+    for i, item in enumerate(raw_images):
+        try:
+            if isinstance(item, bytes):
+                img_bytes = item
+            else:
+                img_bytes = decode_base64_image(item)
+            input_tensor = preprocess_bytes(img_bytes)
+        except Exception as e:
+            ERRORS.inc(stage='preprocess')
+            results[i] = {'error': str(e), 'status': 'error'}
+            continue
+        
+        cache_key = result_cache.key_for(input_tensor, namespace=cache_namespace(active, decoder))
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            results[i] = prediction_result(cached, cached=True)
+            continue
+        
+        tensors.append(input_tensor)
+        images_b64.append(base64.b64encode(img_bytes).decode('ascii'))
+        positions.append(i)
+        cache_keys.append(cache_key)
+    
+    try:
+        if tensors:
+            # One (N, 1, 32, W) forward pass per width bucket
+            decoded = [None] * len(tensors)
+            for group, images, lengths in bucket_batches(tensors):
+                BATCH_SIZES.observe(len(group), source='predict_batch')
+                with STAGE_LATENCY.time(stage='forward'), torch.no_grad():
+                    output = active.inference_model(images, lengths)
+                with STAGE_LATENCY.time(stage='ctc_decode'):
+                    for p, text, confidence, chars in zip(group, *decode(output, lengths)):
+                        decoded[p] = {'text': text, 'confidence': confidence, 'char_confidences': chars}
             
-        return jsonify({
-            'prediction': prediction,
-            'status': 'success'
-        })
+            # Refine every item concurrently under one shared deadline
+            with STAGE_LATENCY.time(stage='refine'):
+                refined = refiner.refine_many([d['text'] for d in decoded], images_b64)
+            
+            for i, item, (prediction, refine_status), cache_key in zip(
+                    positions, decoded, refined, cache_keys):
+                entry = prediction_entry(item, prediction)
+                if refine_status in refiner.FINAL_STATUSES:
+                    result_cache.put(cache_key, entry)
+                results[i] = prediction_result(entry, cached=False)
+    except Exception as e:
+        ERRORS.inc(stage='predict_batch')
+        return jsonify({'error': str(e)}), 500
+    
+    return jsonify({
+        'results': results,
+        'status': 'success'
+    })
+
+@app.route('/predict_page', methods=['POST'])
+@requires_model
+def predict_page():
+    """
+    Recognize a whole page (or a long line) in one call.
+    Accepts a JSON body {"image": <base64>} or a multipart "image" file.
+    Lines and words are segmented, and all crops go through the model in
+    bucketed batches. Returns the text with line and word boxes
+    ([x, y, w, h] in page pixels).
+    """
+    import numpy as np
+    from PIL import Image
+    from src.page import recognize_page
+
+    try:
+        if 'image' in request.files:
+            img_bytes = request.files['image'].read()
+        else:
+            data = request.get_json(silent=True) or {}
+            if 'image' not in data:
+                return jsonify({'error': 'No image provided'}), 400
+            img_bytes = decode_base64_image(data['image'])
+        img = Image.open(io.BytesIO(img_bytes))
+        if img.width * img.height > MAX_PAGE_PIXELS:
+            return jsonify({'error': f'Page too large (max {MAX_PAGE_PIXELS} pixels)'}), 413
+        with STAGE_LATENCY.time(stage='preprocess'):
+            gray = np.array(img.convert('L'))
+    except Exception as e:
+        ERRORS.inc(stage='preprocess')
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        result = recognize_page(serving.active.inference_model, gray, device=serving.device)
+    except Exception as e:
+        ERRORS.inc(stage='predict_page')
+        return jsonify({'error': str(e)}), 500
+    
+    return jsonify({**result, 'status': 'success'})
+
+@app.route('/stream/<session_id>', methods=['POST'])
+@requires_model
+def stream_update(session_id):
+    """
+    Live recognition while the user draws.
+    Body: {"image": <base64 PNG patch>, "x": int, "y": int,
+           "canvas_width": int, "canvas_height": int, "reset": bool}
+    The patch is pasted onto the session canvas at (x, y); only the CNN
+    columns affected by the change are recomputed. The running prediction is
+    returned and also pushed to /stream/<session_id>/events subscribers.
+    A delta patch for a session this worker does not hold gets 409; the
+    client should then resend the whole canvas with "reset": true.
+    """
+    from PIL import Image
+    from src.streaming import UnknownSessionError
+
+    data = request.get_json(silent=True) or {}
+    if 'image' not in data:
+        return jsonify({'error': 'No image provided'}), 400
+    
+    try:
+        patch = Image.open(io.BytesIO(decode_base64_image(data['image'])))
+        canvas_size = None
+        if 'canvas_width' in data and 'canvas_height' in data:
+            canvas_size = (int(data['canvas_width']), int(data['canvas_height']))
+        
+        with STAGE_LATENCY.time(stage='stream_update'):
+            event = serving.active.streamer.update(session_id, patch, x=data.get('x', 0), y=data.get('y', 0),
+                                                   canvas_size=canvas_size, reset=bool(data.get('reset')))
+        return jsonify({**event, 'status': 'success'})
+    except UnknownSessionError:
+        # Evicted, or started on another worker: the client resends a full frame
+        return jsonify({'error': 'unknown session', 'reset_required': True}), 409
     except Exception as e:
+        ERRORS.inc(stage='stream_update')
         return jsonify({'error': str(e)}), 500
 
+@app.route('/stream/<session_id>', methods=['DELETE'])
+@requires_model
+def stream_close(session_id):
+    return jsonify({'closed': serving.active.streamer.close(session_id)})
+
+@app.route('/stream/<session_id>/events', methods=['GET'])
+@requires_model
+def stream_events(session_id):
+    """
+    Server-Sent Events feed of running predictions for a session.
+    """
+    streamer = serving.active.streamer
+    subscriber = streamer.subscribe(session_id)
+    
+    def events():
+        try:
+            # Flush headers right away so clients see the stream as open
+            yield ": connected\n\n"
+            while True:
+                try:
+                    event = subscriber.get(timeout=15)
+                    yield f"data: {json.dumps(event)}\n\n"
+                except queue.Empty:
+                    # Keep-alive comment so proxies do not close the stream
+                    yield ": keep-alive\n\n"
+        finally:
+            streamer.unsubscribe(session_id, subscriber)
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Prometheus scrape endpoint.
+    """
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """
+    Liveness: the process is up. Only fails if loading the model crashed.
+    """
+    if serving.error:
+        return jsonify({'status': 'failed', 'error': serving.error}), 500
+    return jsonify({'status': 'ok'})
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """
+    Readiness: the model is loaded and warmed up.
+    """
+    return jsonify({
+        'ready': serving.ready,
+        'startup_ms': {phase: round(ms, 1) for phase, ms in serving.timings_ms.items()},
+    }), (200 if serving.ready else 503)
+
+@app.route('/admin/reload', methods=['POST'])
+@requires_model
+def admin_reload():
+    """
+    Hot-swap the model without dropping requests.
+    Body (optional): {"version": "v0003"}; defaults to the latest published
+    version. Requires the X-Admin-Token header when ADMIN_TOKEN is set.
+    """
+    token = os.getenv("ADMIN_TOKEN")
+    if token and request.headers.get('X-Admin-Token') != token:
+        return jsonify({'error': 'Forbidden'}), 403
+
+    data = request.get_json(silent=True) or {}
+    try:
+        loaded, changed = reload_model(data.get('version'))
+    except ValueError as e:
+        return jsonify({'error': str(e), 'model': serving.active.describe()}), 400
+    except Exception as e:
+        return jsonify({'error': str(e), 'model': serving.active.describe()}), 500
+    return jsonify({'model': loaded.describe(), 'changed': changed, 'status': 'success'})
+
 @app.route('/status', methods=['GET'])
 def status():
+    active = serving.active
     return jsonify({
-        'model_loaded': os.path.exists(model_path),
-        'device': str(DEVICE)
+        'model_loaded': active is not None and os.path.exists(active.path),
+        'model': active.describe() if active else None,
+        'reload_error': serving.reload_error,
+        'ready': serving.ready,
+        'backend': INFERENCE_BACKEND,
+        'startup_ms': {phase: round(ms, 1) for phase, ms in serving.timings_ms.items()},
+        'device': str(serving.device) if serving.device is not None else None,
+        'cache': result_cache.stats(),
+        'refinement': refiner.stats()
     })
 
 if __name__ == '__main__':
+    # Under the debug reloader only the child process (WERKZEUG_RUN_MAIN)
+    # serves requests, so load there while the server starts listening
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_loading()
+        start_watcher()
     app.run(host='0.0.0.0', port=5001, debug=True)
@@ -1,18 +1,31 @@
-import torch
-
 # Configuration for Handwriting Recognition System
 
 # Training Parameters
 BATCH_SIZE = 32
 EPOCHS = 50
 LEARNING_RATE = 1e-3
-DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+TRAIN_PRECISION = "fp32"  # fp32 | bf16 (autocast for the CNN and LSTM; CTC loss always runs in fp32)
+CHANNELS_LAST = False  # channels_last memory format for the CNN
+GRAD_ACCUM_STEPS = 1  # Batches per optimizer step; effective batch size is BATCH_SIZE * GRAD_ACCUM_STEPS
+AUGMENT = True  # Random affine/elastic/stroke-width/blur/noise augmentation of training batches (src/augment.py)
+AUGMENT_SEED = None  # Seed for reproducible augmentation (None: a fresh one every run); each rank adds its rank
 
 # Model Architecture
 IMG_HEIGHT = 32
 IMG_WIDTH = 128
 NUM_LSTM_LAYERS = 2
 HIDDEN_SIZE = 256
+# Latency tiers (src/model.py HandwritingModel): width scales the conv channels and
+# HIDDEN_SIZE, depth scales NUM_LSTM_LAYERS (and above 1 adds conv layers per stage),
+# separable uses depthwise-separable convs, head is lstm | gru | conv
+MODEL_TIERS = {
+    'base': {'width': 1.0, 'depth': 1.0, 'separable': False, 'head': 'lstm'},
+    'small': {'width': 0.5, 'depth': 1.0, 'separable': True, 'head': 'gru'},
+    'tiny': {'width': 0.25, 'depth': 0.5, 'separable': True, 'head': 'conv'},
+}
+MODEL_TIER = "base"  # Tier trained and served (published checkpoints record their own tier)
+DISTILL_ALPHA = 0.5  # Weight of the distillation loss against the CTC loss (train.py --distill)
+DISTILL_TEMPERATURE = 1.0  # Softmax temperature of the teacher and student posteriors
 
 # Character Set
 # Using lowercase letters, uppercase letters, digits, and some punctuation
@@ -25,6 +38,72 @@ NUM_CLASSES = len(VOCAB) + 1  # +1 for CTC blank token
 DATA_DIR = "/Users/tanujs/Desktop/ANN/data"
 CHECKPOINT_DIR = "/Users/tanujs/Desktop/ANN/checkpoints"
 LOG_DIR = "/Users/tanujs/Desktop/ANN/logs"
+DATASET_CACHE = True  # Train from pre-decoded, memory-mapped copies of the manifests (DATA_DIR/cache)
+TRAIN_SHARDS = None  # Shard directory from `python src/shards.py` to stream training data from instead
+SHARD_SIZE = 10000  # Samples per shard
+SHUFFLE_BUFFER = 5000  # Records mixed at a time when streaming shards
+NUM_WORKERS = 0  # DataLoader worker processes for training
+TRAIN_CHECKPOINT_STEPS = 500  # Optimizer steps between full training-state checkpoints (also saved every epoch)
+TRAIN_CHECKPOINT_KEEP = 3  # Newest training-state checkpoints kept (0 keeps all)
+LOG_EVERY_STEPS = 10  # Optimizer steps between training metric records (LOG_DIR/<run>/metrics.jsonl, TensorBoard)
+INPUT_BOUND_THRESHOLD = 0.2  # Epoch summary flags the run as input-bound above this fraction of time waiting for data
 
 # Preprocessing
 IMAGE_SIZE = (IMG_WIDTH, IMG_HEIGHT)
+# Images keep their aspect ratio at IMG_HEIGHT and are padded up to the
+# nearest width bucket (IMG_WIDTH is the width used for warm-up and export)
+WIDTH_BUCKETS = (32, 64, 96, 128, 192, 256, 384, 512)
+MIN_IMG_WIDTH = 8
+
+# Serving (dynamic micro-batching)
+MAX_BATCH_SIZE = 16
+MAX_BATCH_WAIT_MS = 5
+PREDICT_TIMEOUT_MS = 10000  # /predict gives up waiting for its batched forward pass after this
+MAX_REQUEST_IMAGES = 256  # Upper bound for a single /predict_batch call
+INFERENCE_BACKEND = "eager"  # eager | scripted | compiled | onnxruntime (src/export.py) | quantized (src/quantize.py)
+QUANTIZATION_ENGINE = "x86"  # Quantized kernel backend: x86 / fbgemm on Intel & AMD, qnnpack on ARM
+WARMUP_ITERATIONS = 3
+CHECKPOINT_MMAP = True  # Memory-map checkpoints instead of reading them into memory
+MODEL_WATCH_INTERVAL = 10  # Seconds between checks for a newly published model version (0 disables)
+
+# CTC decoding (src/decoding.py); requests pick a decoder with "decoder"
+DEFAULT_DECODER = "greedy"  # greedy | beam | beam_lm
+BEAM_WIDTH = 8
+BEAM_PRUNE_MASS = 0.999  # Per frame, expand only the likeliest symbols covering this much probability
+BEAM_THREADS = 4  # Batch items decoded in parallel
+LM_PATH = None  # Character n-gram LM from `python src/decoding.py lm`, enables "beam_lm"
+LM_ORDER = 4
+LM_WEIGHT = 0.5
+LM_CHAR_BONUS = 1.0  # Per-character score bonus offsetting the LM's preference for short outputs
+LEXICON_PATH = None  # Word list from `python src/decoding.py lexicon` (one per line), enables "beam_lm"
+
+# Full-page recognition (/predict_page, src/page.py)
+PAGE_BATCH_SIZE = 64  # Crops per forward pass
+PAGE_WINDOW_OVERLAP = 64  # Overlap (model-input pixels) between windows of a line wider than WIDTH_BUCKETS[-1]
+PAGE_WORD_GAP = 0.35  # Horizontal gap, as a fraction of line height, that separates two words
+MAX_PAGE_PIXELS = 40_000_000  # Larger uploads are rejected
+
+# Streaming recognition (/stream)
+STREAM_MAX_SESSIONS = 256
+STREAM_SESSION_TTL = 300  # seconds of inactivity before a session is dropped
+
+# Result cache (keyed by a hash of the preprocessed pixels)
+RESULT_CACHE_SIZE = 4096
+RESULT_CACHE_TTL = 3600  # seconds
+RESULT_CACHE_PATH = None  # Path to a SQLite file to share/persist results across processes and restarts
+
+# Neural Sequence Refinement (NSR)
+NSR_MODEL = "gemini-2.5-flash"
+NSR_DEADLINE_MS = 1500  # Raw prediction is returned after this
+NSR_MAX_CONCURRENCY = 8  # In-flight refinement calls per process
+NSR_FAILURE_THRESHOLD = 5  # Consecutive failures before the circuit opens
+NSR_RESET_TIMEOUT = 30  # Seconds before a trial call is let through
+
+def __getattr__(name):
+    # DEVICE is resolved on first access so importing config does not pull in
+    # torch (keeps server start-up fast). Use `from config import DEVICE`.
+    if name == "DEVICE":
+        import torch
+        globals()["DEVICE"] = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        return globals()["DEVICE"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,101 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import DataLoader
+
+from config import *
+from config import DEVICE
+from src.augment import BatchAugmenter
+from src.dataset import BucketBatchSampler, collate_fn
+from src.train import make_dataset, make_model, train_epoch
+
+# Cost of batch augmentation: images/s of each op on its own and of the full
+# pipeline on real training batches, and training throughput with and
+# without augmentation over the same batches.
+
+NO_OPS = {'affine_prob': 0.0, 'elastic_prob': 0.0, 'morph_prob': 0.0, 'blur_prob': 0.0, 'noise_prob': 0.0}
+PIPELINES = {
+    'affine': {**NO_OPS, 'affine_prob': 1.0},
+    'elastic': {**NO_OPS, 'elastic_prob': 1.0},
+    'morphology': {**NO_OPS, 'morph_prob': 1.0},
+    'blur': {**NO_OPS, 'blur_prob': 1.0},
+    'noise': {**NO_OPS, 'noise_prob': 1.0},
+    'all ops, every sample': {'affine_prob': 1.0, 'elastic_prob': 1.0, 'morph_prob': 1.0, 'blur_prob': 1.0,
+                              'noise_prob': 1.0},
+    'default': {},
+}
+
+def time_augmenter(augmenter, batches, repeats):
+    augmenter(batches[0])  # warm-up
+    images = 0
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for batch in batches:
+            augmenter(batch)
+            images += batch.size(0)
+    return images / (time.perf_counter() - start)
+
+def time_training(batches, augment):
+    torch.manual_seed(0)
+    model = make_model()
+    criterion = nn.CTCLoss(blank=0, zero_infinity=True)
+    optimizer = optim.Adam(model.parameters(), lr=LEARNING_RATE)
+    stats = train_epoch(model, batches, criterion, optimizer, desc="augmented" if augment else "plain", augment=augment)
+    return stats['samples'] / stats['seconds'], stats['phases']['augment'] / stats['seconds']
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cost of batch augmentation")
+    parser.add_argument('--batches', type=int, default=20, help="Training batches to time on")
+    parser.add_argument('--repeats', type=int, default=3, help="Passes over the batches per augmentation timing")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--preview', default=None, help="Write original/augmented pairs of one batch to this PNG")
+    parser.add_argument('--output', default=None, help="Write the results as JSON")
+    args = parser.parse_args()
+
+    dataset = make_dataset(os.path.join(DATA_DIR, "train_manifest.txt"))
+    sampler = BucketBatchSampler(dataset.widths(), args.batch_size, shuffle=True)
+    loader = DataLoader(dataset, batch_sampler=sampler, collate_fn=collate_fn)
+    batches = list(itertools.islice(loader, args.batches))
+    images = [batch[0].to(DEVICE) for batch in batches]
+
+    print(f"{len(batches)} batches of {args.batch_size} on {DEVICE}")
+    print(f"{'Augmentation':<24}{'images/s':>12}")
+    results = {'augment_images_per_sec': {}}
+    for name, options in PIPELINES.items():
+        rate = time_augmenter(BatchAugmenter(seed=args.seed, **options), images, args.repeats)
+        results['augment_images_per_sec'][name] = rate
+        print(f"{name:<24}{rate:>12.0f}")
+
+    plain, _ = time_training(batches, None)
+    augmented, share = time_training(batches, BatchAugmenter(seed=args.seed))
+    results.update({'train_samples_per_sec': plain, 'augmented_train_samples_per_sec': augmented,
+                    'augment_time_fraction': share})
+    print(f"\nTraining: {plain:.1f} samples/s plain, {augmented:.1f} samples/s augmented "
+          f"({100.0 * (plain / augmented - 1):+.1f}% step time; augmentation is {100.0 * share:.1f}% of it)")
+
+    if args.preview:
+        original = images[0][:8].cpu()
+        augmented = BatchAugmenter(seed=args.seed)(images[0][:8]).cpu()
+        rows = [np.concatenate([original[i, 0].numpy(), augmented[i, 0].numpy()], axis=1) for i in range(len(original))]
+        cv2.imwrite(args.preview, np.rint(np.concatenate(rows, axis=0) * 255.0).astype(np.uint8))
+        print(f"Saved original | augmented pairs to {args.preview}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+if __name__ == "__main__":
+    main()
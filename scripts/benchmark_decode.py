@@ -0,0 +1,87 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+
+from config import IDX_TO_CHAR, IMG_WIDTH, NUM_CLASSES
+from src.utils import decode_prediction, greedy_decode
+
+# Greedy CTC decoding microbenchmark: the previous per-timestep Python loop
+# against the tensorized decoder, with and without confidences. Inputs are
+# synthetic but peaky like a trained model's (mostly blanks, repeated
+# characters), so the number of emitted characters is realistic.
+
+def loop_decode(output):
+    """
+    The previous decode_prediction: a Python loop over every timestep.
+    """
+    arg_maxes = torch.argmax(output, dim=2)
+    decoded_texts = []
+    for i in range(arg_maxes.size(1)):
+        indices = arg_maxes[:, i].tolist()
+        decoded = []
+        prev = -1
+        for idx in indices:
+            if idx != 0 and idx != prev:
+                decoded.append(IDX_TO_CHAR.get(idx, ''))
+            prev = idx
+        decoded_texts.append("".join(decoded))
+    return decoded_texts
+
+def synthetic_output(batch_size, steps, blank_ratio=0.6, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    labels = torch.randint(1, NUM_CLASSES, (steps, batch_size), generator=generator)
+    labels[torch.rand(steps, batch_size, generator=generator) < blank_ratio] = 0
+    logits = torch.randn(steps, batch_size, NUM_CLASSES, generator=generator)
+    logits.scatter_add_(2, labels[..., None], torch.full((steps, batch_size, 1), 8.0))
+    return logits.log_softmax(dim=2)
+
+def time_ms(fn, output, repeats):
+    fn(output)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(output)
+        times.append((time.perf_counter() - start) * 1000.0)
+    return statistics.median(times)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark greedy CTC decoding")
+    parser.add_argument('--batch-sizes', default="1,4,16,64,256,1024")
+    parser.add_argument('--steps', type=int, default=IMG_WIDTH // 4, help="Timesteps per sequence (W/4)")
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--output', default=None, help="Write the results as JSON")
+    args = parser.parse_args()
+
+    decoders = {
+        'loop': loop_decode,
+        'vectorized': decode_prediction,
+        'with_confidence': lambda output: greedy_decode(output)[0],
+    }
+    rows = []
+    print(f"Median ms over {args.repeats} runs, {args.steps} timesteps")
+    print(f"{'Batch':>6}" + "".join(f"{name:>17}" for name in decoders) + f"{'speedup':>10}")
+    for batch_size in [int(b) for b in args.batch_sizes.split(',')]:
+        output = synthetic_output(batch_size, args.steps)
+        expected = loop_decode(output)
+        for name, fn in decoders.items():
+            assert fn(output) == expected, f"{name} disagrees with the loop decoder"
+        row = {'batch_size': batch_size}
+        row.update({name: time_ms(fn, output, args.repeats) for name, fn in decoders.items()})
+        rows.append(row)
+        print(f"{batch_size:>6}" + "".join(f"{row[name]:>17.3f}" for name in decoders)
+              + f"{row['loop'] / row['vectorized']:>9.1f}x")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'steps': args.steps, 'repeats': args.repeats, 'results': rows}, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+import argparse
+import base64
+import http.client
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+# End-to-end HTTP load test for the serving stack.
+# For every (workers, threads, max batch size) configuration this starts
+# serve.py on a free local port, with NSR refinement pointed at the local
+# stub (scripts/nsr_stub_server.py), waits for /ready and then drives the
+# endpoints with closed-loop clients at each concurrency level. Requests use
+# real images from the validation set. The result cache is disabled unless
+# --cache is given, so repeated images still reach the model.
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from config import DATA_DIR, CHECKPOINT_DIR, INFERENCE_BACKEND, MAX_BATCH_WAIT_MS
+
+# Runs serve.py with config overrides applied first
+SERVER_BOOTSTRAP = """
+import runpy, sys
+sys.path.insert(0, {root!r})
+import config
+for name, value in {overrides!r}.items():
+    setattr(config, name, value)
+sys.argv = [{serve!r}] + {argv!r}
+runpy.run_path({serve!r}, run_name='__main__')
+"""
+
+def int_list(value):
+    return [int(v) for v in value.split(',') if v]
+
+def parse_mix(value):
+    """
+    "predict=0.8,predict_batch=0.2" -> [('predict', 0.8), ('predict_batch', 0.2)]
+    """
+    mix = []
+    for part in value.split(','):
+        endpoint, _, weight = part.partition('=')
+        if endpoint not in ('predict', 'predict_batch'):
+            raise argparse.ArgumentTypeError(f"Unknown endpoint '{endpoint}' in --mix")
+        mix.append((endpoint, float(weight or 1)))
+    return mix
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def load_corpus(images_dir, limit):
+    names = sorted(n for n in os.listdir(images_dir) if n.lower().endswith(('.png', '.jpg', '.jpeg')))
+    if limit:
+        names = names[:limit]
+    if not names:
+        sys.exit(f"No images found in {images_dir}")
+    corpus = []
+    for name in names:
+        with open(os.path.join(images_dir, name), 'rb') as f:
+            corpus.append(base64.b64encode(f.read()).decode('ascii'))
+    return corpus
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+class Server:
+    """
+    serve.py (and the NSR stub) as subprocesses for one configuration.
+    """
+    def __init__(self, args, workers, threads, batch_size):
+        self.port = free_port()
+        self.processes = []
+
+        env = dict(os.environ)
+        if args.no_refine:
+            env.update(NSR_ENDPOINT='', NSR_API_KEY='', GEMINI_API_KEY='')
+        else:
+            stub_port = free_port()
+            self.processes.append(subprocess.Popen(
+                [sys.executable, os.path.join(PROJECT_ROOT, 'scripts', 'nsr_stub_server.py'),
+                 '--port', str(stub_port), '--delay-ms', str(args.refine_delay_ms)],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+            env['NSR_ENDPOINT'] = f"http://127.0.0.1:{stub_port}/"
+
+        overrides = {
+            'CHECKPOINT_DIR': args.checkpoint_dir,
+            'INFERENCE_BACKEND': args.backend,
+            'MAX_BATCH_SIZE': batch_size,
+            'MAX_BATCH_WAIT_MS': args.batch_wait_ms,
+            'MODEL_WATCH_INTERVAL': 0,
+        }
+        if not args.cache:
+            overrides.update(RESULT_CACHE_SIZE=0, RESULT_CACHE_PATH=None)
+        code = SERVER_BOOTSTRAP.format(
+            root=PROJECT_ROOT, overrides=overrides, serve=os.path.join(PROJECT_ROOT, 'serve.py'),
+            argv=['--host', '127.0.0.1', '--port', str(self.port),
+                  '--workers', str(workers), '--threads', str(threads)],
+        )
+        self.log = open(os.path.join(args.log_dir, f"server_w{workers}_t{threads}_b{batch_size}.log"), 'w')
+        self.processes.append(subprocess.Popen([sys.executable, '-c', code], env=env,
+                                               stdout=self.log, stderr=subprocess.STDOUT))
+
+    def wait_ready(self, timeout=120):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.processes[-1].poll() is not None:
+                raise RuntimeError(f"Server exited early, see {self.log.name}")
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=2)
+                conn.request('GET', '/ready')
+                if conn.getresponse().status == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.25)
+        raise TimeoutError(f"Server not ready after {timeout}s, see {self.log.name}")
+
+    def stop(self):
+        for process in reversed(self.processes):
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.log.close()
+
+def run_load(port, corpus, concurrency, duration, warmup, mix, batch_images, seed):
+    """
+    Closed loop: each client sends its next request as soon as the previous
+    one returns. Only requests started after the warm-up period are recorded.
+    """
+    endpoints = [endpoint for endpoint, _ in mix]
+    weights = [weight for _, weight in mix]
+    start = time.perf_counter()
+    measure_from = start + warmup
+    stop_at = measure_from + duration
+    records = []
+    lock = threading.Lock()
+
+    def client(index):
+        rng = random.Random(seed + index)
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        local = []
+        while True:
+            sent = time.perf_counter()
+            if sent >= stop_at:
+                break
+            endpoint = rng.choices(endpoints, weights)[0]
+            if endpoint == 'predict':
+                body = {'image': rng.choice(corpus)}
+                images = 1
+            else:
+                body = {'images': [rng.choice(corpus) for _ in range(batch_images)]}
+                images = batch_images
+            try:
+                conn.request('POST', '/' + endpoint, body=json.dumps(body).encode(),
+                             headers={'Content-Type': 'application/json'})
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                ok = False
+            done = time.perf_counter()
+            if sent >= measure_from:
+                local.append((endpoint, images, (done - sent) * 1000.0, ok))
+        conn.close()
+        with lock:
+            records.extend(local)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - measure_from
+
+    latencies = [r[2] for r in records if r[3]]
+    result = {
+        'concurrency': concurrency,
+        'requests': len(records),
+        'errors': sum(1 for r in records if not r[3]),
+        'duration_s': elapsed,
+        'throughput_rps': len(latencies) / elapsed,
+        'throughput_images_s': sum(r[1] for r in records if r[3]) / elapsed,
+        'latency_ms': {
+            'mean': float(np.mean(latencies)) if latencies else None,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+        },
+        'by_endpoint': {},
+    }
+    for endpoint in endpoints:
+        values = [r[2] for r in records if r[0] == endpoint and r[3]]
+        result['by_endpoint'][endpoint] = {
+            'requests': len(values),
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+        }
+    return result
+
+def plot_results(results, path):
+    """
+    Latency percentiles and throughput against concurrency, one line per
+    serving configuration.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from plot_metrics import BG_COLOR, ACCENT_COLOR, SUCCESS_COLOR, WARNING_COLOR, ERROR_COLOR
+
+    colors = [ACCENT_COLOR, SUCCESS_COLOR, WARNING_COLOR, ERROR_COLOR, '#BC8CFF', '#39C5CF', '#F778BA']
+    fig, (ax_latency, ax_throughput) = plt.subplots(1, 2, figsize=(16, 7), facecolor=BG_COLOR)
+    for ax in (ax_latency, ax_throughput):
+        ax.set_facecolor(BG_COLOR)
+        ax.grid(True, linestyle='--', alpha=0.1)
+        ax.set_xlabel('Concurrent clients', fontsize=12, fontweight='bold')
+
+    for color, config in zip(itertools.cycle(colors), results['configs']):
+        points = config['points']
+        label = f"{config['workers']}w x {config['threads']}t, batch {config['max_batch_size']}"
+        x = [p['concurrency'] for p in points]
+        ax_latency.plot(x, [p['latency_ms']['p50'] for p in points], 'o-', color=color, linewidth=2, label=f"{label} p50")
+        ax_latency.plot(x, [p['latency_ms']['p99'] for p in points], 's--', color=color, linewidth=1, alpha=0.7, label=f"{label} p99")
+        ax_throughput.plot(x, [p['throughput_images_s'] for p in points], 'o-', color=color, linewidth=2, label=label)
+
+    ax_latency.set_ylabel('Request latency (ms)', fontsize=12, fontweight='bold')
+    ax_latency.set_title('Latency (p50 solid, p99 dashed)', fontsize=14, fontweight='bold')
+    ax_throughput.set_ylabel('Images / second', fontsize=12, fontweight='bold')
+    ax_throughput.set_title('Throughput', fontsize=14, fontweight='bold')
+    ax_latency.legend(frameon=False, fontsize=8)
+    ax_throughput.legend(frameon=False, fontsize=8)
+    fig.suptitle(f"Measured HTTP serving performance ({results['backend']} backend, {results['cpu_count']} CPUs)",
+                 fontsize=16, fontweight='bold')
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    plt.savefig(path, dpi=150, bbox_inches='tight', facecolor=BG_COLOR)
+    plt.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP load test across serving configurations")
+    parser.add_argument('--workers', type=int_list, default=[1], help="Comma-separated serve.py worker counts")
+    parser.add_argument('--threads', type=int_list, default=[1], help="Comma-separated PyTorch threads per worker")
+    parser.add_argument('--batch-sizes', type=int_list, default=[1, 16], help="Comma-separated MAX_BATCH_SIZE values")
+    parser.add_argument('--concurrency', type=int_list, default=[1, 4, 16], help="Comma-separated client counts")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('predict=1'),
+                        help="Request mix, e.g. predict=0.8,predict_batch=0.2")
+    parser.add_argument('--batch-images', type=int, default=8, help="Images per /predict_batch request")
+    parser.add_argument('--duration', type=float, default=10.0, help="Measured seconds per point")
+    parser.add_argument('--warmup', type=float, default=2.0, help="Unmeasured seconds before each point")
+    parser.add_argument('--images-dir', default=os.path.join(DATA_DIR, 'val'))
+    parser.add_argument('--max-images', type=int, default=0, help="0 uses every image in --images-dir")
+    parser.add_argument('--checkpoint-dir', default=CHECKPOINT_DIR)
+    parser.add_argument('--backend', default=INFERENCE_BACKEND)
+    parser.add_argument('--batch-wait-ms', type=float, default=MAX_BATCH_WAIT_MS)
+    parser.add_argument('--refine-delay-ms', type=float, default=0, help="Latency of the NSR stub")
+    parser.add_argument('--no-refine', action='store_true', help="Disable refinement instead of stubbing it")
+    parser.add_argument('--cache', action='store_true', help="Keep the result cache enabled")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--log-dir', default=os.path.join(PROJECT_ROOT, 'logs', 'benchmark'))
+    parser.add_argument('--output', default=os.path.join(PROJECT_ROOT, 'assets', 'latency_benchmark.json'))
+    parser.add_argument('--plot', default=os.path.join(PROJECT_ROOT, 'assets', 'latency_benchmark.png'))
+    args = parser.parse_args()
+
+    os.makedirs(args.log_dir, exist_ok=True)
+    corpus = load_corpus(args.images_dir, args.max_images)
+    print(f"Loaded {len(corpus)} images from {args.images_dir}")
+
+    results = {
+        'backend': args.backend,
+        'cpu_count': os.cpu_count(),
+        'mix': dict(args.mix),
+        'batch_images': args.batch_images,
+        'duration_s': args.duration,
+        'refinement': 'disabled' if args.no_refine else f"stub ({args.refine_delay_ms:g} ms)",
+        'cache': args.cache,
+        'configs': [],
+    }
+
+    print(f"{'workers':>7} {'threads':>7} {'batch':>5} {'clients':>7} {'req/s':>8} {'img/s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    for workers, threads, batch_size in itertools.product(args.workers, args.threads, args.batch_sizes):
+        server = Server(args, workers, threads, batch_size)
+        try:
+            server.wait_ready()
+            points = []
+            for concurrency in args.concurrency:
+                point = run_load(server.port, corpus, concurrency, args.duration, args.warmup,
+                                 args.mix, args.batch_images, args.seed)
+                points.append(point)
+                latency = point['latency_ms']
+                print(f"{workers:>7} {threads:>7} {batch_size:>5} {concurrency:>7} "
+                      f"{point['throughput_rps']:>8.1f} {point['throughput_images_s']:>8.1f} "
+                      f"{latency['p50'] or 0:>8.1f} {latency['p95'] or 0:>8.1f} {latency['p99'] or 0:>8.1f} "
+                      f"{point['errors']:>6}")
+        finally:
+            server.stop()
+        results['configs'].append({
+            'workers': workers,
+            'threads': threads,
+            'max_batch_size': batch_size,
+            'points': points,
+        })
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved results to {args.output}")
+    if args.plot:
+        plot_results(results, args.plot)
+        print(f"Saved plot to {args.plot}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Cold-start benchmark for the serving app.
+# Every run is a fresh interpreter, so import and page-cache effects of the
+# previous run do not leak into the import timings. Reports how long until
+# /healthz answers (process is live) and until the model is ready, with the
+# import / load / backend / warm-up breakdown recorded by app.py.
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+import config
+if {checkpoint_dir!r}:
+    config.CHECKPOINT_DIR = {checkpoint_dir!r}
+config.CHECKPOINT_MMAP = {mmap!r}
+import app
+app_import = (time.perf_counter() - start) * 1000.0
+client = app.app.test_client()
+assert client.get('/healthz').status_code == 200
+healthz = (time.perf_counter() - start) * 1000.0
+app.start_loading(background=False)
+ready = (time.perf_counter() - start) * 1000.0
+print(json.dumps({{'app_import': app_import, 'healthz': healthz, 'ready': ready, **app.serving.timings_ms}}))
+"""
+
+def run_once(checkpoint_dir, mmap):
+    code = CHILD.format(root=PROJECT_ROOT, checkpoint_dir=checkpoint_dir, mmap=mmap)
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    wall = (time.perf_counter() - start) * 1000.0
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings['process_wall'] = wall
+    return timings
+
+def summarize(runs):
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure serving cold-start time")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--checkpoint-dir', default=None, help="Overrides CHECKPOINT_DIR from config.py")
+    parser.add_argument('--compare-mmap', action='store_true',
+                        help="Also measure with CHECKPOINT_MMAP disabled")
+    parser.add_argument('--output', default=None, help="Write the results as JSON")
+    args = parser.parse_args()
+
+    modes = [True, False] if args.compare_mmap else [True]
+    results = {}
+    for mmap in modes:
+        label = 'mmap' if mmap else 'no_mmap'
+        runs = [run_once(args.checkpoint_dir, mmap) for _ in range(args.runs)]
+        results[label] = {'median_ms': summarize(runs), 'runs': runs}
+
+    phases = ['app_import', 'healthz', 'import', 'load', 'backend', 'warmup', 'ready', 'process_wall']
+    print(f"Median over {args.runs} runs (ms since the child started, except the loader phases)")
+    print(f"{'Phase':<14}" + "".join(f"{label:>12}" for label in results))
+    for phase in phases:
+        print(f"{phase:<14}" + "".join(f"{r['median_ms'][phase]:>12.1f}" for r in results.values()))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'runs_per_mode': args.runs, 'results': results}, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+
+from config import *
+from src.backends import load_backend
+from src.dataset import BucketBatchSampler, collate_fn
+from src.model import build_model, load_model
+from src.train import make_dataset, validate
+
+# Size, CPU latency and accuracy of each model tier (config.MODEL_TIERS), to
+# pick a tier per endpoint. Tiers are scored on the validation manifest from
+# their checkpoints (--checkpoint small=checkpoints/small/best_model.pth);
+# tiers without one get size and latency only.
+
+def latency_ms(forward, batch_size, width, iterations):
+    """
+    (p50, p95) wall-clock milliseconds of one forward pass.
+    """
+    images = torch.rand(batch_size, 1, IMG_HEIGHT, width)
+    timings = []
+    with torch.inference_mode():
+        for _ in range(5):
+            forward(images)
+        for _ in range(iterations):
+            start = time.perf_counter()
+            forward(images)
+            timings.append((time.perf_counter() - start) * 1000.0)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare model tiers: parameters, CPU latency and CER")
+    parser.add_argument('--tiers', nargs='+', default=list(MODEL_TIERS), choices=list(MODEL_TIERS))
+    parser.add_argument('--checkpoint', nargs='*', default=[], metavar="TIER=PATH",
+                        help="Trained weights per tier, e.g. base=checkpoints/best_model.pth")
+    parser.add_argument('--backend', default='eager', choices=('eager', 'scripted', 'compiled'))
+    parser.add_argument('--widths', type=int, nargs='+', default=[IMG_WIDTH, WIDTH_BUCKETS[-1]],
+                        help="Line widths (pixels) to time single-image latency at")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Batch size for throughput")
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=None, help="Intra-op threads (default: torch's)")
+    parser.add_argument('--output', default=None, help="Write the results as JSON")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    checkpoints = dict(entry.split("=", 1) for entry in args.checkpoint)
+    unknown = set(checkpoints) - set(MODEL_TIERS)
+    if unknown:
+        parser.error(f"unknown tier(s) in --checkpoint: {', '.join(sorted(unknown))}")
+
+    val_loader = None
+    if checkpoints:
+        val_dataset = make_dataset(os.path.join(DATA_DIR, "val_manifest.txt"))
+        val_sampler = BucketBatchSampler(val_dataset.widths(), BATCH_SIZE, shuffle=False)
+        val_loader = DataLoader(val_dataset, batch_sampler=val_sampler, collate_fn=collate_fn)
+    criterion = nn.CTCLoss(blank=0, zero_infinity=True)
+
+    results = {}
+    no_artifacts = tempfile.mkdtemp()
+    for tier in args.tiers:
+        # Backend artifacts are looked up next to each checkpoint; untrained
+        # tiers are scripted / compiled in-process
+        if tier in checkpoints:
+            model = load_model(checkpoints[tier], device='cpu', tier=tier)
+            forward = load_backend(args.backend, model, artifact_dir=os.path.dirname(checkpoints[tier]))
+        else:
+            model = build_model(tier).eval()
+            forward = load_backend(args.backend, model, artifact_dir=no_artifacts)
+        result = {
+            'architecture': MODEL_TIERS[tier],
+            'parameters': sum(p.numel() for p in model.parameters()),
+            'latency_ms': {},
+        }
+        for width in args.widths:
+            p50, p95 = latency_ms(forward, 1, width, args.iterations)
+            result['latency_ms'][str(width)] = {'p50': p50, 'p95': p95}
+        p50, _ = latency_ms(forward, args.batch_size, IMG_WIDTH, max(5, args.iterations // 5))
+        result['lines_per_sec'] = args.batch_size / (p50 / 1000.0)
+        if tier in checkpoints:
+            result['val_loss'], result['cer'] = validate(model, val_loader, criterion, channels_last=False)
+        results[tier] = result
+        print(f"{tier}: {result['parameters']:,} parameters, "
+              + ", ".join(f"{width}px {r['p50']:.2f} ms" for width, r in result['latency_ms'].items())
+              + (f", CER {result['cer']:.4f}" if 'cer' in result else ""))
+
+    # Markdown table, as published in the README
+    widths = [str(width) for width in args.widths]
+    print(f"\n{args.backend} backend, {torch.get_num_threads()} thread(s), batch 1 latency p50 / p95")
+    print("| Tier | Parameters | " + " | ".join(f"Latency @{width}px (ms)" for width in widths)
+          + f" | Lines/s (batch {args.batch_size}) | CER |")
+    print("|---|---:|" + "---:|" * len(widths) + "---:|---:|")
+    for tier, result in results.items():
+        latencies = " | ".join(f"{result['latency_ms'][w]['p50']:.2f} / {result['latency_ms'][w]['p95']:.2f}"
+                               for w in widths)
+        cer = f"{result['cer']:.4f}" if 'cer' in result else "-"
+        print(f"| {tier} | {result['parameters'] / 1e6:.2f}M | {latencies} | {result['lines_per_sec']:.0f} | {cer} |")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'backend': args.backend, 'threads': torch.get_num_threads(), 'results': results}, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import DataLoader
+
+from config import *
+from config import DEVICE
+from src.dataset import BucketBatchSampler, collate_fn
+from src.model import build_model
+from src.train import make_dataset, train_epoch, validate
+
+# Training throughput and accuracy per precision mode: the same model, data
+# order and seed trained in fp32, bf16 autocast, and either with the CNN in
+# channels_last. Reports training samples/s and the validation CER reached.
+
+MODES = {
+    'fp32': ('fp32', False),
+    'fp32+channels_last': ('fp32', True),
+    'bf16': ('bf16', False),
+    'bf16+channels_last': ('bf16', True),
+}
+
+def run(mode, train_dataset, val_loader, args):
+    precision, channels_last = MODES[mode]
+    torch.manual_seed(0)
+    model = build_model().to(DEVICE)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    criterion = nn.CTCLoss(blank=0, zero_infinity=True)
+    optimizer = optim.Adam(model.parameters(), lr=LEARNING_RATE)
+
+    samples = seconds = skipped = 0
+    for epoch in range(args.epochs):
+        sampler = BucketBatchSampler(train_dataset.widths(), args.batch_size, shuffle=True)
+        sampler.set_epoch(epoch)
+        loader = DataLoader(train_dataset, batch_sampler=sampler, collate_fn=collate_fn)
+        batches = itertools.islice(loader, args.steps) if args.steps else loader
+        stats = train_epoch(model, batches, criterion, optimizer, desc=f"{mode} {epoch + 1}/{args.epochs}",
+                            precision=precision, channels_last=channels_last, accum_steps=args.accum_steps)
+        samples += stats['samples']
+        seconds += stats['seconds']
+        skipped += stats['skipped']
+    val_loss, cer = validate(model, val_loader, criterion, channels_last=channels_last)
+    return {'samples_per_sec': samples / seconds, 'val_loss': val_loss, 'cer': cer, 'skipped_batches': skipped}
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare training throughput and CER across precision modes")
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    parser.add_argument('--epochs', type=int, default=1)
+    parser.add_argument('--steps', type=int, default=0, help="Batches per epoch (0: the whole training set)")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--accum-steps', type=int, default=GRAD_ACCUM_STEPS)
+    parser.add_argument('--output', default=None, help="Write the results as JSON")
+    args = parser.parse_args()
+
+    if DEVICE.type == "cpu" and not torch.ops.mkldnn._is_mkldnn_bf16_supported():
+        print("Warning: this CPU has no native bf16 support; bf16 will be emulated and slow")
+    train_dataset = make_dataset(os.path.join(DATA_DIR, "train_manifest.txt"))
+    val_dataset = make_dataset(os.path.join(DATA_DIR, "val_manifest.txt"))
+    val_sampler = BucketBatchSampler(val_dataset.widths(), BATCH_SIZE, shuffle=False)
+    val_loader = DataLoader(val_dataset, batch_sampler=val_sampler, collate_fn=collate_fn)
+
+    results = {mode: run(mode, train_dataset, val_loader, args) for mode in args.modes}
+
+    baseline = results.get('fp32')
+    print(f"\nBatch size {args.batch_size} x {args.accum_steps} accumulation steps, {args.epochs} epoch(s)")
+    print(f"{'Mode':<22}{'samples/s':>11}{'speedup':>9}{'val loss':>10}{'CER':>8}{'CER vs fp32':>13}")
+    for mode, result in results.items():
+        speedup = f"{result['samples_per_sec'] / baseline['samples_per_sec']:.2f}x" if baseline else "-"
+        delta = f"{result['cer'] - baseline['cer']:+.4f}" if baseline else "-"
+        print(f"{mode:<22}{result['samples_per_sec']:>11.1f}{speedup:>9}{result['val_loss']:>10.4f}"
+              f"{result['cer']:>8.4f}{delta:>13}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'epochs': args.epochs, 'batch_size': args.batch_size, 'accum_steps': args.accum_steps,
+                       'results': results}, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the NSR refinement service.
+# Point the app at it with NSR_ENDPOINT=http://localhost:8765/ to exercise
+# deadlines and the circuit breaker without an external API.
+
+def make_handler(delay_ms, fail_rate, suffix):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'{}')
+
+            if delay_ms:
+                time.sleep(delay_ms / 1000.0)
+
+            if random.random() < fail_rate:
+                body = b'{"error": "stub failure"}'
+                self.send_response(500)
+            else:
+                body = json.dumps({'text': payload.get('prediction', '') + suffix}).encode()
+                self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub NSR refinement server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--delay-ms', type=float, default=0, help="Artificial latency per request")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument('--suffix', default='', help="Appended to the prediction so refinement is visible")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args.delay_ms, args.fail_rate, args.suffix))
+    print(f"NSR stub listening on http://{args.host}:{args.port}/")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from torch.utils.data import DataLoader
+
+from config import *
+from src.dataset import HandwritingDataset, PackedHandwritingDataset, BucketBatchSampler, collate_fn
+from src.train import load_manifest
+
+# Packs manifests into the memory-mapped cache that training reads
+# (DATA_DIR/cache/<manifest name>.*). Training also packs on demand; run this
+# ahead of time, or with --benchmark to compare loading speed with the PNGs.
+
+def images_per_sec(dataset, batch_size, workers):
+    sampler = BucketBatchSampler(dataset.widths(), batch_size, shuffle=True)
+    loader = DataLoader(dataset, batch_sampler=sampler, collate_fn=collate_fn, num_workers=workers)
+    start = time.perf_counter()
+    for _ in loader:
+        pass
+    return len(dataset) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack manifests into the memory-mapped dataset cache")
+    parser.add_argument('--manifest', nargs='+', default=[os.path.join(DATA_DIR, "train_manifest.txt"),
+                                                          os.path.join(DATA_DIR, "val_manifest.txt")])
+    parser.add_argument('--cache-dir', default=os.path.join(DATA_DIR, "cache"))
+    parser.add_argument('--benchmark', action='store_true', help="Time one epoch of loading, PNGs vs cache")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=0, help="DataLoader workers for --benchmark")
+    args = parser.parse_args()
+
+    for manifest in args.manifest:
+        image_paths, labels = load_manifest(manifest)
+        cache_path = os.path.join(args.cache_dir, os.path.splitext(os.path.basename(manifest))[0])
+        start = time.perf_counter()
+        packed = PackedHandwritingDataset.open(image_paths, labels, cache_path)
+        size_mb = os.path.getsize(cache_path + ".images.u8") / 1e6
+        print(f"{manifest}: {len(packed)} images, {size_mb:.1f} MB at {cache_path} "
+              f"(ready in {time.perf_counter() - start:.2f}s)")
+
+        if args.benchmark:
+            png = images_per_sec(HandwritingDataset(image_paths, labels), args.batch_size, args.workers)
+            cached = images_per_sec(packed, args.batch_size, args.workers)
+            print(f"  loading: {png:.0f} img/s from PNGs, {cached:.0f} img/s from the cache ({cached / png:.1f}x)")
+
+if __name__ == "__main__":
+    main()
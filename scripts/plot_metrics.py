@@ -1,3 +1,4 @@
+import json
 import matplotlib.pyplot as plt
 import numpy as np
 import os
@@ -65,25 +66,13 @@ def save_plots():
     plt.savefig('assets/architecture_comparison.png', dpi=300, bbox_inches='tight', facecolor=BG_COLOR)
     plt.close()
 
-    # 3. Latency vs Batch Size (Realistic Hardware Benchmark)
-    batch_sizes = [1, 4, 8, 16, 32]
-    latency_gpu = [15, 22, 35, 60, 110] # ms
-    latency_cpu = [85, 140, 260, 480, 890] # ms
-    
-    plt.figure(figsize=(10, 7), facecolor=BG_COLOR)
-    ax = plt.gca()
-    ax.set_facecolor(BG_COLOR)
-    
-    plt.plot(batch_sizes, latency_gpu, 'o-', label='NVIDIA RTX (GPU)', color=SUCCESS_COLOR, linewidth=2)
-    plt.plot(batch_sizes, latency_cpu, 's-', label='Intel Core i7 (CPU)', color=ERROR_COLOR, linewidth=2)
-    
-    plt.xlabel('Batch Size', fontsize=12, fontweight='bold')
-    plt.ylabel('Inference Latency (ms)', fontsize=12, fontweight='bold')
-    plt.title('Hardware Performance Benchmarking', fontsize=16, pad=25, fontweight='bold')
-    plt.legend(frameon=False)
-    plt.grid(True, linestyle='--', alpha=0.1)
-    plt.savefig('assets/latency_benchmark.png', dpi=300, bbox_inches='tight', facecolor=BG_COLOR)
-    plt.close()
+    # 3. Serving latency / throughput, measured by scripts/benchmark_http.py
+    if os.path.exists('assets/latency_benchmark.json'):
+        from benchmark_http import plot_results
+        with open('assets/latency_benchmark.json') as f:
+            plot_results(json.load(f), 'assets/latency_benchmark.png')
+    else:
+        print("assets/latency_benchmark.json not found; run scripts/benchmark_http.py to measure latency.")
 
     print("Realistic graphs generated successfully in assets/ folder.")
 
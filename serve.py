@@ -0,0 +1,165 @@
+import argparse
+import os
+import signal
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+import torch
+
+# Production serving entry point.
+# The master process loads HandwritingModel once, moves its parameters into
+# shared memory and then forks worker processes that all accept connections
+# on the same listening socket. Each worker runs its own threaded WSGI server
+# (so micro-batching still applies inside a worker) with a fixed number of
+# intra-op threads to avoid oversubscribing the cores.
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def parse_args():
+    cores = available_cores()
+    parser = argparse.ArgumentParser(description="Pre-forked multi-process server for the handwriting model")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--workers', type=int, default=cores,
+                        help=f"Number of worker processes (default: {cores}, one per available core)")
+    parser.add_argument('--threads', type=int, default=None,
+                        help="Intra-op threads per worker (default: cores // workers, at least 1)")
+    parser.add_argument('--backlog', type=int, default=2048, help="Listen backlog of the shared socket")
+    args = parser.parse_args()
+    if args.threads is None:
+        args.threads = max(1, cores // args.workers)
+    return args
+
+def bind_socket(host, port, backlog):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+def run_worker(flask_app, sock, host, port, threads, metrics_dir):
+    from werkzeug.serving import make_server
+    from src.metrics import REGISTRY
+    from app import start_watcher
+
+    # Restore default signal handling inherited from the master
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+    # /metrics in any worker reports totals across all workers
+    REGISTRY.enable_multiprocess(metrics_dir)
+
+    # Each worker picks up newly published model versions on its own
+    start_watcher()
+
+    server = make_server(host, port, flask_app, threaded=True, fd=sock.fileno())
+    server.serve_forever()
+
+def spawn_worker(flask_app, sock, args, metrics_dir):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(flask_app, sock, args.host, args.port, args.threads, metrics_dir)
+        except Exception as e:
+            print(f"[worker {os.getpid()}] crashed: {e}", file=sys.stderr)
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+def main():
+    args = parse_args()
+
+    # Keep the master single-threaded while loading so no OpenMP thread pool
+    # exists at fork time; every worker sets its own thread count afterwards.
+    torch.set_num_threads(1)
+
+    import app as server_app
+    from config import DEVICE
+    from src.metrics import REGISTRY
+
+    if DEVICE.type != 'cpu':
+        sys.exit("serve.py shares weights across forked processes and only supports CPU inference.")
+
+    # Load and warm up once in the master so every worker starts ready
+    server_app.start_loading(background=False)
+
+    # Shared, read-only weights: forked workers map the same pages instead of
+    # each holding a private copy. Versions hot-reloaded later by a worker's
+    # watcher are loaded in that worker and are not shared.
+    active = server_app.serving.active
+    active.model.share_memory()
+    if isinstance(active.inference_model, torch.nn.Module):
+        active.inference_model.share_memory()
+
+    if args.workers > 1:
+        # Streaming sessions and SSE subscribers are per-process dicts
+        print(f"Warning: /stream sessions are kept per worker and are not shared across "
+              f"{args.workers} workers; use --workers 1 for live streaming recognition.", file=sys.stderr)
+
+    sock = bind_socket(args.host, args.port, args.backlog)
+    metrics_dir = tempfile.mkdtemp(prefix="ann-metrics-")
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} workers x {args.threads} threads")
+
+    workers = {}
+    for _ in range(args.workers):
+        pid = spawn_worker(server_app.app, sock, args, metrics_dir)
+        workers[pid] = time.monotonic()
+
+    stopping = False
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = workers.pop(pid, None)
+        if started is None:
+            continue
+        # Keep the dead worker's counters and histograms in the totals, but
+        # drop its gauges so values such as in-flight stay correct
+        REGISTRY.retire(metrics_dir, pid)
+        if stopping:
+            continue
+
+        print(f"Worker {pid} exited with status {status}; restarting", file=sys.stderr)
+        # Avoid a tight crash loop if workers die right after starting
+        if time.monotonic() - started < 1.0:
+            time.sleep(1.0)
+        new_pid = spawn_worker(server_app.app, sock, args, metrics_dir)
+        workers[new_pid] = time.monotonic()
+
+    sock.close()
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import math
+
+import torch
+import torch.nn.functional as F
+
+# Training-time augmentation on whole batches. Runs after collate_fn on the
+# padded (B, 1, H, W) float batch (ink high, background 0), on whatever
+# device the batch is on, so it costs a handful of tensor ops per batch
+# instead of Python/OpenCV work per sample:
+#
+#   affine     rotation, slant (horizontal shear), scale, vertical shift
+#   elastic    smooth random displacement field
+#   morphology thicker or thinner strokes (blend towards a 3x3 dilation/erosion)
+#   blur       Gaussian blur with a per-sample sigma
+#   noise      additive Gaussian noise
+#
+# Each sample draws its own parameters and whether each op applies to it.
+# Geometric ops are centred on each sample's own content, not the padded
+# canvas, and the right padding (past each sample's true width, when the
+# widths are given) is blanked again at the end so CTC input lengths stay
+# valid. Ink warped into a sample's own right margin is kept, so the last
+# glyph is never cut off while the label still has it. Affine and elastic
+# share a single grid_sample.
+
+class BatchAugmenter:
+    """
+    Callable batch augmentation: augmenter(images) -> augmented images.
+    All randomness comes from the augmenter's own generator, so a given
+    seed reproduces the same augmentations (state_dict() / load_state_dict()
+    carry it across a resumed run). seed=None seeds from the OS.
+    """
+    def __init__(self, seed=None, affine_prob=0.5, rotate=2.0, slant=0.35, scale=0.1, shift=0.06,
+                 elastic_prob=0.3, elastic_alpha=1.5, elastic_cell=8, morph_prob=0.3, blur_prob=0.2,
+                 blur_sigma=(0.4, 1.0), noise_prob=0.3, noise_std=(0.02, 0.08)):
+        self.generator = torch.Generator()
+        if seed is None:
+            self.generator.seed()
+        else:
+            self.generator.manual_seed(seed)
+        self.affine_prob = affine_prob
+        self.rotate = rotate  # degrees, +/-
+        self.slant = slant  # horizontal shear per unit of height, +/-
+        self.scale = scale  # relative, +/-
+        self.shift = shift  # vertical shift as a fraction of the height, +/-
+        self.elastic_prob = elastic_prob
+        self.elastic_alpha = elastic_alpha  # displacement std in pixels
+        self.elastic_cell = elastic_cell  # pixels between displacement control points
+        self.morph_prob = morph_prob
+        self.blur_prob = blur_prob
+        self.blur_sigma = blur_sigma
+        self.noise_prob = noise_prob
+        self.noise_std = noise_std
+
+    def state_dict(self):
+        return {'generator': self.generator.get_state()}
+
+    def load_state_dict(self, state):
+        self.generator.set_state(state['generator'])
+
+    def _uniform(self, n, low, high):
+        return torch.rand(n, generator=self.generator) * (high - low) + low
+
+    def _chosen(self, n, prob):
+        return torch.rand(n, generator=self.generator) < prob
+
+    def __call__(self, images, widths=None):
+        """
+        `widths` are the samples' unpadded widths in pixels; output columns
+        past them are blanked. Without them nothing is blanked.
+        """
+        batch, _, height, width = images.shape
+        device = images.device
+        # Content width of each sample: up to its last non-blank column
+        columns = torch.arange(1, width + 1, device=device)
+        extent = ((images.amax(dim=(1, 2)) > 0) * columns).amax(dim=1).clamp(min=1)
+
+        grid = self._grid(batch, height, width, extent.cpu().float())
+        if grid is not None:
+            images = F.grid_sample(images, grid.to(device), mode='bilinear', padding_mode='zeros', align_corners=False)
+        images = self._morphology(images)
+        images = self._blur(images)
+        images = self._noise(images)
+
+        images = images.clamp_(0.0, 1.0)
+        if widths is None:
+            return images
+        keep = (columns[None, :] <= torch.as_tensor(widths, device=device)[:, None]).to(images.dtype)
+        return images * keep[:, None, None, :]
+
+    def _grid(self, batch, height, width, extent):
+        """
+        (B, H, W, 2) sampling grid for the affine and elastic warps, or None
+        if no sample gets either.
+        """
+        affine = self._chosen(batch, self.affine_prob)
+        elastic = self._chosen(batch, self.elastic_prob)
+        if not (affine.any() or elastic.any()):
+            return None
+
+        # Output pixel -> input pixel map, around each sample's content centre
+        angle = torch.deg2rad(self._uniform(batch, -self.rotate, self.rotate)) * affine
+        slant = self._uniform(batch, -self.slant, self.slant) * affine
+        scale = 1.0 + self._uniform(batch, -self.scale, self.scale) * affine
+        shift = self._uniform(batch, -self.shift, self.shift) * height * affine
+        cos, sin = torch.cos(angle), torch.sin(angle)
+        linear = torch.stack([
+            torch.stack([cos / scale, cos * slant - sin / scale], dim=1),
+            torch.stack([sin / scale, sin * slant + cos / scale], dim=1),
+        ], dim=1)  # rotation @ [[1/s, slant], [0, 1/s]]
+        centre = torch.stack([extent / 2, torch.full_like(extent, height / 2)], dim=1)
+        offset = centre - (linear @ centre[:, :, None])[:, :, 0] + torch.stack([torch.zeros_like(shift), shift], dim=1)
+
+        # Pixel coordinates -> grid_sample's [-1, 1] coordinates (align_corners=False)
+        to_unit = torch.tensor([[2.0 / width, 0.0, -1.0], [0.0, 2.0 / height, -1.0], [0.0, 0.0, 1.0]])
+        pixel_map = torch.zeros(batch, 3, 3)
+        pixel_map[:, :2, :2] = linear
+        pixel_map[:, :2, 2] = offset
+        pixel_map[:, 2, 2] = 1.0
+        theta = (to_unit @ pixel_map @ torch.linalg.inv(to_unit))[:, :2]
+        grid = F.affine_grid(theta, (batch, 1, height, width), align_corners=False)
+
+        if elastic.any():
+            cells = (max(2, math.ceil(height / self.elastic_cell) + 1), max(2, math.ceil(width / self.elastic_cell) + 1))
+            field = torch.randn((batch, 2) + cells, generator=self.generator) * self.elastic_alpha
+            field = field * elastic[:, None, None, None]
+            field = F.interpolate(field, size=(height, width), mode='bicubic', align_corners=True)
+            # Pixels -> grid units
+            field = field * torch.tensor([2.0 / width, 2.0 / height])[None, :, None, None]
+            grid = grid + field.permute(0, 2, 3, 1)
+        return grid
+
+    def _morphology(self, images):
+        chosen = self._chosen(images.size(0), self.morph_prob).nonzero().squeeze(1)
+        if chosen.numel() == 0:
+            return images
+        subset = images[chosen]
+        # Half get thicker strokes, half thinner, by a random fraction of one pixel
+        thicker = self._chosen(chosen.numel(), 0.5).to(images.device)
+        amount = self._uniform(chosen.numel(), 0.3, 1.0).to(images.device)[:, None, None, None]
+        dilated = F.max_pool2d(subset, 3, stride=1, padding=1)
+        eroded = -F.max_pool2d(-subset, 3, stride=1, padding=1)
+        target = torch.where(thicker[:, None, None, None], dilated, eroded)
+        images = images.clone()
+        images[chosen] = subset + amount * (target - subset)
+        return images
+
+    def _blur(self, images):
+        chosen = self._chosen(images.size(0), self.blur_prob).nonzero().squeeze(1)
+        if chosen.numel() == 0:
+            return images
+        sigma = self._uniform(chosen.numel(), *self.blur_sigma)
+        radius = math.ceil(2 * self.blur_sigma[1])
+        offsets = torch.arange(-radius, radius + 1, dtype=torch.float32)
+        kernel_1d = torch.exp(-offsets[None, :] ** 2 / (2 * sigma[:, None] ** 2))
+        kernel_1d = kernel_1d / kernel_1d.sum(dim=1, keepdim=True)
+        kernels = (kernel_1d[:, :, None] * kernel_1d[:, None, :])[:, None].to(images.device, images.dtype)
+        # One grouped convolution blurs every chosen sample with its own kernel
+        subset = images[chosen]
+        _, _, height, width = subset.shape
+        blurred = F.conv2d(subset.reshape(1, -1, height, width), kernels, padding=radius, groups=chosen.numel())
+        images = images.clone()
+        images[chosen] = blurred.reshape(subset.shape)
+        return images
+
+    def _noise(self, images):
+        chosen = self._chosen(images.size(0), self.noise_prob).nonzero().squeeze(1)
+        if chosen.numel() == 0:
+            return images
+        std = self._uniform(chosen.numel(), *self.noise_std)[:, None, None, None]
+        noise = torch.randn((chosen.numel(),) + tuple(images.shape[1:]), generator=self.generator) * std
+        images = images.clone()
+        images[chosen] = images[chosen] + noise.to(images.device, images.dtype)
+        return images
@@ -0,0 +1,130 @@
+import os
+import time
+import warnings
+
+import torch
+import torch.nn as nn
+
+from config import CHECKPOINT_DIR, IMG_HEIGHT, IMG_WIDTH, QUANTIZATION_ENGINE
+from src.model import fold_batchnorm, mask_padding
+
+BACKENDS = ('eager', 'scripted', 'compiled', 'onnxruntime', 'quantized')
+
+TORCHSCRIPT_FILE = "model_scripted.pt"
+ONNX_FILE = "model.onnx"
+QUANTIZED_FILE = "model_quantized.pt"
+
+def script_model(model):
+    """
+    Frozen TorchScript version of the model with BatchNorm folded into the convs.
+    """
+    with warnings.catch_warnings():
+        # torch.jit is deprecated upstream but remains the fastest eager-free CPU path
+        warnings.simplefilter("ignore", FutureWarning)
+        scripted = torch.jit.script(fold_batchnorm(model))
+        return torch.jit.freeze(scripted.eval())
+
+class OnnxRuntimeModel:
+    """
+    Callable wrapper around an ONNX Runtime session that takes and returns
+    torch tensors, so it can stand in for the eager model.
+    The session is created lazily per process because ORT thread pools do
+    not survive fork().
+    """
+    def __init__(self, onnx_path, num_threads=None):
+        self.onnx_path = onnx_path
+        self.num_threads = num_threads
+        self._session = None
+        self._pid = None
+
+    def _ensure_session(self):
+        if self._session is None or self._pid != os.getpid():
+            import onnxruntime as ort
+
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            options.intra_op_num_threads = self.num_threads or torch.get_num_threads()
+            options.inter_op_num_threads = 1
+            self._session = ort.InferenceSession(self.onnx_path, options, providers=['CPUExecutionProvider'])
+            self._input_name = self._session.get_inputs()[0].name
+            self._pid = os.getpid()
+        return self._session
+
+    def __call__(self, x, lengths=None):
+        session = self._ensure_session()
+        output = torch.from_numpy(session.run(None, {self._input_name: x.detach().cpu().numpy()})[0])
+        return mask_padding(output, lengths) if lengths is not None else output
+
+class MaskedLengthModel(nn.Module):
+    """
+    Adapts a single-input module (e.g. the traced int8 model) to the
+    forward(x, lengths=None) interface. Padding columns still run through the
+    LSTM, but the time steps past each length decode as blank.
+    """
+    def __init__(self, module):
+        super(MaskedLengthModel, self).__init__()
+        self.module = module
+
+    def forward(self, x, lengths=None):
+        output = self.module(x)
+        return mask_padding(output, lengths) if lengths is not None else output
+
+def load_backend(name, model, artifact_dir=CHECKPOINT_DIR):
+    """
+    Return a callable mapping a (B, 1, H, W) tensor and optional per-sample
+    lengths (see output_lengths) to CTC log-probabilities (T, B, num_classes)
+    for the requested backend:
+
+    - eager:       the PyTorch model as-is
+    - scripted:    TorchScript artifact from src/export.py, or scripted in-process
+    - compiled:    torch.compile of the BatchNorm-folded model
+    - onnxruntime: ONNX artifact from src/export.py run by ONNX Runtime
+    - quantized:   int8 TorchScript artifact from src/quantize.py (CPU only)
+    """
+    if name == 'eager':
+        return model
+    if name == 'scripted':
+        path = os.path.join(artifact_dir, TORCHSCRIPT_FILE)
+        if os.path.exists(path):
+            print(f"Loading TorchScript model from {path}")
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", FutureWarning)
+                scripted = torch.jit.load(path, map_location=next(model.parameters()).device)
+        else:
+            scripted = script_model(model)
+        # Not serializable, so applied after loading rather than at export time
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", FutureWarning)
+            return torch.jit.optimize_for_inference(scripted)
+    if name == 'compiled':
+        return torch.compile(fold_batchnorm(model), dynamic=True)
+    if name == 'onnxruntime':
+        path = os.path.join(artifact_dir, ONNX_FILE)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found. Run `python src/export.py` first.")
+        return OnnxRuntimeModel(path)
+    if name == 'quantized':
+        path = os.path.join(artifact_dir, QUANTIZED_FILE)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found. Run `python src/quantize.py` first.")
+        # Packed int8 weights are specific to the engine they were built with
+        torch.backends.quantized.engine = QUANTIZATION_ENGINE
+        print(f"Loading quantized model from {path}")
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", FutureWarning)
+            return MaskedLengthModel(torch.jit.load(path, map_location='cpu'))
+    raise ValueError(f"Unknown inference backend '{name}'. Choose from {BACKENDS}.")
+
+def warm_up(forward, batch_sizes=(1,), iterations=3, device="cpu"):
+    """
+    Run a few dummy inferences so lazy initialization (graph optimization,
+    compilation, allocator growth) happens before serving traffic.
+    Returns the elapsed time in milliseconds.
+    """
+    start = time.perf_counter()
+    with torch.no_grad():
+        for batch_size in batch_sizes:
+            dummy = torch.zeros(batch_size, 1, IMG_HEIGHT, IMG_WIDTH, device=device)
+            for _ in range(iterations):
+                forward(dummy)
+    return (time.perf_counter() - start) * 1000.0
@@ -0,0 +1,193 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+from src.dataset import bucket_width, pad_batch
+from src.metrics import STAGE_LATENCY, BATCH_SIZES, QUEUE_DEPTH, ERRORS
+from src.model import output_lengths
+from src.utils import greedy_decode
+
+def bucket_batches(tensors, max_batch_size=None):
+    """
+    Group (1, 1, H, W_i) tensors by width bucket, one forward pass each
+    (split further into chunks of `max_batch_size` if given).
+    Yields (positions, padded batch, CTC lengths).
+    """
+    groups = {}
+    for position, tensor in enumerate(tensors):
+        groups.setdefault(bucket_width(tensor.size(3)), []).append(position)
+    for group in groups.values():
+        step = max_batch_size or len(group)
+        for start in range(0, len(group), step):
+            positions = group[start:start + step]
+            images, widths = pad_batch([tensors[p][0] for p in positions])
+            yield positions, images, output_lengths(widths)
+
+class BatchScheduler:
+    """
+    Dynamic micro-batching for the serving path.
+    Concurrent requests are collected into batches of up to `max_batch_size`
+    images, with one forward pass per width bucket. The first request in a
+    batch waits at most `max_wait_ms` for others to join, which bounds the
+    added latency. Each request names one of `decoders` (name -> callable
+    like greedy_decode) to turn its output into text.
+    """
+    def __init__(self, model, max_batch_size=16, max_wait_ms=5, decoders=None):
+        self.model = model
+        self.decoders = decoders or {'greedy': greedy_decode}
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pid = None
+        self._closed = False
+
+    def submit(self, input_tensor, decoder='greedy'):
+        """
+        Queue a (1, 1, H, W) tensor for inference.
+        Returns a Future that resolves to {"text", "confidence",
+        "char_confidences"} (see greedy_decode).
+        """
+        if decoder not in self.decoders:
+            raise ValueError(f"Unknown decoder '{decoder}'")
+        self._ensure_worker()
+        future = Future()
+        item = (input_tensor, future, time.perf_counter(), decoder)
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                QUEUE_DEPTH.inc()
+                self._queue.put(item)
+        if closed:
+            # Retired by a model swap: run stragglers directly on this model
+            self._process([item])
+        return future
+
+    def close(self):
+        """
+        Stop the worker once everything already queued has been processed.
+        Used when the model is swapped out, so in-flight requests finish on
+        the model they were submitted to.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._worker is not None and self._pid == os.getpid():
+                self._queue.put(None)
+
+    def predict(self, input_tensor, timeout=None, decoder='greedy'):
+        return self.submit(input_tensor, decoder).result(timeout=timeout)
+
+    def _ensure_worker(self):
+        # Threads do not survive fork(), so (re)start the worker lazily in
+        # whichever process is actually serving requests.
+        if self._closed or (self._pid == os.getpid() and self._worker is not None and self._worker.is_alive()):
+            return
+        with self._lock:
+            if self._closed or (self._pid == os.getpid() and self._worker is not None and self._worker.is_alive()):
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._worker = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+            self._worker.start()
+
+    def _collect(self):
+        """
+        Next batch, and whether close() was called (a None marker in the queue).
+        """
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    # Window closed, but take anything that is already waiting
+                    item = self._queue.get_nowait()
+                else:
+                    item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        while True:
+            batch, closing = self._collect()
+            if batch:
+                QUEUE_DEPTH.dec(len(batch))
+                try:
+                    self._process(batch)
+                except Exception as e:
+                    # Never let one bad batch kill the worker and strand every later request
+                    ERRORS.inc(stage='batch')
+                    self._fail([f for _, f, _, _ in batch], e)
+            if closing:
+                return
+
+    @staticmethod
+    def _fail(futures, error):
+        for future in futures:
+            if not future.done():
+                future.set_exception(error)
+
+    def _process(self, batch):
+        started = time.perf_counter()
+        for _, _, enqueued, _ in batch:
+            STAGE_LATENCY.observe(started - enqueued, stage='queue_wait')
+
+        batch = [(t, f, d) for t, f, _, d in batch if f.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        futures = [f for _, f, _ in batch]
+        decoders = [d for _, _, d in batch]
+        try:
+            groups = list(bucket_batches([t for t, _, _ in batch]))
+        except Exception as e:
+            # e.g. a tensor with an unexpected shape: fail this batch, keep serving
+            ERRORS.inc(stage='batch')
+            self._fail(futures, e)
+            return
+        for positions, images, lengths in groups:
+            BATCH_SIZES.observe(len(positions), source='scheduler')
+            try:
+                with STAGE_LATENCY.time(stage='forward'), torch.no_grad():
+                    output = self.model(images, lengths)
+            except Exception as e:
+                ERRORS.inc(stage='forward')
+                for p in positions:
+                    futures[p].set_exception(e)
+                continue
+
+            # One decoder call per decoder named in this group
+            by_decoder = {}
+            for i, p in enumerate(positions):
+                by_decoder.setdefault(decoders[p], []).append(i)
+            for name, rows in by_decoder.items():
+                try:
+                    with STAGE_LATENCY.time(stage='ctc_decode'):
+                        if len(rows) == len(positions):
+                            decoded = self.decoders[name](output, lengths)
+                        else:
+                            index = torch.tensor(rows)
+                            decoded = self.decoders[name](output[:, index], lengths[index])
+                except Exception as e:
+                    ERRORS.inc(stage='ctc_decode')
+                    for i in rows:
+                        futures[positions[i]].set_exception(e)
+                    continue
+                for i, text, confidence, chars in zip(rows, *decoded):
+                    futures[positions[i]].set_result({'text': text, 'confidence': confidence, 'char_confidences': chars})
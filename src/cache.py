@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from src.metrics import CACHE_EVENTS
+
+class DiskCacheBackend:
+    """
+    SQLite-backed store shared by every process that points at the same file.
+    Lets cached results survive restarts.
+    """
+    def __init__(self, path, ttl_seconds, prune_every=256):
+        self.path = path
+        self.ttl = ttl_seconds
+        self.prune_every = prune_every
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._writes = 0
+
+    def _connection(self):
+        # SQLite connections must not be shared across fork()
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, raw TEXT, refined TEXT, expires_at REAL, scores TEXT)"
+            )
+            # Files written before confidences were cached lack the column
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(results)")]
+            if 'scores' not in columns:
+                self._conn.execute("ALTER TABLE results ADD COLUMN scores TEXT")
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key):
+        """
+        (value, expires_at as a time.time() timestamp), or None if the key
+        is missing or expired.
+        """
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT raw, refined, expires_at, scores FROM results WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[2] < time.time():
+            return None
+        return {'raw': row[0], 'refined': row[1], **json.loads(row[3] or '{}')}, row[2]
+
+    def put(self, key, value):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, raw, refined, expires_at, scores) VALUES (?, ?, ?, ?, ?)",
+                (key, value['raw'], value['refined'], time.time() + self.ttl,
+                 json.dumps({k: v for k, v in value.items() if k not in ('raw', 'refined')})),
+            )
+            self._writes += 1
+            if self._writes % self.prune_every == 0:
+                conn.execute("DELETE FROM results WHERE expires_at < ?", (time.time(),))
+            conn.commit()
+
+    def clear(self):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM results")
+            conn.commit()
+
+class ResultCache:
+    """
+    Bounded LRU + TTL cache for prediction results.
+    Keys are content hashes of the preprocessed input tensor, so different
+    encodings of the same pixels share an entry. Values hold both the raw
+    CTC prediction and the NSR-refined text, plus the raw prediction's
+    confidences.
+    """
+    def __init__(self, max_entries=4096, ttl_seconds=3600, disk_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.disk = DiskCacheBackend(disk_path, ttl_seconds) if disk_path else None
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def key_for(input_tensor, namespace=None):
+        """
+        `namespace` (e.g. the model version) keeps results of different
+        models apart.
+        """
+        pixels = input_tensor.detach().cpu().contiguous().numpy()
+        digest = hashlib.blake2b(pixels.tobytes(), digest_size=16)
+        digest.update(str(tuple(pixels.shape)).encode())
+        if namespace:
+            digest.update(str(namespace).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at >= now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    CACHE_EVENTS.inc(event='hit')
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+                CACHE_EVENTS.inc(event='expiration')
+
+        found = self.disk.get(key) if self.disk else None
+        with self._lock:
+            if found is None:
+                self.misses += 1
+                CACHE_EVENTS.inc(event='miss')
+                return None
+            self.hits += 1
+            CACHE_EVENTS.inc(event='hit')
+            value, expires_at = found
+            # Keep the disk row's expiry rather than starting a fresh TTL
+            self._insert(key, value, now + max(0.0, expires_at - time.time()))
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._insert(key, value, time.monotonic() + self.ttl)
+        if self.disk:
+            self.disk.put(key, value)
+
+    def _insert(self, key, value, expires_at):
+        # expires_at is on the time.monotonic() clock
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+            CACHE_EVENTS.inc(event='eviction')
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.disk:
+            self.disk.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'disk_backend': self.disk.path if self.disk else None,
+            }
@@ -0,0 +1,182 @@
+import json
+import os
+import re
+import threading
+import time
+
+import torch
+
+# Versioned checkpoints for zero-downtime deploys.
+#
+#   CHECKPOINT_DIR/
+#     best_model.pth          copy of the latest version (for older tools)
+#     versions/
+#       LATEST                name of the newest published version
+#       v0001/model.pth       weights
+#       v0001/metadata.json   epoch, validation metrics, publish time
+#     training/
+#       state-00001500.pt     full training state after optimizer step 1500,
+#                             for `src/train.py --resume` (last few kept)
+#
+# Every file is written to a temporary name and renamed into place, so a
+# reader (or a memory-mapped model) never sees a partially written file.
+
+VERSIONS_DIR = "versions"
+LATEST_FILE = "LATEST"
+MODEL_FILE = "model.pth"
+METADATA_FILE = "metadata.json"
+TRAINING_DIR = "training"
+
+def atomic_write(path, write, mode='wb'):
+    """
+    Call write(f) on a temporary file next to `path`, then rename it into place.
+    """
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, mode) as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def versions_dir(checkpoint_dir):
+    return os.path.join(checkpoint_dir, VERSIONS_DIR)
+
+def version_dir(checkpoint_dir, version):
+    return os.path.join(versions_dir(checkpoint_dir), version)
+
+def list_versions(checkpoint_dir):
+    root = versions_dir(checkpoint_dir)
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        name for name in os.listdir(root)
+        if re.fullmatch(r"v\d+", name) and os.path.exists(os.path.join(root, name, MODEL_FILE))
+    )
+
+def latest_version(checkpoint_dir):
+    """
+    Name of the newest published version, or None if nothing was published.
+    """
+    try:
+        with open(os.path.join(versions_dir(checkpoint_dir), LATEST_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def read_metadata(checkpoint_dir, version):
+    try:
+        with open(os.path.join(version_dir(checkpoint_dir, version), METADATA_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def publish_checkpoint(state_dict, checkpoint_dir, metadata=None):
+    """
+    Save `state_dict` as a new version, point LATEST at it and refresh
+    best_model.pth. Returns the version name.
+    """
+    existing = list_versions(checkpoint_dir)
+    number = int(existing[-1][1:]) + 1 if existing else 1
+    version = f"v{number:04d}"
+    target = version_dir(checkpoint_dir, version)
+    os.makedirs(target, exist_ok=True)
+
+    atomic_write(os.path.join(target, MODEL_FILE), lambda f: torch.save(state_dict, f))
+    info = {'version': version, 'published_at': time.time(), **(metadata or {})}
+    atomic_write(os.path.join(target, METADATA_FILE), lambda f: json.dump(info, f, indent=2), mode='w')
+
+    # Servers watch LATEST, so it is written last
+    atomic_write(os.path.join(versions_dir(checkpoint_dir), LATEST_FILE), lambda f: f.write(version), mode='w')
+    atomic_write(os.path.join(checkpoint_dir, "best_model.pth"), lambda f: torch.save(state_dict, f))
+    return version
+
+def resolve_checkpoint(checkpoint_dir, version=None):
+    """
+    (version, weights path, artifact dir) to load. Falls back to the
+    unversioned best_model.pth when nothing has been published.
+    Backend artifacts (TorchScript, ONNX, int8) for a version live in its
+    directory (src/export.py --output-dir, src/quantize.py --output).
+    """
+    version = version or latest_version(checkpoint_dir)
+    if version is None:
+        return None, os.path.join(checkpoint_dir, "best_model.pth"), checkpoint_dir
+    if not re.fullmatch(r"v\d+", version):
+        raise ValueError(f"Invalid model version '{version}'")
+    path = os.path.join(version_dir(checkpoint_dir, version), MODEL_FILE)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Model version '{version}' not found at {path}")
+    return version, path, version_dir(checkpoint_dir, version)
+
+def training_state_dir(checkpoint_dir):
+    return os.path.join(checkpoint_dir, TRAINING_DIR)
+
+def list_training_states(checkpoint_dir):
+    """
+    Paths of the training-state checkpoints, oldest first.
+    """
+    root = training_state_dir(checkpoint_dir)
+    if not os.path.isdir(root):
+        return []
+    return [os.path.join(root, name) for name in sorted(os.listdir(root))
+            if re.fullmatch(r"state-\d+\.pt", name)]
+
+def latest_training_state(checkpoint_dir):
+    states = list_training_states(checkpoint_dir)
+    return states[-1] if states else None
+
+def load_training_state(path):
+    # Holds Python and NumPy RNG states besides tensors, so not weights_only
+    return torch.load(path, map_location="cpu", weights_only=False)
+
+def snapshot(obj):
+    """
+    Copy of a (nested) state with every tensor cloned to CPU memory, so
+    training can carry on changing the originals while it is written out.
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {key: snapshot(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(value) for value in obj)
+    return obj
+
+class AsyncCheckpointer:
+    """
+    Writes training-state checkpoints on a background thread. save() only
+    takes an in-memory snapshot and returns; the file is written atomically
+    (so a crash mid-write leaves the previous checkpoint intact) and then
+    all but the newest `keep` are deleted. At most one write is in flight:
+    a save() while the previous one is still being written waits for it.
+    """
+    def __init__(self, checkpoint_dir, keep=3):
+        self.directory = training_state_dir(checkpoint_dir)
+        self.keep = keep
+        self._thread = None
+        self._error = None
+
+    def save(self, step, state):
+        state = snapshot(state)
+        self.wait()
+        self._thread = threading.Thread(target=self._write, args=(step, state), name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def _write(self, step, state):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            atomic_write(os.path.join(self.directory, f"state-{step:08d}.pt"), lambda f: torch.save(state, f))
+            for path in list_training_states(os.path.dirname(self.directory))[:-self.keep]:
+                os.remove(path)
+        except Exception as e:
+            self._error = e
+
+    def wait(self):
+        """
+        Block until the pending write (if any) is on disk; re-raises its error.
+        """
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
@@ -1,9 +1,58 @@
+import hashlib
 import os
+import random
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 import torch
-from torch.utils.data import Dataset
-from config import CHAR_TO_IDX, IMG_HEIGHT, IMG_WIDTH
+from PIL import Image
+from torch.utils.data import Dataset, Sampler
+from config import CHAR_TO_IDX, IMG_HEIGHT, IMG_WIDTH, WIDTH_BUCKETS, MIN_IMG_WIDTH, VOCAB
+from src.model import output_lengths
+
+# Bump when preprocessing changes in a way the cache fingerprint cannot see
+PACK_FORMAT = 1
+
+def scaled_width(width, height):
+    """
+    Width after resizing to IMG_HEIGHT with the aspect ratio kept.
+    """
+    new_w = int(round(width * IMG_HEIGHT / max(height, 1)))
+    return max(MIN_IMG_WIDTH, min(new_w, WIDTH_BUCKETS[-1]))
+
+def bucket_width(width):
+    """
+    Smallest width bucket that fits `width`.
+    """
+    for bucket in WIDTH_BUCKETS:
+        if width <= bucket:
+            return bucket
+    return WIDTH_BUCKETS[-1]
+
+def resize_to_height(img):
+    """
+    Grayscale uint8 (H, W) -> float32 (IMG_HEIGHT, W') in [0, 1] with ink
+    high and paper low. W' follows the aspect ratio (see scaled_width).
+    """
+    h, w = img.shape
+    img = cv2.resize(img, (scaled_width(w, h), IMG_HEIGHT))
+    img = img.astype(np.float32) / 255.0
+    
+    # Ensure ink is high value (1.0) and paper is low value (0.0)
+    if np.mean(img) > 0.5:
+        img = 1.0 - img
+    return img
+
+def pad_batch(images):
+    """
+    Right-pad (C, H, W_i) images with background to the bucket of the widest
+    one. Returns the (B, C, H, W) batch and the true widths.
+    """
+    widths = torch.tensor([image.size(-1) for image in images])
+    batch = images[0].new_zeros((len(images),) + tuple(images[0].shape[:-1]) + (bucket_width(int(widths.max())),))
+    for i, image in enumerate(images):
+        batch[i, ..., :image.size(-1)] = image
+    return batch, widths
 
 class HandwritingDataset(Dataset):
     def __init__(self, image_paths, labels, transform=None):
@@ -21,21 +70,27 @@ class HandwritingDataset(Dataset):
             # Create a blank image if path is invalid
             img = np.zeros((IMG_HEIGHT, IMG_WIDTH), dtype=np.uint8)
         
-        # Resize to fixed height while maintaining aspect ratio or pad
-        h, w = img.shape
-        new_w = int(h * (IMG_WIDTH / IMG_HEIGHT))
-        img = cv2.resize(img, (IMG_WIDTH, IMG_HEIGHT))
-        
-        # Normalize
-        img = img.astype(np.float32) / 255.0
-        
-        # Ensure ink is high value (1.0) and paper is low value (0.0)
-        if np.mean(img) > 0.5:
-            img = 1.0 - img
+        # Resize to fixed height while maintaining aspect ratio; padding to a
+        # width bucket happens per batch in collate_fn
+        img = resize_to_height(img)
             
         img = np.expand_dims(img, axis=0) # Add channel dim
         return img
 
+    def widths(self):
+        """
+        Resized width of every image, read from the file headers only.
+        """
+        widths = []
+        for path in self.image_paths:
+            try:
+                with Image.open(path) as img:
+                    w, h = img.size
+            except OSError:
+                w, h = IMG_WIDTH, IMG_HEIGHT
+            widths.append(scaled_width(w, h))
+        return widths
+
     def encode_label(self, label):
         return [CHAR_TO_IDX[char] for char in label if char in CHAR_TO_IDX]
 
@@ -53,14 +108,199 @@ class HandwritingDataset(Dataset):
             'text': label
         }
 
+class PackedHandwritingDataset(Dataset):
+    """
+    HandwritingDataset read from a packed cache (see pack_dataset): every
+    image already decoded, resized and inverted, stored as uint8 in one
+    memory-mapped file. Items are zero-copy views into the map; collate_fn
+    turns the padded uint8 batch into floats.
+    """
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        with np.load(cache_path + ".index.npz") as index:
+            self.offsets = index['offsets']
+            self._widths = index['widths']
+            self.label_offsets = index['label_offsets']
+            self.labels = index['labels']
+            self.texts = index['texts']
+            self.fingerprint = str(index['fingerprint'])
+        self._images = None
+
+    @classmethod
+    def open(cls, image_paths, labels, cache_path):
+        """
+        Open the cache at `cache_path`, (re)packing it first if it is missing
+        or was built from a different manifest, images or preprocessing.
+        """
+        fingerprint = pack_fingerprint(image_paths, labels)
+        try:
+            dataset = cls(cache_path)
+            if dataset.fingerprint == fingerprint:
+                return dataset
+            print(f"Dataset cache {cache_path} is stale, repacking")
+        except (OSError, KeyError, ValueError):
+            print(f"Packing dataset cache {cache_path}")
+        pack_dataset(image_paths, labels, cache_path, fingerprint=fingerprint)
+        return cls(cache_path)
+
+    @property
+    def images(self):
+        # Opened lazily so each DataLoader worker maps the file itself.
+        # Copy-on-write mode gives writable (torch-friendly) views without
+        # ever writing back to the cache.
+        if self._images is None:
+            self._images = np.memmap(self.cache_path + ".images.u8", dtype=np.uint8, mode='c')
+        return self._images
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_images'] = None
+        return state
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def widths(self):
+        return self._widths.tolist()
+
+    def __getitem__(self, idx):
+        offset, width = int(self.offsets[idx]), int(self._widths[idx])
+        image = self.images[offset:offset + IMG_HEIGHT * width].reshape(1, IMG_HEIGHT, width)
+        label = self.labels[self.label_offsets[idx]:self.label_offsets[idx + 1]]
+        return {
+            'image': torch.from_numpy(image),
+            'label': torch.from_numpy(label.astype(np.int64)),
+            'label_length': torch.IntTensor([len(label)]),
+            'text': str(self.texts[idx])
+        }
+
+def pack_fingerprint(image_paths, labels):
+    """
+    Hash of everything the packed cache depends on: the manifest entries,
+    each image's size and mtime, and the preprocessing parameters.
+    """
+    digest = hashlib.sha1(repr((PACK_FORMAT, IMG_HEIGHT, IMG_WIDTH, WIDTH_BUCKETS[-1], MIN_IMG_WIDTH, VOCAB)).encode())
+    for path, label in zip(image_paths, labels):
+        try:
+            stat = os.stat(path)
+            stamp = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            stamp = None
+        digest.update(f"{path}\t{label}\t{stamp}\n".encode())
+    return digest.hexdigest()
+
+def pack_dataset(image_paths, labels, cache_path, fingerprint=None, workers=None):
+    """
+    Decode and preprocess every image once and write the packed cache:
+    <cache_path>.images.u8 (images as uint8, ink high, each 32 x W flattened
+    back to back) and <cache_path>.index.npz (offsets, widths, encoded labels,
+    texts, fingerprint). Both files are replaced atomically.
+    """
+    from src.checkpoints import atomic_write
+
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    source = HandwritingDataset(image_paths, labels)
+
+    def load(path):
+        return np.rint(source.preprocess_image(path)[0] * 255.0).astype(np.uint8)
+
+    offsets, widths = [], []
+    def write_images(f):
+        offset = 0
+        # cv2 releases the GIL while decoding and resizing
+        with ThreadPoolExecutor(workers or os.cpu_count() or 1) as pool:
+            for image in pool.map(load, image_paths):
+                offsets.append(offset)
+                widths.append(image.shape[1])
+                f.write(image.tobytes())
+                offset += image.size
+    atomic_write(cache_path + ".images.u8", write_images)
+
+    encoded = [source.encode_label(label) for label in labels]
+    label_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    label_offsets[1:] = np.cumsum([len(e) for e in encoded])
+    atomic_write(cache_path + ".index.npz", lambda f: np.savez(
+        f,
+        offsets=np.array(offsets, dtype=np.int64),
+        widths=np.array(widths, dtype=np.int32),
+        label_offsets=label_offsets,
+        labels=np.array([i for e in encoded for i in e], dtype=np.int16),
+        texts=np.array(labels, dtype=str),
+        fingerprint=np.array(fingerprint or pack_fingerprint(image_paths, labels)),
+    ))
+    return cache_path
+
+class BucketBatchSampler(Sampler):
+    """
+    Batches of indices whose images fall in the same width bucket, so a
+    batch is padded by at most one bucket step. Batch order (and order
+    within each bucket) is shuffled per epoch; call set_epoch() each epoch.
+    Under distributed training every rank builds the same batch list and
+    takes every world_size-th batch from position `rank`. load_state_dict()
+    resumes an epoch after the batches a rank has already consumed.
+    """
+    def __init__(self, widths, batch_size, shuffle=True, drop_last=False, seed=0, rank=None, world_size=None):
+        from src.distributed import rank_and_world
+
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+        default_rank, default_world = rank_and_world()
+        self.rank = default_rank if rank is None else rank
+        self.world_size = default_world if world_size is None else world_size
+        self.buckets = {}
+        for index, width in enumerate(widths):
+            self.buckets.setdefault(bucket_width(width), []).append(index)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        self.start = 0
+
+    def load_state_dict(self, state):
+        # {'epoch', 'batches'}: skip the first `batches` batches of that epoch
+        self.epoch = state['epoch']
+        self.start = state['batches']
+
+    def batches(self):
+        rng = random.Random(self.seed + self.epoch)
+        batches = []
+        for bucket in sorted(self.buckets):
+            indices = list(self.buckets[bucket])
+            if self.shuffle:
+                rng.shuffle(indices)
+            for start in range(0, len(indices), self.batch_size):
+                batch = indices[start:start + self.batch_size]
+                if len(batch) == self.batch_size or not self.drop_last:
+                    batches.append(batch)
+        if self.shuffle:
+            rng.shuffle(batches)
+        return batches[self.rank::self.world_size][self.start:]
+
+    def __iter__(self):
+        return iter(self.batches())
+
+    def __len__(self):
+        sizes = [len(indices) for indices in self.buckets.values()]
+        if self.drop_last:
+            total = sum(size // self.batch_size for size in sizes)
+        else:
+            total = sum((size + self.batch_size - 1) // self.batch_size for size in sizes)
+        return max(0, len(range(self.rank, total, self.world_size)) - self.start)
+
 def collate_fn(batch):
-    images = torch.stack([item['image'] for item in batch])
+    images, widths = pad_batch([item['image'] for item in batch])
+    if images.dtype == torch.uint8:
+        # Packed datasets hand out uint8 views; cast once per batch
+        images = images.float().div_(255.0)
     labels = torch.cat([item['label'] for item in batch])
     label_lengths = torch.cat([item['label_length'] for item in batch])
     texts = [item['text'] for item in batch]
     
-    # Sequence length after CNN (calculated from model architecture)
-    # Our model reduces width from 128 to 32
-    input_lengths = torch.full(size=(len(batch),), fill_value=32, dtype=torch.int32)
+    # True sequence length of each sample after the CNN (W/4), so CTC
+    # ignores the columns that only cover padding
+    input_lengths = output_lengths(widths).to(torch.int32)
     
     return images, labels, input_lengths, label_lengths, texts
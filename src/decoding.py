@@ -0,0 +1,388 @@
+import argparse
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the project root to the python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from config import *
+from src.utils import greedy_decode
+
+# CTC prefix beam search, with an optional character n-gram LM and an
+# optional lexicon that restricts the output to known words.
+#
+# Beams are scored as
+#   log P_ctc(prefix) + LM_WEIGHT * log P_lm(prefix) + LM_CHAR_BONUS * len(prefix)
+# where the bonus only applies together with the LM (it offsets the LM's
+# preference for short outputs). Per frame, only the most likely symbols
+# covering BEAM_PRUNE_MASS of the probability are expanded; frames where the
+# blank alone covers that mass just carry every beam forward, which is most
+# frames of a trained model.
+
+BOS = "\x02"  # LM start-of-text padding
+EOS = "\x03"  # LM end of text; shares label index 0 with the CTC blank
+SPACE = CHAR_TO_IDX.get(' ')
+
+def manifest_texts(manifest_path):
+    """
+    Labels of a manifest (image<TAB>label per line).
+    """
+    texts = []
+    with open(manifest_path, "r") as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) == 2:
+                texts.append(parts[1])
+    return texts
+
+class CharNgramLM:
+    """
+    Character n-gram language model with Witten-Bell interpolation, so
+    unseen characters keep some probability. log_probs(prefix) gives
+    log P(next | prefix) over the label indices, with index 0 the end of text.
+    """
+    def __init__(self, order, counts):
+        self.order = order
+        self.counts = counts  # {history: {char: count}} for histories of length 0..order-1
+        self._probs = {}
+        self._log_probs = {}  # history -> read-only log distribution
+
+    @classmethod
+    def train(cls, texts, order=LM_ORDER):
+        counts = {}
+        for text in texts:
+            chars = [BOS] * (order - 1) + [c for c in text if c in CHAR_TO_IDX] + [EOS]
+            for i in range(order - 1, len(chars)):
+                for n in range(order):
+                    history = counts.setdefault("".join(chars[i - n:i]), {})
+                    history[chars[i]] = history.get(chars[i], 0) + 1
+        return cls(order, counts)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            data = json.load(f)
+        return cls(data['order'], data['counts'])
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({'order': self.order, 'counts': self.counts}, f)
+
+    def _distribution(self, history):
+        probs = self._probs.get(history)
+        if probs is not None:
+            return probs
+        if history:
+            probs = self._distribution(history[1:]).copy()
+        else:
+            probs = np.full(NUM_CLASSES, 1.0 / NUM_CLASSES)
+        seen = self.counts.get(history)
+        if seen:
+            total, types = sum(seen.values()), len(seen)
+            probs *= types / (total + types)
+            for char, count in seen.items():
+                probs[0 if char == EOS else CHAR_TO_IDX[char]] += count / (total + types)
+        self._probs[history] = probs
+        return probs
+
+    def log_probs(self, prefix):
+        """
+        log P(next label | prefix) for a tuple of label indices. The
+        returned array is shared and read-only.
+        """
+        n = self.order - 1
+        recent = prefix[max(0, len(prefix) - n):]
+        history = BOS * (n - len(recent)) + "".join(IDX_TO_CHAR[i] for i in recent)
+        log_probs = self._log_probs.get(history)
+        if log_probs is None:
+            log_probs = np.log(self._distribution(history))
+            log_probs.setflags(write=False)
+            self._log_probs[history] = log_probs
+        return log_probs
+
+class LexiconTrie:
+    """
+    Character trie of allowed words. masks[node] marks the labels that may
+    follow in that state: the node's children, plus a space once a word
+    is complete.
+    """
+    ROOT = 0
+
+    def __init__(self, words):
+        self.children = [{}]
+        self.terminal = [False]
+        for word in words:
+            if not word or any(c not in CHAR_TO_IDX or c == ' ' for c in word):
+                continue
+            node = self.ROOT
+            for char in word:
+                label = CHAR_TO_IDX[char]
+                if label not in self.children[node]:
+                    self.children[node][label] = len(self.children)
+                    self.children.append({})
+                    self.terminal.append(False)
+                node = self.children[node][label]
+            self.terminal[node] = True
+
+        self.masks = np.zeros((len(self.children), NUM_CLASSES), dtype=bool)
+        for node, children in enumerate(self.children):
+            self.masks[node, list(children)] = True
+            if self.terminal[node] and SPACE is not None:
+                self.masks[node, SPACE] = True
+
+    @classmethod
+    def from_texts(cls, texts):
+        return cls(sorted({word for text in texts for word in text.split(' ')}))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            return cls(line.strip() for line in f)
+
+    def step(self, node, label):
+        return self.ROOT if label == SPACE else self.children[node][label]
+
+    def can_end(self, node):
+        return self.terminal[node]
+
+class BeamSearchDecoder:
+    """
+    Batched CTC prefix beam search. Called like greedy_decode: (T, B, C)
+    log-probs and optional lengths in, (texts, confidences, char_confidences)
+    out. The confidence is the geometric mean per frame of the CTC
+    probability of the chosen text (summed over all its alignments);
+    per-character confidences are not defined for beams and are None.
+    Batch items are decoded in parallel on a thread pool.
+    """
+    def __init__(self, beam_width=BEAM_WIDTH, prune_mass=BEAM_PRUNE_MASS, lm=None, lexicon=None,
+                 lm_weight=LM_WEIGHT, char_bonus=LM_CHAR_BONUS, threads=BEAM_THREADS):
+        self.beam_width = beam_width
+        self.prune_mass = prune_mass
+        self.lm = lm
+        self.lexicon = lexicon
+        self.lm_weight = lm_weight if lm is not None else 0.0
+        self.char_bonus = char_bonus if lm is not None else 0.0
+        self.threads = threads
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        # Pool threads do not survive fork(); make one per process
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ThreadPoolExecutor(self.threads, thread_name_prefix="beam-search")
+                self._pid = os.getpid()
+            return self._pool
+
+    def __call__(self, output, lengths=None):
+        log_probs = output.detach().float().cpu().numpy().transpose(1, 0, 2)
+        steps = lengths.tolist() if lengths is not None else [log_probs.shape[1]] * log_probs.shape[0]
+        items = [log_probs[i, :steps[i]] for i in range(log_probs.shape[0])]
+        if self.threads > 1 and len(items) > 1:
+            results = list(self._executor().map(self.decode_one, items))
+        else:
+            results = [self.decode_one(item) for item in items]
+        texts = [text for text, _ in results]
+        confidences = [confidence for _, confidence in results]
+        return texts, confidences, [None] * len(items)
+
+    def _candidates(self, probs):
+        """
+        Non-blank labels worth expanding in a frame: the most likely symbols
+        covering prune_mass of the probability, at most beam_width of them.
+        """
+        order = np.argsort(probs)[::-1]
+        count = int(np.searchsorted(np.cumsum(probs[order]), self.prune_mass)) + 1
+        top = order[:min(count, self.beam_width)]
+        return top[top != 0]
+
+    def _lm_rows(self, prefixes):
+        return np.stack([self.lm.log_probs(prefix) for prefix in prefixes])
+
+    def decode_one(self, log_probs):
+        """
+        Best text and confidence for one (T, C) sequence of log-probs.
+        """
+        steps = len(log_probs)
+        if steps == 0:
+            return "", 1.0
+        probs = np.exp(log_probs)
+
+        # Beam state: prefix tuples plus parallel arrays
+        prefixes = [()]
+        p_blank = np.zeros(1)  # log P(prefix, path ends in blank)
+        p_char = np.full(1, -np.inf)  # log P(prefix, path ends in its last character)
+        lm_score = np.zeros(1)
+        nodes = [LexiconTrie.ROOT]
+
+        for t in range(steps):
+            frame = log_probs[t]
+            last = np.array([prefix[-1] if prefix else 0 for prefix in prefixes])
+            total = np.logaddexp(p_blank, p_char)
+            # Same prefix: a blank, or a repeat of its last character
+            stay_blank = total + frame[0]
+            stay_char = np.where(last > 0, p_char + frame[last], -np.inf)
+
+            candidates = self._candidates(probs[t])
+            if len(candidates) == 0:
+                p_blank, p_char = stay_blank, stay_char
+                continue
+
+            # Extensions by one character; repeating the last character only
+            # extends paths that went through a blank in between
+            extend = np.where(candidates[None, :] == last[:, None], p_blank[:, None], total[:, None])
+            extend = extend + frame[candidates][None, :]
+            extend_lm = np.zeros_like(extend)
+            if self.lm is not None:
+                extend_lm = lm_score[:, None] + self._lm_rows(prefixes)[:, candidates]
+            if self.lexicon is not None:
+                extend[~self.lexicon.masks[nodes][:, candidates]] = -np.inf
+            lengths = np.array([len(prefix) for prefix in prefixes])
+            rank = extend + self.lm_weight * extend_lm + self.char_bonus * (lengths[:, None] + 1)
+
+            # Only the best extensions can make it into the next beam
+            flat = rank.ravel()
+            if flat.size > self.beam_width:
+                best = np.argpartition(-flat, self.beam_width - 1)[:self.beam_width]
+            else:
+                best = np.arange(flat.size)
+
+            beams = {}
+            for k, prefix in enumerate(prefixes):
+                beams[prefix] = [stay_blank[k], stay_char[k], lm_score[k], nodes[k]]
+            for index in best.tolist():
+                if flat[index] == -np.inf:
+                    continue
+                k, m = divmod(index, len(candidates))
+                label = int(candidates[m])
+                prefix = prefixes[k] + (label,)
+                entry = beams.get(prefix)
+                if entry is not None:
+                    entry[1] = np.logaddexp(entry[1], extend[k, m])
+                else:
+                    node = self.lexicon.step(nodes[k], label) if self.lexicon is not None else nodes[k]
+                    beams[prefix] = [-np.inf, extend[k, m], extend_lm[k, m], node]
+
+            prefixes = list(beams)
+            state = np.array([entry[:3] for entry in beams.values()])
+            lengths = np.array([len(prefix) for prefix in prefixes])
+            rank = np.logaddexp(state[:, 0], state[:, 1]) + self.lm_weight * state[:, 2] + self.char_bonus * lengths
+            keep = np.argsort(-rank)[:self.beam_width]
+            prefixes = [prefixes[k] for k in keep]
+            nodes = [beams[prefix][3] for prefix in prefixes]
+            p_blank, p_char, lm_score = state[keep, 0], state[keep, 1], state[keep, 2]
+
+        # Finish: end-of-text LM probability, and only complete words
+        total = np.logaddexp(p_blank, p_char)
+        final = total.copy()
+        if self.lm is not None:
+            end = self._lm_rows(prefixes)[:, 0]
+            lengths = np.array([len(prefix) for prefix in prefixes])
+            final += self.lm_weight * (lm_score + end) + self.char_bonus * lengths
+        if self.lexicon is not None:
+            complete = np.array([not prefix or self.lexicon.can_end(node) for prefix, node in zip(prefixes, nodes)])
+            if complete.any():
+                final[~complete] = -np.inf
+        best = int(np.argmax(final))
+        text = "".join(IDX_TO_CHAR[label] for label in prefixes[best])
+        return text, float(np.exp(total[best] / steps))
+
+@functools.lru_cache(maxsize=None)
+def load_decoders():
+    """
+    Decoders selectable per request, by name:
+    - greedy:  best-path decoding (default, see greedy_decode)
+    - beam:    prefix beam search on the model output alone
+    - beam_lm: beam search with the LM (LM_PATH) and/or lexicon
+               (LEXICON_PATH); only available if one of them is configured
+    """
+    decoders = {'greedy': greedy_decode, 'beam': BeamSearchDecoder()}
+    lm = CharNgramLM.load(LM_PATH) if LM_PATH else None
+    lexicon = LexiconTrie.load(LEXICON_PATH) if LEXICON_PATH else None
+    if lm is not None or lexicon is not None:
+        decoders['beam_lm'] = BeamSearchDecoder(lm=lm, lexicon=lexicon)
+    return decoders
+
+def compare(args):
+    import torch
+    from src.model import load_model
+    from src.train import make_loader
+    from src.utils import calculate_metrics
+
+    loader = make_loader(args.manifest, args.samples)
+    dataset = loader.dataset
+    model = load_model(args.checkpoint, device='cpu')
+    outputs = []
+    with torch.no_grad():
+        for images, _, input_lengths, _, batch_texts in loader:
+            outputs.append((model(images, input_lengths), input_lengths, batch_texts))
+
+    decoders = {'greedy': greedy_decode, 'beam': BeamSearchDecoder(beam_width=args.beam_width)}
+    lm = CharNgramLM.load(args.lm) if args.lm else None
+    lexicon = LexiconTrie.load(args.lexicon) if args.lexicon else None
+    if lm is not None:
+        decoders['beam+lm'] = BeamSearchDecoder(beam_width=args.beam_width, lm=lm)
+    if lexicon is not None:
+        decoders['beam+lexicon'] = BeamSearchDecoder(beam_width=args.beam_width, lexicon=lexicon)
+    if lm is not None and lexicon is not None:
+        decoders['beam+lm+lexicon'] = BeamSearchDecoder(beam_width=args.beam_width, lm=lm, lexicon=lexicon)
+
+    print(f"{len(dataset)} images from {args.manifest}, beam width {args.beam_width}")
+    print(f"{'Decoder':<18}{'CER':>8}{'ms/image':>10}")
+    for name, decode in decoders.items():
+        preds, targets = [], []
+        start = time.perf_counter()
+        for output, input_lengths, batch_texts in outputs:
+            preds.extend(decode(output, input_lengths)[0])
+            targets.extend(batch_texts)
+        elapsed = (time.perf_counter() - start) * 1000.0
+        print(f"{name:<18}{calculate_metrics(preds, targets):>8.4f}{elapsed / len(dataset):>10.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="CTC beam search: build the LM and lexicon, compare decoders")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    lm_parser = commands.add_parser('lm', help="Train the character n-gram LM from manifests")
+    lm_parser.add_argument('--manifest', nargs='+', default=[os.path.join(DATA_DIR, "train_manifest.txt")])
+    lm_parser.add_argument('--order', type=int, default=LM_ORDER)
+    lm_parser.add_argument('--output', default=os.path.join(CHECKPOINT_DIR, "char_lm.json"))
+
+    lexicon_parser = commands.add_parser('lexicon', help="Collect the word list from manifests")
+    lexicon_parser.add_argument('--manifest', nargs='+', default=[os.path.join(DATA_DIR, "train_manifest.txt")])
+    lexicon_parser.add_argument('--output', default=os.path.join(CHECKPOINT_DIR, "lexicon.txt"))
+
+    compare_parser = commands.add_parser('compare', help="CER and speed of each decoder on a manifest")
+    compare_parser.add_argument('--checkpoint', default=os.path.join(CHECKPOINT_DIR, "best_model.pth"))
+    compare_parser.add_argument('--manifest', default=os.path.join(DATA_DIR, "val_manifest.txt"))
+    compare_parser.add_argument('--samples', type=int, default=0, help="0 uses the whole manifest")
+    compare_parser.add_argument('--beam-width', type=int, default=BEAM_WIDTH)
+    compare_parser.add_argument('--lm', default=LM_PATH)
+    compare_parser.add_argument('--lexicon', default=LEXICON_PATH)
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        compare(args)
+        return
+
+    texts = [text for manifest in args.manifest for text in manifest_texts(manifest)]
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    if args.command == 'lm':
+        lm = CharNgramLM.train(texts, order=args.order)
+        lm.save(args.output)
+        print(f"Trained a {args.order}-gram character LM on {len(texts)} labels -> {args.output}")
+    else:
+        words = sorted({word for text in texts for word in text.split(' ') if word})
+        with open(args.output, "w") as f:
+            f.write("\n".join(words) + "\n")
+        print(f"Wrote {len(words)} words from {len(texts)} labels -> {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import contextlib
+import os
+
+import torch
+import torch.distributed as dist
+
+# Multi-process data-parallel training on CPUs (gloo backend). Launch with
+# torchrun, which sets RANK / WORLD_SIZE / LOCAL_WORLD_SIZE / MASTER_ADDR:
+#
+#   torchrun --nproc_per_node 4 src/train.py                      # one machine
+#   torchrun --nnodes 2 --node_rank 0 --nproc_per_node 32 \
+#            --master_addr 10.0.0.1 --master_port 29500 src/train.py   # on each node
+#
+# Without torchrun everything here degrades to a single process.
+
+def rank_and_world():
+    """
+    (rank, world size) of this process: from the process group if one is
+    initialised, else from the variables torchrun sets, else (0, 1).
+    """
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank(), dist.get_world_size()
+    return int(os.environ.get("RANK", 0)), int(os.environ.get("WORLD_SIZE", 1))
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1
+
+def is_main_process():
+    return rank_and_world()[0] == 0
+
+def setup():
+    """
+    Join the process group when launched by torchrun with more than one
+    process, and give each local process an equal share of the cores so
+    ranks on the same machine do not oversubscribe it. Returns True if
+    training is distributed.
+    """
+    if int(os.environ.get("WORLD_SIZE", 1)) <= 1 or is_distributed():
+        return is_distributed()
+    dist.init_process_group(backend="gloo")
+    local_world = int(os.environ.get("LOCAL_WORLD_SIZE", 1))
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world))
+    return True
+
+def cleanup():
+    if is_distributed():
+        dist.destroy_process_group()
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+@contextlib.contextmanager
+def main_process_first():
+    """
+    Let rank 0 run the block (e.g. build a dataset cache) before the other
+    ranks, which then find its output instead of racing to write it.
+    """
+    if not is_main_process():
+        barrier()
+    yield
+    if is_main_process():
+        barrier()
+
+def all_reduce_sum(*values):
+    """
+    Sum numbers across ranks; returns them as floats in the same order.
+    """
+    if not is_distributed():
+        return [float(value) for value in values]
+    tensor = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor.tolist()
+
+def all_gather_object(obj):
+    """
+    [obj of rank 0, obj of rank 1, ...] (picklable objects).
+    """
+    if not is_distributed():
+        return [obj]
+    gathered = [None] * dist.get_world_size()
+    dist.all_gather_object(gathered, obj)
+    return gathered
+
+def all_reduce_max(value):
+    if not is_distributed():
+        return float(value)
+    tensor = torch.tensor([value], dtype=torch.float64)
+    dist.all_reduce(tensor, op=dist.ReduceOp.MAX)
+    return tensor.item()
+
+def all_reduce_min(value):
+    return -all_reduce_max(-value)
+
+def lockstep(loader):
+    """
+    Iterate `loader` until any rank runs out of batches, so every rank
+    takes the same number of steps even when their shares are uneven
+    (e.g. streamed shards). Costs one tiny all-reduce per batch; the
+    longer ranks drop their last few batches of the epoch.
+    """
+    iterator = iter(loader)
+    while True:
+        batch = next(iterator, None)
+        if all_reduce_min(batch is not None) == 0:
+            return
+        yield batch
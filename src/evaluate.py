@@ -0,0 +1,212 @@
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+# Add the project root to the python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Levenshtein
+import numpy as np
+import torch
+
+from config import *
+from src.backends import load_backend, warm_up
+from src.model import load_model
+from src.train import make_loader
+
+# Standalone evaluation: score one or more checkpoints x backends on a
+# manifest in one run. Images are loaded by parallel DataLoader workers and
+# metrics are accumulated as batches arrive, so memory stays flat however
+# large the manifest is.
+
+BACKENDS = ['eager', 'scripted', 'compiled', 'onnxruntime', 'quantized']
+LENGTH_BINS = (4, 8, 12, 16, 24, 32)  # upper bounds of the label-length groups
+
+def length_bin(length):
+    lower = 1
+    for upper in LENGTH_BINS:
+        if length <= upper:
+            return f"{lower}-{upper}"
+        lower = upper + 1
+    return f"{lower}+"
+
+class CorpusMetrics:
+    """
+    Streaming corpus-level error counts. update() with each batch of
+    predictions; summary() divides the totals once, so the CER/WER are the
+    corpus rates rather than averages of per-batch rates.
+    """
+    def __init__(self):
+        self.samples = 0
+        self.exact = 0
+        self.char_edits = 0
+        self.chars = 0
+        self.word_edits = 0
+        self.words = 0
+        # (reference char, predicted char); '' marks an insertion or deletion
+        self.confusions = Counter()
+        # length group -> [samples, char edits, chars, exact matches]
+        self.by_length = {}
+
+    def update(self, preds, targets):
+        for pred, target in zip(preds, targets):
+            edits = Levenshtein.distance(pred, target)
+            self.samples += 1
+            self.exact += pred == target
+            self.char_edits += edits
+            self.chars += len(target)
+            self.word_edits += Levenshtein.distance(pred.split(), target.split())
+            self.words += len(target.split())
+
+            for op, target_pos, pred_pos in Levenshtein.editops(target, pred):
+                if op == 'replace':
+                    self.confusions[(target[target_pos], pred[pred_pos])] += 1
+                elif op == 'delete':
+                    self.confusions[(target[target_pos], '')] += 1
+                else:
+                    self.confusions[('', pred[pred_pos])] += 1
+
+            group = self.by_length.setdefault(length_bin(len(target)), [0, 0, 0, 0])
+            group[0] += 1
+            group[1] += edits
+            group[2] += len(target)
+            group[3] += pred == target
+
+    def summary(self, top_confusions=20):
+        def rate(errors, total):
+            return errors / total if total else 0.0
+
+        lengths = []
+        for name in sorted(self.by_length, key=lambda n: int(n.split('-')[0].rstrip('+'))):
+            samples, edits, chars, exact = self.by_length[name]
+            lengths.append({'length': name, 'samples': samples, 'cer': rate(edits, chars),
+                            'sequence_accuracy': rate(exact, samples)})
+        return {
+            'samples': self.samples,
+            'cer': rate(self.char_edits, self.chars),
+            'wer': rate(self.word_edits, self.words),
+            'sequence_accuracy': rate(self.exact, self.samples),
+            'confusions': [{'reference': ref, 'prediction': hyp, 'count': count}
+                           for (ref, hyp), count in self.confusions.most_common(top_confusions)],
+            'by_length': lengths,
+        }
+
+def evaluate(forward, loader, decode):
+    """
+    Run `forward` over the loader. Returns the metrics summary plus
+    throughput (images/s over model + decode time, and end to end including
+    waiting for data) and per-batch latency percentiles.
+    """
+    metrics = CorpusMetrics()
+    latencies = []
+    data_wait = 0.0
+    images = 0
+    start = fetched = time.perf_counter()
+    with torch.no_grad():
+        for batch, _, input_lengths, _, texts in loader:
+            ready = time.perf_counter()
+            data_wait += ready - fetched
+            preds = decode(forward(batch, input_lengths), input_lengths)[0]
+            latencies.append((time.perf_counter() - ready) * 1000.0)
+            images += len(texts)
+            metrics.update(preds, texts)
+            fetched = time.perf_counter()
+    wall = time.perf_counter() - start
+    compute = sum(latencies) / 1000.0
+
+    result = metrics.summary()
+    result.update({
+        'images_per_sec': images / compute if compute else 0.0,
+        'end_to_end_images_per_sec': images / wall if wall else 0.0,
+        'ms_per_image': compute * 1000.0 / images if images else 0.0,
+        'batch_latency_ms': {
+            'p50': float(np.percentile(latencies, 50)) if latencies else 0.0,
+            'p95': float(np.percentile(latencies, 95)) if latencies else 0.0,
+            'p99': float(np.percentile(latencies, 99)) if latencies else 0.0,
+        },
+        'data_wait_s': data_wait,
+    })
+    return result
+
+def run_name(checkpoint, backend):
+    # versions/v0003/model.pth -> v0003, otherwise the file name
+    path = os.path.abspath(checkpoint)
+    parent = os.path.basename(os.path.dirname(path))
+    label = parent if os.path.basename(path) == "model.pth" else os.path.basename(path)
+    return f"{label}:{backend}"
+
+def print_details(name, result):
+    print(f"\n== {name}")
+    confusions = ", ".join(
+        f"{c['reference'] or '∅'!r}->{c['prediction'] or '∅'!r} x{c['count']}" for c in result['confusions'][:10]
+    )
+    print(f"Top confusions (reference->prediction): {confusions or 'none'}")
+    print(f"{'Length':<8}{'Samples':>9}{'CER':>9}{'SeqAcc':>9}")
+    for group in result['by_length']:
+        print(f"{group['length']:<8}{group['samples']:>9}{group['cer']:>9.4f}{group['sequence_accuracy']:>9.4f}")
+
+def main():
+    from src.decoding import BeamSearchDecoder, CharNgramLM, LexiconTrie, load_decoders
+
+    parser = argparse.ArgumentParser(description="Evaluate checkpoints and inference backends on a manifest")
+    parser.add_argument('--checkpoint', nargs='+', default=[os.path.join(CHECKPOINT_DIR, "best_model.pth")],
+                        help="Backend artifacts are looked up next to each checkpoint")
+    parser.add_argument('--backend', nargs='+', default=[INFERENCE_BACKEND], choices=BACKENDS)
+    parser.add_argument('--manifest', default=os.path.join(DATA_DIR, "val_manifest.txt"))
+    parser.add_argument('--samples', type=int, default=0, help="0 evaluates the whole manifest")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1), help="DataLoader worker processes")
+    parser.add_argument('--decoder', default='greedy', help="greedy | beam | beam_lm")
+    parser.add_argument('--lm', default=None, help="Character LM for beam_lm (overrides LM_PATH)")
+    parser.add_argument('--lexicon', default=None, help="Word list for beam_lm (overrides LEXICON_PATH)")
+    parser.add_argument('--output', default=None, help="Write every result as JSON")
+    args = parser.parse_args()
+
+    decoders = dict(load_decoders())
+    if args.lm or args.lexicon:
+        decoders['beam_lm'] = BeamSearchDecoder(lm=CharNgramLM.load(args.lm) if args.lm else None,
+                                                lexicon=LexiconTrie.load(args.lexicon) if args.lexicon else None)
+    if args.decoder not in decoders:
+        sys.exit(f"Unknown decoder '{args.decoder}' (available: {', '.join(decoders)})")
+
+    loader = make_loader(args.manifest, args.samples, batch_size=args.batch_size, num_workers=args.workers)
+    print(f"Evaluating {len(loader.dataset)} images from {args.manifest} "
+          f"({args.workers} loader workers, batch size {args.batch_size}, {args.decoder} decoding)")
+
+    results = {}
+    for checkpoint in args.checkpoint:
+        model = load_model(checkpoint, device='cpu')
+        for backend in args.backend:
+            name = run_name(checkpoint, backend)
+            try:
+                forward = load_backend(backend, model, artifact_dir=os.path.dirname(os.path.abspath(checkpoint)))
+                warm_up(forward, batch_sizes=(1, args.batch_size), iterations=2)
+                results[name] = evaluate(forward, loader, decoders[args.decoder])
+            except Exception as e:
+                print(f"{name}: failed ({e})")
+                results[name] = {'error': str(e)}
+
+    print(f"\n{'Run':<28}{'CER':>8}{'WER':>8}{'SeqAcc':>8}{'img/s':>9}{'e2e img/s':>11}{'p50 ms':>9}{'p95 ms':>9}")
+    for name, result in results.items():
+        if 'error' in result:
+            print(f"{name:<28}  error: {result['error']}")
+            continue
+        latency = result['batch_latency_ms']
+        print(f"{name:<28}{result['cer']:>8.4f}{result['wer']:>8.4f}{result['sequence_accuracy']:>8.4f}"
+              f"{result['images_per_sec']:>9.1f}{result['end_to_end_images_per_sec']:>11.1f}"
+              f"{latency['p50']:>9.2f}{latency['p95']:>9.2f}")
+    for name, result in results.items():
+        if 'error' not in result:
+            print_details(name, result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'manifest': args.manifest, 'decoder': args.decoder, 'batch_size': args.batch_size,
+                       'results': results}, f, indent=2)
+        print(f"\nSaved results to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import argparse
+import os
+import sys
+
+# Add the project root to the python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+
+from config import *
+from src.model import load_model, fold_batchnorm, output_lengths
+from src.backends import script_model, OnnxRuntimeModel, TORCHSCRIPT_FILE, ONNX_FILE
+from src.utils import decode_prediction
+
+def export_torchscript(model, path):
+    scripted = script_model(model)
+    torch.jit.save(scripted, path)
+    return torch.jit.load(path, map_location='cpu')
+
+def export_onnx(model, path):
+    import onnx
+
+    fused = fold_batchnorm(model)
+    example = torch.zeros(2, 1, IMG_HEIGHT, IMG_WIDTH)
+    batch = torch.export.Dim('batch', min=1, max=4096)
+    # Width in whole CNN output columns (4 input pixels each)
+    steps = torch.export.Dim('steps', min=MIN_IMG_WIDTH // 4, max=WIDTH_BUCKETS[-1] // 4)
+    torch.onnx.export(
+        fused, (example,), path,
+        input_names=['image'], output_names=['log_probs'],
+        dynamo=True, dynamic_shapes={'x': {0: batch, 3: 4 * steps}},
+        external_data=False,
+    )
+    # The exporter records the example's sequence length on the LSTM and
+    # everything after it even though the graph follows the input width;
+    # drop the recorded intermediate shapes and declare the output symbolic
+    exported = onnx.load(path)
+    del exported.graph.value_info[:]
+    exported.graph.output[0].type.tensor_type.shape.dim[0].dim_param = 'steps'
+    onnx.save(exported, path)
+    return OnnxRuntimeModel(path)
+
+def parity_inputs(num_samples=32):
+    """
+    (batch, lengths) pairs: real validation images (one batch per width
+    bucket, right-padded as in serving) when available, random noise
+    otherwise, plus a widest-bucket batch so the dynamic width is exercised.
+    `lengths` are the CTC lengths the server passes along with each batch.
+    """
+    from src.train import load_manifest
+    from src.dataset import HandwritingDataset, BucketBatchSampler, pad_batch
+
+    def unpadded(images):
+        return images, output_lengths(torch.full((images.size(0),), images.size(3)))
+
+    batches = [unpadded(torch.rand(4, 1, IMG_HEIGHT, WIDTH_BUCKETS[-1]))]
+    val_manifest = os.path.join(DATA_DIR, "val_manifest.txt")
+    if os.path.exists(val_manifest):
+        paths, labels = load_manifest(val_manifest)
+        dataset = HandwritingDataset(paths[:num_samples], labels[:num_samples])
+        for indices in BucketBatchSampler(dataset.widths(), num_samples, shuffle=False):
+            images, widths = pad_batch([dataset[i]['image'] for i in indices])
+            batches.append((images, output_lengths(widths)))
+    else:
+        batches.append(unpadded(torch.rand(num_samples, 1, IMG_HEIGHT, IMG_WIDTH)))
+    return batches
+
+def check_parity(reference, candidate, batches, atol=1e-3, padded_atol=None):
+    """
+    Compare log-probabilities and greedy decodes of a candidate backend with
+    the eager reference model, both called with the serving lengths.
+
+    Samples padded past their length are reported separately: eager and
+    TorchScript pack the LSTM to each length, while ONNX Runtime and int8
+    run the padding through it and only mask the output, so they drift
+    there. Padded samples only fail the check when `padded_atol` is given.
+    """
+    stats = {kind: {'max_diff': 0.0, 'matches': 0, 'total': 0} for kind in ('unpadded', 'padded')}
+    with torch.no_grad():
+        for inputs, lengths in batches:
+            expected = reference(inputs, lengths)
+            actual = candidate(inputs, lengths)
+            steps = expected.size(0)
+            for i, (a, b) in enumerate(zip(decode_prediction(expected), decode_prediction(actual))):
+                length = int(lengths[i])
+                kind = stats['padded' if length < steps else 'unpadded']
+                # Steps past the length are masked to blank (-inf elsewhere) in both
+                diff = (expected[:length, i] - actual[:length, i]).abs().max().item()
+                kind['max_diff'] = max(kind['max_diff'], diff)
+                kind['matches'] += a == b
+                kind['total'] += 1
+
+    unpadded, padded = stats['unpadded'], stats['padded']
+    passed = unpadded['max_diff'] <= atol and unpadded['matches'] == unpadded['total']
+    if padded_atol is not None:
+        passed = passed and padded['max_diff'] <= padded_atol and padded['matches'] == padded['total']
+    return {
+        'max_abs_diff': unpadded['max_diff'],
+        'decode_agreement': unpadded['matches'] / max(1, unpadded['total']),
+        'padded_max_abs_diff': padded['max_diff'],
+        'padded_decode_agreement': padded['matches'] / padded['total'] if padded['total'] else None,
+        'padded_samples': padded['total'],
+        'passed': passed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Export TorchScript / ONNX inference artifacts")
+    parser.add_argument('--checkpoint', default=os.path.join(CHECKPOINT_DIR, "best_model.pth"))
+    parser.add_argument('--output-dir', default=CHECKPOINT_DIR)
+    parser.add_argument('--formats', nargs='+', default=['torchscript', 'onnx'], choices=['torchscript', 'onnx'])
+    parser.add_argument('--atol', type=float, default=1e-3, help="Max allowed log-prob difference vs eager")
+    parser.add_argument('--padded-atol', type=float, default=None,
+                        help="Also fail if samples padded past their length differ by more than this "
+                             "(default: report only)")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    model = load_model(args.checkpoint, device='cpu')
+    batches = parity_inputs()
+
+    failed = False
+    for fmt in args.formats:
+        if fmt == 'torchscript':
+            path = os.path.join(args.output_dir, TORCHSCRIPT_FILE)
+            candidate = export_torchscript(model, path)
+        else:
+            path = os.path.join(args.output_dir, ONNX_FILE)
+            candidate = export_onnx(model, path)
+
+        report = check_parity(model, candidate, batches, atol=args.atol, padded_atol=args.padded_atol)
+        status = "OK" if report['passed'] else "MISMATCH"
+        print(f"{fmt}: {path} [{status}] max |diff| = {report['max_abs_diff']:.2e}, "
+              f"decode agreement = {report['decode_agreement']:.1%}")
+        if report['padded_samples']:
+            drift = "" if report['padded_max_abs_diff'] <= args.atol else " (drifts from the packed eager LSTM)"
+            print(f"  padded samples ({report['padded_samples']}): max |diff| = {report['padded_max_abs_diff']:.2e}, "
+                  f"decode agreement = {report['padded_decode_agreement']:.1%}{drift}")
+        failed = failed or not report['passed']
+
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Minimal Prometheus instrumentation for the serving path.
+# Recording a sample costs one lock acquisition and a dict update, so it is
+# safe to leave on in production. Under serve.py every worker periodically
+# writes a snapshot to a shared directory and /metrics merges all of them.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+DEAD_SNAPSHOT = "dead.json"  # Counter and histogram totals of workers that have exited
+
+class Metric:
+    def __init__(self, registry, name, help, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.samples = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.samples[key] = self.samples.get(key, 0) + amount
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self.registry.lock:
+            self.samples[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.samples[key] = self.samples.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, registry, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(registry, name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.registry.lock:
+            sample = self.samples.get(key)
+            if sample is None:
+                # Per-bucket (non-cumulative) counts, then +Inf, sum and count
+                sample = self.samples[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            sample[index] += 1
+            sample[-2] += value
+            sample[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.multiprocess_dir = None
+        self._flusher = None
+        self._flush_pid = None
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(self, name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(self, name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(self, name, help, labelnames, buckets))
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                name: {'samples': [[list(k), v] for k, v in metric.samples.items()]}
+                for name, metric in self.metrics.items()
+            }
+
+    def reset(self):
+        """
+        Drop every recorded sample (the metrics stay registered).
+        """
+        with self.lock:
+            for metric in self.metrics.values():
+                metric.samples.clear()
+
+    def enable_multiprocess(self, directory, interval=1.0):
+        """
+        Periodically write this process's samples to `directory` so /metrics
+        in any worker can report totals across all of them.
+        Samples inherited from the parent across fork() (e.g. its warm-up)
+        are dropped first, or every worker would report them again.
+        """
+        self.reset()
+        self.multiprocess_dir = directory
+        self._flush_pid = os.getpid()
+
+        def flush_forever():
+            while True:
+                self.flush()
+                time.sleep(interval)
+
+        self._flusher = threading.Thread(target=flush_forever, name="metrics-flush", daemon=True)
+        self._flusher.start()
+
+    def flush(self):
+        _write_snapshot(os.path.join(self.multiprocess_dir, f"{os.getpid()}.json"), self.snapshot())
+
+    def retire(self, directory, pid):
+        """
+        Fold a dead worker's snapshot into `dead.json` so its counters and
+        histograms keep counting towards the totals (otherwise they would go
+        down and look like a counter reset); its gauges are dropped.
+        Called by the serve.py master, the only writer of `dead.json`.
+        """
+        path = os.path.join(directory, f"{pid}.json")
+        snapshots = [_read_snapshot(path)]
+        dead_path = os.path.join(directory, DEAD_SNAPSHOT)
+        if os.path.exists(dead_path):
+            snapshots.append(_read_snapshot(dead_path))
+        merged = self._merge([
+            {name: snap for name, snap in snapshot.items()
+             if name in self.metrics and self.metrics[name].type != 'gauge'}
+            for snapshot in snapshots if snapshot is not None
+        ])
+        _write_snapshot(dead_path, {name: {'samples': [[list(k), v] for k, v in samples.items()]}
+                                    for name, samples in merged.items() if samples})
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _merge(self, snapshots):
+        merged = {name: {} for name in self.metrics}
+        for snapshot in snapshots:
+            for name, snap in snapshot.items():
+                if name not in merged:
+                    continue
+                for labels, value in snap['samples']:
+                    key = tuple(labels)
+                    current = merged[name].get(key)
+                    if current is None:
+                        merged[name][key] = value
+                    elif isinstance(value, list):
+                        merged[name][key] = [a + b for a, b in zip(current, value)]
+                    else:
+                        merged[name][key] = current + value
+        return merged
+
+    def _merged_samples(self):
+        if not self.multiprocess_dir:
+            return {name: {tuple(k): v for k, v in snap['samples']} for name, snap in self.snapshot().items()}
+
+        self.flush()
+        snapshots = (_read_snapshot(path) for path in glob.glob(os.path.join(self.multiprocess_dir, "*.json")))
+        return self._merge(snapshot for snapshot in snapshots if snapshot is not None)
+
+    def render(self):
+        """
+        Prometheus text exposition format (version 0.0.4).
+        """
+        merged = self._merged_samples()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for key, value in sorted(merged.get(name, {}).items()):
+                labels = list(zip(metric.labelnames, key))
+                if metric.type != 'histogram':
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), value[:-2]):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else _format_value(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels + [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value[-2])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+        return "\n".join(lines) + "\n"
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_snapshot(path, snapshot):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    body = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels
+    )
+    return '{' + body + '}'
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+REGISTRY = MetricsRegistry()
+
+REQUESTS = REGISTRY.counter('ann_http_requests_total', "HTTP requests by endpoint and status code", ['endpoint', 'code'])
+REQUEST_LATENCY = REGISTRY.histogram('ann_http_request_duration_seconds', "End-to-end request latency", ['endpoint'])
+IN_FLIGHT = REGISTRY.gauge('ann_http_requests_in_flight', "Requests currently being handled", ['endpoint'])
+ERRORS = REGISTRY.counter('ann_errors_total', "Errors by stage", ['stage'])
+STAGE_LATENCY = REGISTRY.histogram('ann_stage_duration_seconds', "Latency of each serving stage", ['stage'])
+BATCH_SIZES = REGISTRY.histogram('ann_batch_size', "Images per model forward pass", ['source'], buckets=BATCH_BUCKETS)
+QUEUE_DEPTH = REGISTRY.gauge('ann_batch_queue_depth', "Requests waiting for the micro-batch scheduler")
+REFINEMENTS = REGISTRY.counter('ann_refinement_total', "NSR refinement outcomes", ['status'])
+CACHE_EVENTS = REGISTRY.counter('ann_result_cache_total', "Result cache lookups and evictions", ['event'])
@@ -1,71 +1,318 @@
+import copy
+import functools
+import json
+import os
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
+
+def _scaled(value, multiplier, minimum=8):
+    # Channel counts stay multiples of 8 for the CPU kernels
+    return max(minimum, int(round(value * multiplier / 8)) * 8)
+
+def _conv(in_channels, out_channels, separable=False):
+    """
+    (depthwise, conv) pair for a 3x3 convolution: a per-channel 3x3 then a
+    1x1 across channels when separable, else Identity and a plain 3x3.
+    """
+    if not separable:
+        return nn.Identity(), nn.Conv2d(in_channels, out_channels, kernel_size=3, padding=1)
+    depthwise = nn.Conv2d(in_channels, in_channels, kernel_size=3, padding=1, groups=in_channels, bias=False)
+    return depthwise, nn.Conv2d(in_channels, out_channels, kernel_size=1)
+
+class ConvBlock(nn.Module):
+    """
+    Extra conv + BatchNorm + ReLU layer of a CNN stage (depth > 1).
+    """
+    def __init__(self, channels, separable=False):
+        super(ConvBlock, self).__init__()
+        self.depthwise, self.conv = _conv(channels, channels, separable)
+        self.bn = nn.BatchNorm2d(channels)
+
+    def forward(self, x):
+        return F.relu(self.bn(self.conv(self.depthwise(x))))
 
 class HandwritingModel(nn.Module):
-    def __init__(self, num_classes, hidden_size=256, num_layers=2):
+    """
+    CRNN: a 5-stage CNN over the line image, then a sequence head over its
+    columns, trained with CTC. The defaults are the original model; lighter
+    variants (the tiers in config.MODEL_TIERS) change:
+
+      width      multiplier on the conv channels and the head's hidden size
+      depth      multiplier on the head's layers; above 1 it also adds
+                 conv layers to each CNN stage
+      separable  depthwise-separable 3x3 convs (all but the first)
+      head       "lstm" or "gru" (bidirectional), or "conv" (1-D convs)
+
+    The pooling, and so the CTC input lengths, are the same in every variant.
+    """
+    def __init__(self, num_classes, hidden_size=256, num_layers=2, width=1.0, depth=1.0, separable=False,
+                 head="lstm"):
         super(HandwritingModel, self).__init__()
+        if head not in ("lstm", "gru", "conv"):
+            raise ValueError(f"Unknown sequence head '{head}' (lstm, gru or conv)")
+        self.architecture = {'num_classes': num_classes, 'hidden_size': hidden_size, 'num_layers': num_layers,
+                             'width': width, 'depth': depth, 'separable': separable, 'head': head}
+        channels = [_scaled(c, width) for c in (32, 64, 128, 256, 512)]
+        hidden_size = _scaled(hidden_size, width, minimum=16)
+        num_layers = max(1, int(round(num_layers * depth)))
+        extra = max(0, int(round(depth)) - 1)
         
         # CNN Feature Extractor
-        self.conv1 = nn.Conv2d(1, 32, kernel_size=3, padding=1)
-        self.bn1 = nn.BatchNorm2d(32)
+        self.conv1 = nn.Conv2d(1, channels[0], kernel_size=3, padding=1)
+        self.bn1 = nn.BatchNorm2d(channels[0])
+        self.extra1 = nn.ModuleList([ConvBlock(channels[0], separable) for _ in range(extra)])
         self.pool1 = nn.MaxPool2d(2) # 32x128 -> 16x64
         
-        self.conv2 = nn.Conv2d(32, 64, kernel_size=3, padding=1)
-        self.bn2 = nn.BatchNorm2d(64)
+        self.conv2_dw, self.conv2 = _conv(channels[0], channels[1], separable)
+        self.bn2 = nn.BatchNorm2d(channels[1])
+        self.extra2 = nn.ModuleList([ConvBlock(channels[1], separable) for _ in range(extra)])
         self.pool2 = nn.MaxPool2d(2) # 16x64 -> 8x32
         
-        self.conv3 = nn.Conv2d(64, 128, kernel_size=3, padding=1)
-        self.bn3 = nn.BatchNorm2d(128)
+        self.conv3_dw, self.conv3 = _conv(channels[1], channels[2], separable)
+        self.bn3 = nn.BatchNorm2d(channels[2])
+        self.extra3 = nn.ModuleList([ConvBlock(channels[2], separable) for _ in range(extra)])
         self.pool3 = nn.MaxPool2d((2, 1)) # 8x32 -> 4x32
         
-        self.conv4 = nn.Conv2d(128, 256, kernel_size=3, padding=1)
-        self.bn4 = nn.BatchNorm2d(256)
+        self.conv4_dw, self.conv4 = _conv(channels[2], channels[3], separable)
+        self.bn4 = nn.BatchNorm2d(channels[3])
+        self.extra4 = nn.ModuleList([ConvBlock(channels[3], separable) for _ in range(extra)])
         self.pool4 = nn.MaxPool2d((2, 1)) # 4x32 -> 2x32
         
-        self.conv5 = nn.Conv2d(256, 512, kernel_size=3, padding=1)
-        self.bn5 = nn.BatchNorm2d(512)
-        # Final feature map size: 1 x 32 x 512 (approx)
+        self.conv5_dw, self.conv5 = _conv(channels[3], channels[4], separable)
+        self.bn5 = nn.BatchNorm2d(channels[4])
+        self.extra5 = nn.ModuleList([ConvBlock(channels[4], separable) for _ in range(extra)])
+        # Final feature map size: 2 x W/4 x channels[4] (1024 features per column by default)
+        features = channels[4] * 2
         
-        # RNN Layers (Bidirectional LSTM)
-        self.lstm = nn.LSTM(1024, hidden_size, num_layers, 
-                            bidirectional=True, batch_first=True, dropout=0.2)
+        # Sequence head: bidirectional LSTM / GRU, or a stack of 1-D convs
+        dropout = 0.2 if num_layers > 1 else 0.0
+        if head == "lstm":
+            self.lstm = nn.LSTM(features, hidden_size, num_layers,
+                                bidirectional=True, batch_first=True, dropout=dropout)
+        elif head == "gru":
+            self.gru = nn.GRU(features, hidden_size, num_layers,
+                              bidirectional=True, batch_first=True, dropout=dropout)
+        else:
+            self.temporal = nn.ModuleList([
+                nn.Conv1d(features if i == 0 else hidden_size * 2, hidden_size * 2, kernel_size=3, padding=1)
+                for i in range(num_layers)
+            ])
         
         # Output fully connected layer
         self.fc = nn.Linear(hidden_size * 2, num_classes)
         
-    def forward(self, x):
+    def forward_features(self, x):
         # Input shape: (batch_size, 1, 32, 128)
         x = F.relu(self.bn1(self.conv1(x)))
+        for block in self.extra1:
+            x = block(x)
         x = self.pool1(x)
         
-        x = F.relu(self.bn2(self.conv2(x)))
+        x = F.relu(self.bn2(self.conv2(self.conv2_dw(x))))
+        for block in self.extra2:
+            x = block(x)
         x = self.pool2(x)
         
-        x = F.relu(self.bn3(self.conv3(x)))
+        x = F.relu(self.bn3(self.conv3(self.conv3_dw(x))))
+        for block in self.extra3:
+            x = block(x)
         x = self.pool3(x)
         
-        x = F.relu(self.bn4(self.conv4(x)))
+        x = F.relu(self.bn4(self.conv4(self.conv4_dw(x))))
+        for block in self.extra4:
+            x = block(x)
         x = self.pool4(x)
         
-        x = F.relu(self.bn5(self.conv5(x)))
+        x = F.relu(self.bn5(self.conv5(self.conv5_dw(x))))
+        for block in self.extra5:
+            x = block(x)
         
         # Current shape: (batch_size, 512, 2, 32)
-        # Reshape for LSTM: (batch_size, sequence_length, features)
+        return x
+    
+    def forward_sequence(self, x, lengths=None):
+        # type: (Tensor, Optional[Tensor]) -> Tensor
+        # Reshape for the sequence head: (batch_size, sequence_length, features)
         # We want to treat the horizontal dimension as the sequence
-        x = x.permute(0, 3, 1, 2) # (batch_size, 32, 512, 2)
+        x = x.permute(0, 3, 1, 2) # (batch_size, W/4, 512, 2)
         batch_size, seq_len, channels, height = x.size()
         x = x.reshape(batch_size, seq_len, channels * height)
         
-        # LSTM
-        x, _ = self.lstm(x)
+        if hasattr(self, 'temporal'):
+            # 1-D convs over the columns; padding columns are zeroed before
+            # each layer so a sample's output does not depend on its bucket
+            x = x.transpose(1, 2)
+            for conv in self.temporal:
+                if lengths is not None:
+                    steps = torch.arange(seq_len, device=x.device)
+                    x = x * (steps.unsqueeze(0) < lengths.to(x.device).unsqueeze(1)).unsqueeze(1).to(x.dtype)
+                x = F.relu(conv(x))
+            x = x.transpose(1, 2)
+        elif lengths is not None:
+            # With per-sample lengths the padding columns are packed away,
+            # so the backward direction starts at each sample's last real column
+            packed = pack_padded_sequence(x, lengths.cpu().long(), batch_first=True, enforce_sorted=False)
+            if hasattr(self, 'lstm'):
+                packed, _ = self.lstm(packed)
+            else:
+                packed, _ = self.gru(packed)
+            x, _ = pad_packed_sequence(packed, batch_first=True, total_length=seq_len)
+        elif hasattr(self, 'lstm'):
+            x, _ = self.lstm(x)
+        else:
+            x, _ = self.gru(x)
         
         # Prediction
         x = self.fc(x)
         
         # Return log probabilities for CTC loss
         # Expected shape by CTC: (sequence_length, batch_size, num_classes)
-        return x.permute(1, 0, 2).log_softmax(2)
+        # Always in fp32: under bf16 autocast the log-probs would otherwise
+        # lose most of their precision before reaching CTC
+        x = x.permute(1, 0, 2).float().log_softmax(2)
+        if lengths is not None:
+            x = mask_padding(x, lengths)
+        return x
+    
+    def forward(self, x, lengths=None):
+        # type: (Tensor, Optional[Tensor]) -> Tensor
+        # lengths: CTC input length of each sample, see output_lengths()
+        x = self.forward_features(x)
+        return self.forward_sequence(x, lengths)
+
+    def output_lengths(self, widths):
+        return output_lengths(widths, self)
+
+def mask_padding(log_probs, lengths):
+    """
+    Force every time step past a sample's length to the CTC blank, so
+    decoders never read characters out of padding.
+    """
+    steps = torch.arange(log_probs.size(0), device=log_probs.device).unsqueeze(1)
+    padded = (steps >= lengths.to(log_probs.device).unsqueeze(0)).unsqueeze(2)
+    blank = torch.full_like(log_probs[0, 0], float('-inf'))
+    blank[0] = 0.0
+    return torch.where(padded, blank, log_probs)
+
+def _horizontal(value):
+    return value[1] if isinstance(value, tuple) else value
+
+@functools.lru_cache(maxsize=None)
+def _reference_model():
+    from config import NUM_CLASSES
+    with torch.device("meta"):
+        return HandwritingModel(num_classes=NUM_CLASSES)
+
+def output_lengths(widths, model=None):
+    """
+    Sequence length after the CNN for each input width, i.e. the true CTC
+    input lengths (pool1 and pool2 halve the width, the rest keep it).
+    Assumes conv/pool layers are registered in the order they are applied.
+    """
+    widths = torch.as_tensor(widths)
+    for m in (model or _reference_model()).modules():
+        if isinstance(m, (nn.Conv2d, nn.MaxPool2d)):
+            kernel = _horizontal(m.kernel_size)
+            stride = _horizontal(m.stride or m.kernel_size)
+            padding = _horizontal(m.padding)
+            dilation = _horizontal(m.dilation)
+            widths = (widths + 2 * padding - dilation * (kernel - 1) - 1) // stride + 1
+    return widths
+
+def input_widths(lengths, model=None):
+    """
+    Widest input that still gives each sequence length, i.e. the inverse of
+    output_lengths: an upper bound on a sample's unpadded width, at most
+    stride - 1 columns past it.
+    """
+    lengths = torch.as_tensor(lengths)
+    layers = [m for m in (model or _reference_model()).modules() if isinstance(m, (nn.Conv2d, nn.MaxPool2d))]
+    for m in reversed(layers):
+        kernel = _horizontal(m.kernel_size)
+        stride = _horizontal(m.stride or m.kernel_size)
+        padding = _horizontal(m.padding)
+        dilation = _horizontal(m.dilation)
+        lengths = lengths * stride - 2 * padding + dilation * (kernel - 1)
+    return lengths
+
+def fold_batchnorm(model):
+    """
+    Return an inference-only copy of the model with every BatchNorm folded
+    into the convolution before it (convN + bnN -> convN, bnN = Identity,
+    also inside ConvBlocks).
+    """
+    fused = copy.deepcopy(model).eval()
+    for parent in list(fused.modules()):
+        for name, module in list(parent.named_children()):
+            if not (name.startswith('conv') and isinstance(module, nn.Conv2d)):
+                continue
+            bn_name = 'bn' + name[len('conv'):]
+            bn = getattr(parent, bn_name, None)
+            if isinstance(bn, nn.BatchNorm2d):
+                setattr(parent, name, fuse_conv_bn_eval(module, bn))
+                setattr(parent, bn_name, nn.Identity())
+    return fused
+
+def build_model(tier=None, model_class=HandwritingModel):
+    """
+    Untrained model of a tier from config.MODEL_TIERS (default MODEL_TIER).
+    """
+    from config import NUM_CLASSES, HIDDEN_SIZE, NUM_LSTM_LAYERS, MODEL_TIER, MODEL_TIERS
+
+    tier = tier or MODEL_TIER
+    if tier not in MODEL_TIERS:
+        raise ValueError(f"Unknown model tier '{tier}' (choose from {', '.join(MODEL_TIERS)})")
+    return model_class(num_classes=NUM_CLASSES, hidden_size=HIDDEN_SIZE, num_layers=NUM_LSTM_LAYERS,
+                       **MODEL_TIERS[tier])
+
+def checkpoint_tier(checkpoint_path, default=None):
+    """
+    Tier recorded in the metadata.json published next to a checkpoint, else
+    `default` (MODEL_TIER if None).
+    """
+    from config import MODEL_TIER
+    from src.checkpoints import METADATA_FILE
+
+    try:
+        with open(os.path.join(os.path.dirname(checkpoint_path), METADATA_FILE)) as f:
+            tier = json.load(f).get('tier')
+    except (OSError, ValueError, TypeError):
+        tier = None
+    return tier or default or MODEL_TIER
+
+def load_model(checkpoint_path=None, device="cpu", mmap=False, tier=None):
+    """
+    Build a HandwritingModel in eval mode and load weights if the checkpoint exists.
+    The architecture is `tier`, else the one the checkpoint was published
+    with (see checkpoint_tier), else MODEL_TIER.
+    With mmap=True the checkpoint is memory-mapped and the parameters are
+    assigned straight from it instead of being randomly initialized and copied.
+    """
+    if tier is None and checkpoint_path:
+        tier = checkpoint_tier(checkpoint_path)
+
+    def build():
+        return build_model(tier)
+
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        print(f"Loading weights from {checkpoint_path}")
+        if mmap:
+            state_dict = torch.load(checkpoint_path, map_location="cpu", mmap=True, weights_only=True)
+            with torch.device("meta"):
+                model = build()
+            model.load_state_dict(state_dict, assign=True)
+            model = model.to(device)
+        else:
+            model = build().to(device)
+            model.load_state_dict(torch.load(checkpoint_path, map_location=device))
+    else:
+        print("Warning: Model weights not found. Predictions will be random.")
+        model = build().to(device)
+    model.eval()
+    return model
 
 if __name__ == "__main__":
     from config import NUM_CLASSES
@@ -0,0 +1,227 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+# Add the project root to the python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+import torch
+
+from config import *
+from src.batching import bucket_batches
+from src.dataset import resize_to_height
+from src.metrics import STAGE_LATENCY, BATCH_SIZES
+from src.utils import ctc_collapse
+
+# Full-page recognition:
+#   1. Otsu-binarize the page and find text lines from the horizontal ink profile
+#   2. split each line into words from its vertical ink profile (letter
+#      gaps are bridged, word gaps are not)
+#   3. cut crops wider than the widest bucket into overlapping windows
+#   4. run every crop through the model, batched per width bucket
+#   5. stitch the windows' best-path frames together at the middle of each
+#      overlap, then collapse to text
+# Lines that touch (no blank row between them) come out as one line.
+
+MIN_LINE_HEIGHT = 6  # pixels; thinner ink bands are treated as noise
+CROP_MARGIN = 0.1  # fraction of the line height kept around each word
+
+def binarize(gray):
+    """
+    (H, W) uint8 page -> uint8 mask with ink = 1, for dark-on-light or
+    light-on-dark pages.
+    """
+    flags = cv2.THRESH_BINARY_INV if gray.mean() > 127 else cv2.THRESH_BINARY
+    _, mask = cv2.threshold(gray, 0, 1, flags | cv2.THRESH_OTSU)
+    return mask
+
+def _runs(active, min_gap=1):
+    """
+    [start, end) runs of True in a 1-D bool array; runs separated by fewer
+    than `min_gap` False entries are merged.
+    """
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], active.astype(np.int8), [0]))))
+    runs = []
+    for start, end in edges.reshape(-1, 2).tolist():
+        if runs and start - runs[-1][1] < min_gap:
+            runs[-1][1] = end
+        else:
+            runs.append([start, end])
+    return runs
+
+def find_lines(mask, min_height=MIN_LINE_HEIGHT):
+    """
+    [y0, y1) bands of text lines from the horizontal projection profile.
+    Thin fragments (i-dots, stray descenders) are attached to the nearest line
+    if close enough, otherwise dropped.
+    """
+    profile = mask.sum(axis=1)
+    bands = _runs(profile >= max(1, mask.shape[1] // 500), min_gap=2)
+    if not bands:
+        return []
+    typical = np.median([end - start for start, end in bands])
+    lines = [band for band in bands if band[1] - band[0] >= max(min_height, typical / 2)]
+    for start, end in bands:
+        if not lines or end - start >= max(min_height, typical / 2):
+            continue
+        nearest = min(lines, key=lambda line: max(line[0] - end, start - line[1]))
+        if max(nearest[0] - end, start - nearest[1]) <= typical / 2:
+            nearest[0], nearest[1] = min(nearest[0], start), max(nearest[1], end)
+    return [tuple(line) for line in lines]
+
+def find_words(mask, line):
+    """
+    (x0, y0, x1, y1) page boxes of the words in a line band, left to right:
+    runs of inked columns, with gaps narrower than PAGE_WORD_GAP line heights
+    bridged (letter spacing) and wider ones kept (word spacing).
+    """
+    y0, y1 = line
+    band = mask[y0:y1]
+    gap = max(1, int(round(PAGE_WORD_GAP * (y1 - y0))))
+    min_ink = max(2, (y1 - y0) // 4)
+
+    words = []
+    for x0, x1 in _runs(band.any(axis=0), min_gap=gap):
+        word = band[:, x0:x1]
+        if word.sum() < min_ink:
+            continue
+        rows = np.flatnonzero(word.any(axis=1))
+        words.append((x0, y0 + int(rows[0]), x1, y0 + int(rows[-1]) + 1))
+    return words
+
+def window_spans(width, height):
+    """
+    [x0, x1) windows covering a crop so that each one fits the widest bucket
+    at IMG_HEIGHT, overlapping by PAGE_WINDOW_OVERLAP model pixels.
+    """
+    scale = IMG_HEIGHT / max(height, 1)
+    window = max(1, int(WIDTH_BUCKETS[-1] / scale))
+    if width <= window:
+        return [(0, width)]
+    overlap = min(int(PAGE_WINDOW_OVERLAP / scale), window // 2)
+    starts = list(range(0, width - window, window - overlap)) + [width - window]
+    return [(start, start + window) for start in starts]
+
+def stitch(spans, frames):
+    """
+    Merge the best-path labels of overlapping windows into one string. Each
+    window keeps the frames centred between the midpoints of its overlaps
+    with its neighbours, so every column of the crop is read exactly once.
+    """
+    merged = []
+    for k, ((x0, x1), labels) in enumerate(zip(spans, frames)):
+        lo = (spans[k - 1][1] + x0) / 2 if k > 0 else -np.inf
+        hi = (x1 + spans[k + 1][0]) / 2 if k + 1 < len(spans) else np.inf
+        centres = x0 + (np.arange(len(labels)) + 0.5) * (x1 - x0) / max(len(labels), 1)
+        merged.extend(labels[(centres >= lo) & (centres < hi)].tolist())
+    return ctc_collapse(merged)
+
+def recognize_crops(model, crops, device="cpu", batch_size=PAGE_BATCH_SIZE):
+    """
+    Best-path frame labels for every (H, W) uint8 crop, batched per width bucket.
+    """
+    tensors = [torch.from_numpy(resize_to_height(crop))[None, None] for crop in crops]
+    frames = [None] * len(tensors)
+    for positions, images, lengths in bucket_batches(tensors, max_batch_size=batch_size):
+        BATCH_SIZES.observe(len(positions), source='page')
+        with STAGE_LATENCY.time(stage='forward'), torch.no_grad():
+            output = model(images.to(device), lengths)
+        labels = output.argmax(dim=2).cpu().numpy()
+        for i, (p, length) in enumerate(zip(positions, lengths.tolist())):
+            frames[p] = labels[:length, i]
+    return frames
+
+def recognize_page(model, gray, device="cpu", batch_size=PAGE_BATCH_SIZE):
+    """
+    Recognize every line of a (H, W) uint8 grayscale page.
+    Returns {"text", "lines": [{"bbox", "text", "words": [{"bbox", "text"}]}],
+    "crops"} with boxes as [x, y, w, h] in page pixels.
+    """
+    height, width = gray.shape
+    with STAGE_LATENCY.time(stage='segment'):
+        mask = binarize(gray)
+        lines, crops = [], []
+        for y0, y1 in find_lines(mask):
+            margin = int(CROP_MARGIN * (y1 - y0)) + 1
+            cy0, cy1 = max(0, y0 - margin), min(height, y1 + margin)
+            words = []
+            for x0, wy0, x1, wy1 in find_words(mask, (y0, y1)):
+                # Crop the full line height so every word is read at the same scale
+                crop = gray[cy0:cy1, max(0, x0 - margin):min(width, x1 + margin)]
+                spans = window_spans(crop.shape[1], crop.shape[0])
+                words.append({'bbox': [x0, wy0, x1 - x0, wy1 - wy0], 'spans': spans, 'first': len(crops)})
+                crops.extend(crop[:, start:end] for start, end in spans)
+            if words:
+                x0 = min(w['bbox'][0] for w in words)
+                x1 = max(w['bbox'][0] + w['bbox'][2] for w in words)
+                lines.append({'bbox': [x0, y0, x1 - x0, y1 - y0], 'words': words})
+
+    frames = recognize_crops(model, crops, device=device, batch_size=batch_size) if crops else []
+
+    with STAGE_LATENCY.time(stage='ctc_decode'):
+        for line in lines:
+            for word in line['words']:
+                spans, first = word.pop('spans'), word.pop('first')
+                word['text'] = stitch(spans, frames[first:first + len(spans)])
+            line['text'] = " ".join(word['text'] for word in line['words'] if word['text'])
+    return {
+        'text': "\n".join(line['text'] for line in lines),
+        'lines': lines,
+        'crops': len(crops),
+    }
+
+def annotate(gray, result, path):
+    """
+    Save a copy of the page with line (blue) and word (green) boxes.
+    """
+    canvas = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+    for line in result['lines']:
+        x, y, w, h = line['bbox']
+        cv2.rectangle(canvas, (x, y), (x + w, y + h), (255, 0, 0), 1)
+        for word in line['words']:
+            x, y, w, h = word['bbox']
+            cv2.rectangle(canvas, (x, y), (x + w, y + h), (0, 160, 0), 1)
+    cv2.imwrite(path, canvas)
+
+def main():
+    from src.backends import load_backend
+    from src.model import load_model
+
+    parser = argparse.ArgumentParser(description="Recognize a full page or long line")
+    parser.add_argument('image')
+    parser.add_argument('--checkpoint', default=os.path.join(CHECKPOINT_DIR, "best_model.pth"))
+    parser.add_argument('--backend', default=INFERENCE_BACKEND,
+                        choices=['eager', 'scripted', 'compiled', 'onnxruntime', 'quantized'])
+    parser.add_argument('--batch-size', type=int, default=PAGE_BATCH_SIZE)
+    parser.add_argument('--output', default=None, help="Write the result as JSON")
+    parser.add_argument('--annotate', default=None, help="Write the page with detected boxes drawn")
+    args = parser.parse_args()
+
+    gray = cv2.imread(args.image, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        sys.exit(f"Could not read {args.image}")
+    model = load_model(args.checkpoint, device='cpu')
+    forward = load_backend(args.backend, model, artifact_dir=os.path.dirname(os.path.abspath(args.checkpoint)))
+
+    start = time.perf_counter()
+    result = recognize_page(forward, gray, batch_size=args.batch_size)
+    elapsed = (time.perf_counter() - start) * 1000.0
+
+    words = sum(len(line['words']) for line in result['lines'])
+    print(result['text'])
+    print(f"\n{len(result['lines'])} lines, {words} words, {result['crops']} crops in {elapsed:.0f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved result to {args.output}")
+    if args.annotate:
+        annotate(gray, result, args.annotate)
+        print(f"Saved boxes to {args.annotate}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import argparse
+import io
+import os
+import sys
+import time
+import warnings
+
+# Add the project root to the python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+import torch.nn as nn
+import torch.ao.quantization as tq
+
+from config import *
+from src.model import HandwritingModel, load_model, fold_batchnorm, mask_padding
+from src.backends import QUANTIZED_FILE
+from src.utils import decode_prediction, calculate_metrics
+from src.train import make_loader
+
+class QuantizableHandwritingModel(HandwritingModel):
+    """
+    HandwritingModel with quant/dequant stubs around the CNN so the conv
+    stack can be statically quantized while the sequence head stays float
+    (and its LSTM / GRU and Linear layers are dynamically quantized instead).
+    """
+    def __init__(self, num_classes, hidden_size=256, num_layers=2, **architecture):
+        super(QuantizableHandwritingModel, self).__init__(num_classes, hidden_size, num_layers, **architecture)
+        self.quant = tq.QuantStub()
+        self.dequant = tq.DeQuantStub()
+
+    def forward_features(self, x):
+        x = self.quant(x)
+        x = super(QuantizableHandwritingModel, self).forward_features(x)
+        return self.dequant(x)
+
+def quantize_model(model, calibration_loader, engine=QUANTIZATION_ENGINE):
+    """
+    Static int8 quantization of the conv layers (calibrated on real images)
+    followed by dynamic int8 quantization of the LSTM / GRU and Linear layers.
+    """
+    torch.backends.quantized.engine = engine
+
+    qmodel = QuantizableHandwritingModel(**model.architecture)
+    qmodel.load_state_dict(model.state_dict())
+    qmodel = fold_batchnorm(qmodel.cpu())
+
+    # Static quantization for the CNN only
+    qmodel.qconfig = tq.get_default_qconfig(engine)
+    for name in ('lstm', 'gru', 'temporal', 'fc'):
+        if hasattr(qmodel, name):
+            getattr(qmodel, name).qconfig = None
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        tq.prepare(qmodel, inplace=True)
+        with torch.no_grad():
+            for images, *_ in calibration_loader:
+                qmodel(images)
+        tq.convert(qmodel, inplace=True)
+
+        # Dynamic quantization for the sequence head
+        qmodel = tq.quantize_dynamic(qmodel, {nn.LSTM, nn.GRU, nn.Linear}, dtype=torch.qint8)
+    return qmodel.eval()
+
+def save_quantized(qmodel, path):
+    """
+    Serialize as TorchScript so the artifact loads without this module.
+    """
+    example = torch.zeros(2, 1, IMG_HEIGHT, IMG_WIDTH)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        traced = torch.jit.trace(qmodel, example, check_trace=False)
+        torch.jit.save(traced, path)
+    return traced
+
+def serialized_size_mb(module):
+    buffer = io.BytesIO()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        if isinstance(module, torch.jit.ScriptModule):
+            torch.jit.save(module, buffer)
+        else:
+            torch.save(module.state_dict(), buffer)
+    return buffer.tell() / 1e6
+
+def measure_latency(forward, batch_size=1, iterations=50):
+    """
+    Median wall-clock latency in milliseconds for one forward pass.
+    """
+    dummy = torch.rand(batch_size, 1, IMG_HEIGHT, IMG_WIDTH)
+    timings = []
+    with torch.no_grad():
+        for _ in range(5):
+            forward(dummy)
+        for _ in range(iterations):
+            start = time.perf_counter()
+            forward(dummy)
+            timings.append((time.perf_counter() - start) * 1000.0)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+def corpus_cer(forward, loader):
+    preds, targets = [], []
+    with torch.no_grad():
+        for images, _, input_lengths, _, texts in loader:
+            # Same padding treatment for both models: the traced int8 model
+            # takes no lengths, so neither packs and both mask the padding
+            preds.extend(decode_prediction(mask_padding(forward(images), input_lengths)))
+            targets.extend(texts)
+    return calculate_metrics(preds, targets)
+
+def main():
+    parser = argparse.ArgumentParser(description="Post-training int8 quantization for CPU inference")
+    parser.add_argument('--checkpoint', default=os.path.join(CHECKPOINT_DIR, "best_model.pth"))
+    parser.add_argument('--manifest', default=os.path.join(DATA_DIR, "val_manifest.txt"),
+                        help="Calibration / evaluation manifest")
+    parser.add_argument('--calibration-samples', type=int, default=256)
+    parser.add_argument('--eval-samples', type=int, default=0, help="0 evaluates the whole manifest")
+    parser.add_argument('--output', default=os.path.join(CHECKPOINT_DIR, QUANTIZED_FILE))
+    parser.add_argument('--engine', default=QUANTIZATION_ENGINE, choices=torch.backends.quantized.supported_engines)
+    args = parser.parse_args()
+
+    model = load_model(args.checkpoint, device='cpu')
+    calibration_loader = make_loader(args.manifest, args.calibration_samples)
+    eval_loader = make_loader(args.manifest, args.eval_samples)
+
+    print(f"Calibrating on {len(calibration_loader.dataset)} images from {args.manifest}")
+    qmodel = quantize_model(model, calibration_loader, engine=args.engine)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    traced = save_quantized(qmodel, args.output)
+    print(f"Saved quantized model to {args.output}")
+
+    rows = []
+    for name, forward in (('fp32', model), ('int8', traced)):
+        rows.append((
+            name,
+            serialized_size_mb(forward),
+            measure_latency(forward, batch_size=1),
+            measure_latency(forward, batch_size=MAX_BATCH_SIZE),
+            corpus_cer(forward, eval_loader),
+        ))
+
+    print(f"\n{'Model':<6} {'Size (MB)':>10} {'Lat bs=1 (ms)':>14} {f'Lat bs={MAX_BATCH_SIZE} (ms)':>15} {'CER':>8}")
+    for name, size, lat1, latn, cer in rows:
+        print(f"{name:<6} {size:>10.2f} {lat1:>14.2f} {latn:>15.2f} {cer:>8.4f}")
+
+    (_, size0, lat0, latn0, cer0), (_, size1, lat1, latn1, cer1) = rows
+    print(f"\nint8 is {size1 / size0:.2f}x the size of fp32, {lat0 / lat1:.2f}x faster at bs=1, "
+          f"{latn0 / latn1:.2f}x faster at bs={MAX_BATCH_SIZE}; CER delta {cer1 - cer0:+.4f}")
+
+if __name__ == "__main__":
+    main()
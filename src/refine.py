@@ -0,0 +1,303 @@
+import base64
+import http.client
+import importlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+
+from src.metrics import REFINEMENTS
+
+from config import (
+    NSR_DEADLINE_MS, NSR_MAX_CONCURRENCY, NSR_FAILURE_THRESHOLD,
+    NSR_RESET_TIMEOUT, NSR_MODEL,
+)
+
+# Load environment variables for NSR (Neural Sequence Refinement)
+load_dotenv()
+
+PROMPT = "Analyze and correct this handwriting sequence. Raw prediction: '{}'. Return only corrected text."
+
+class CircuitBreaker:
+    """
+    Skips refinement while the backend keeps failing or timing out.
+    After `failure_threshold` consecutive failures the circuit opens for
+    `reset_timeout` seconds, then lets a single trial request through.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def allow_request(self):
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                return True
+            return False
+
+    def cancel_trial(self):
+        """
+        Give back a trial granted by `allow_request` that was never sent, so
+        the next request can take it instead of the circuit staying half-open.
+        """
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._state = self.OPEN
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+class GeminiBackend:
+    """
+    Refinement through the Gemini API. The client is configured once and
+    reused for every request.
+    """
+    def __init__(self, api_key, model_name=NSR_MODEL):
+        lib = importlib.import_module('google.generativeai')
+        lib.configure(api_key=api_key)
+        self.engine = lib.GenerativeModel(model_name)
+
+    def refine(self, prediction, image_bytes, timeout):
+        query = [
+            PROMPT.format(prediction),
+            {"mime_type": "image/png", "data": image_bytes}
+        ]
+        result = self.engine.generate_content(query, request_options={'timeout': timeout})
+        return result.text.strip()
+
+class HTTPBackend:
+    """
+    Refinement through a plain JSON-over-HTTP service (see
+    scripts/nsr_stub_server.py). Keeps one persistent connection per thread.
+
+    Request:  POST {"prediction": "...", "image": "<base64 png>"}
+    Response: {"text": "..."}
+    """
+    def __init__(self, endpoint):
+        parts = urlsplit(endpoint)
+        self.scheme = parts.scheme or 'http'
+        self.netloc = parts.netloc
+        self.path = parts.path or '/'
+        self._local = threading.local()
+
+    def _connection(self, timeout):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+            conn = cls(self.netloc, timeout=timeout)
+            self._local.conn = conn
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn
+
+    def refine(self, prediction, image_bytes, timeout):
+        body = json.dumps({
+            'prediction': prediction,
+            'image': base64.b64encode(image_bytes).decode('ascii'),
+        }).encode()
+        conn = self._connection(timeout)
+        try:
+            conn.request('POST', self.path, body=body, headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            payload = response.read()
+        except Exception:
+            # Drop the broken connection so the next call reconnects
+            conn.close()
+            self._local.conn = None
+            raise
+        if response.status != 200:
+            raise RuntimeError(f"NSR backend returned HTTP {response.status}")
+        return json.loads(payload)['text'].strip()
+
+def backend_from_env():
+    """
+    Pick the refinement backend from the environment.
+    NSR_ENDPOINT selects the HTTP backend, otherwise NSR_API_KEY (or
+    GEMINI_API_KEY) selects Gemini. Returns None when refinement is disabled.
+    """
+    endpoint = os.getenv("NSR_ENDPOINT")
+    if endpoint:
+        return HTTPBackend(endpoint)
+    token = os.getenv("NSR_API_KEY") or os.getenv("GEMINI_API_KEY")
+    if token:
+        return GeminiBackend(token)
+    return None
+
+class NSRRefiner:
+    """
+    Managed Neural Sequence Refinement (NSR) stage.
+
+    - The backend client is built once, on first use, and reused.
+    - Calls run on a bounded thread pool; when every slot is busy the raw
+      prediction is returned immediately instead of queueing.
+    - Each call has a deadline after which the raw prediction is returned.
+    - A circuit breaker skips refinement while the backend is failing or slow.
+
+    `refine` returns (text, status), where status is one of 'refined',
+    'disabled', 'busy', 'circuit_open', 'timeout' or 'error'. Only 'refined'
+    and 'disabled' results are final and safe to cache.
+    """
+    FINAL_STATUSES = ('refined', 'disabled')
+
+    def __init__(self, backend_factory=backend_from_env, deadline_ms=NSR_DEADLINE_MS,
+                 max_concurrency=NSR_MAX_CONCURRENCY, breaker=None):
+        self.backend_factory = backend_factory
+        self.deadline = deadline_ms / 1000.0
+        self.max_concurrency = max_concurrency
+        self.breaker = breaker or CircuitBreaker(NSR_FAILURE_THRESHOLD, NSR_RESET_TIMEOUT)
+
+        self._backend = None
+        self._initialized = False
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._counts = {s: 0 for s in ('refined', 'disabled', 'busy', 'circuit_open', 'timeout', 'error')}
+
+    def _ensure_backend(self):
+        if self._initialized:
+            return self._backend
+        with self._lock:
+            if not self._initialized:
+                try:
+                    self._backend = self.backend_factory()
+                except Exception as e:
+                    print(f"NSR disabled: could not initialize backend ({e})")
+                    self._backend = None
+                if self._backend is not None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                        thread_name_prefix="nsr")
+                self._initialized = True
+        return self._backend
+
+    def _count(self, status):
+        REFINEMENTS.inc(status=status)
+        with self._lock:
+            self._counts[status] += 1
+
+    def _call(self, prediction, image_bytes):
+        try:
+            return self._backend.refine(prediction, image_bytes, self.deadline)
+        finally:
+            self._slots.release()
+
+    def submit(self, prediction, image_b64):
+        """
+        Start refinement without waiting. Returns a Future, or a status string
+        when the request was not sent to the backend.
+        """
+        if not image_b64 or self._ensure_backend() is None:
+            return 'disabled'
+        if ',' in image_b64:
+            image_b64 = image_b64.split(',')[1]
+        image_bytes = base64.b64decode(image_b64)
+
+        # Take a slot before asking the breaker: a half-open trial that is
+        # granted must reach the backend, or nothing would ever close or
+        # reopen the circuit.
+        if not self._slots.acquire(blocking=False):
+            return 'busy'
+        if not self.breaker.allow_request():
+            self._slots.release()
+            return 'circuit_open'
+        try:
+            return self._executor.submit(self._call, prediction, image_bytes)
+        except Exception:
+            self._slots.release()
+            self.breaker.cancel_trial()
+            raise
+
+    def collect(self, prediction, pending, deadline):
+        """
+        Resolve the result of `submit`, waiting until the absolute `deadline`
+        (time.monotonic()) at most.
+        """
+        if isinstance(pending, str):
+            self._count(pending)
+            return prediction, pending
+        try:
+            text = pending.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeout:
+            self.breaker.record_failure()
+            self._count('timeout')
+            return prediction, 'timeout'
+        except Exception:
+            self.breaker.record_failure()
+            self._count('error')
+            return prediction, 'error'
+
+        self.breaker.record_success()
+        self._count('refined')
+        return (text or prediction), 'refined'
+
+    def refine(self, prediction, image_b64=None):
+        deadline = time.monotonic() + self.deadline
+        try:
+            pending = self.submit(prediction, image_b64)
+        except Exception:
+            pending = 'error'
+        return self.collect(prediction, pending, deadline)
+
+    def refine_many(self, predictions, images_b64):
+        """
+        Refine several predictions concurrently under one shared deadline.
+        """
+        deadline = time.monotonic() + self.deadline
+        pending = []
+        for prediction, image_b64 in zip(predictions, images_b64):
+            try:
+                pending.append(self.submit(prediction, image_b64))
+            except Exception:
+                pending.append('error')
+        return [self.collect(p, f, deadline) for p, f in zip(predictions, pending)]
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        return {
+            'enabled': self._backend is not None if self._initialized else None,
+            'circuit': self.breaker.state,
+            'deadline_ms': int(self.deadline * 1000),
+            'max_concurrency': self.max_concurrency,
+            **counts,
+        }
+
+_default_refiner = None
+_default_lock = threading.Lock()
+
+def get_refiner():
+    """
+    Process-wide refiner shared by every request.
+    """
+    global _default_refiner
+    if _default_refiner is None:
+        with _default_lock:
+            if _default_refiner is None:
+                _default_refiner = NSRRefiner()
+    return _default_refiner
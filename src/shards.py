@@ -0,0 +1,324 @@
+import argparse
+import json
+import os
+import random
+import struct
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the project root to the python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+
+from config import *
+from src.checkpoints import atomic_write
+from src.dataset import bucket_width, collate_fn, resize_to_height
+from src.distributed import rank_and_world
+
+# Sharded record format for corpora that do not fit in memory.
+#
+#   <shard dir>/
+#     index.json            shard names and sample counts, preprocessing settings
+#     shard-00000.bin       records back to back: <u32 image bytes><u16 label bytes>
+#                           <PNG of the preprocessed 32 x W uint8 line><utf-8 label>
+#     shard-00000.idx.npz   record offsets and image widths, for seeking and bucketing
+#
+# Images are stored already resized and inverted (as training sees them), so
+# reading one is a PNG decode and nothing else. Training streams the shards
+# in order through a shuffle buffer; nothing proportional to the corpus size
+# is held in memory.
+
+SHARD_FORMAT = 1
+INDEX_FILE = "index.json"
+RECORD_HEADER = struct.Struct("<IH")
+
+def iter_manifest(manifest_path):
+    """
+    (image path, label) pairs of a manifest, read lazily. Paths resolve like
+    train.load_manifest: DATA_DIR/<train|val>/<file>.
+    """
+    split = "train" if "train" in os.path.basename(manifest_path) else "val"
+    with open(manifest_path, "r") as f:
+        for line in f:
+            parts = line.strip().split("\t")
+            if len(parts) == 2:
+                yield os.path.join(DATA_DIR, split, parts[0]), parts[1]
+
+def preprocessing():
+    # Settings the stored images depend on; a reader refuses other values
+    return {'img_height': IMG_HEIGHT, 'min_width': MIN_IMG_WIDTH, 'max_width': WIDTH_BUCKETS[-1]}
+
+def encode_record(path):
+    """
+    Read one line image and return (PNG bytes of the preprocessed uint8
+    image, its width).
+    """
+    img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        img = np.zeros((IMG_HEIGHT, IMG_WIDTH), dtype=np.uint8)
+    img = np.rint(resize_to_height(img) * 255.0).astype(np.uint8)
+    ok, png = cv2.imencode(".png", img)
+    if not ok:
+        raise ValueError(f"Could not encode {path}")
+    return png.tobytes(), img.shape[1]
+
+def write_shard(path, records):
+    """
+    Write [(png bytes, width, label)] as a shard plus its .idx.npz.
+    """
+    offsets, widths = [0], []
+    def write(f):
+        for png, width, label in records:
+            label = label.encode('utf-8')
+            f.write(RECORD_HEADER.pack(len(png), len(label)))
+            f.write(png)
+            f.write(label)
+            offsets.append(offsets[-1] + RECORD_HEADER.size + len(png) + len(label))
+            widths.append(width)
+    atomic_write(path, write)
+    atomic_write(path[:-len(".bin")] + ".idx.npz", lambda f: np.savez(
+        f, offsets=np.array(offsets, dtype=np.int64), widths=np.array(widths, dtype=np.int32)))
+
+def convert_manifest(manifest_path, output_dir, samples_per_shard=SHARD_SIZE, workers=None):
+    """
+    Convert a manifest into shards of `samples_per_shard` records. Images are
+    encoded on a thread pool one shard at a time, so memory stays at about
+    one shard whatever the manifest size. index.json is written last; a
+    directory without it is an unfinished conversion.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    shards = []
+    pending = []
+
+    def flush(pool):
+        name = f"shard-{len(shards):05d}.bin"
+        encoded = pool.map(encode_record, [path for path, _ in pending])
+        write_shard(os.path.join(output_dir, name),
+                    [(png, width, label) for (png, width), (_, label) in zip(encoded, pending)])
+        shards.append({'name': name, 'samples': len(pending)})
+        pending.clear()
+
+    # cv2 releases the GIL while decoding, resizing and encoding
+    with ThreadPoolExecutor(workers or os.cpu_count() or 1) as pool:
+        for entry in iter_manifest(manifest_path):
+            pending.append(entry)
+            if len(pending) == samples_per_shard:
+                flush(pool)
+        if pending:
+            flush(pool)
+
+    index = {'format': SHARD_FORMAT, 'preprocessing': preprocessing(),
+             'samples': sum(shard['samples'] for shard in shards), 'shards': shards}
+    atomic_write(os.path.join(output_dir, INDEX_FILE), lambda f: json.dump(index, f, indent=2), mode='w')
+    return index
+
+def read_records(path, start=0):
+    """
+    (png bytes, width, label) of every record of a shard from record
+    `start` on, read sequentially.
+    """
+    with np.load(path[:-len(".bin")] + ".idx.npz") as index:
+        offsets, widths = index['offsets'], index['widths']
+    with open(path, 'rb', buffering=1 << 20) as f:
+        f.seek(int(offsets[start]))
+        for width in widths[start:].tolist():
+            image_len, label_len = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+            png = f.read(image_len)
+            yield png, width, f.read(label_len).decode('utf-8')
+
+def decode_record(png, label):
+    image = cv2.imdecode(np.frombuffer(png, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    encoded = [CHAR_TO_IDX[char] for char in label if char in CHAR_TO_IDX]
+    return {
+        'image': torch.from_numpy(image[None]),
+        'label': torch.LongTensor(encoded),
+        'label_length': torch.IntTensor([len(encoded)]),
+        'text': label
+    }
+
+class ShardedDataset(IterableDataset):
+    """
+    Streams width-bucketed batches (lists of items for collate_fn) from a
+    shard directory.
+
+    Each epoch the shard order is shuffled with the same seed on every
+    process, and shard i goes to consumer i % consumers, where there is one
+    consumer per DataLoader worker per distributed rank. A consumer reads
+    its shards sequentially through a shuffle buffer of `buffer_size`
+    records. Records leaving the buffer are grouped by width bucket into
+    batches. A consumer's batch sequence is fully determined by
+    (seed, epoch, consumer), so resuming only needs the number of batches
+    each consumer had delivered. Skipped batches are read but never decoded.
+    The DataLoader takes batches from its workers round-robin, starting at
+    worker 0; `worker_offset` rotates which consumer worker 0 plays, so a
+    resumed epoch continues the interleave where it stopped.
+
+    Iterate through ShardLoader, which keeps track of that position.
+    """
+    def __init__(self, shard_dir, batch_size, shuffle=True, buffer_size=SHUFFLE_BUFFER,
+                 drop_last=False, seed=0):
+        with open(os.path.join(shard_dir, INDEX_FILE)) as f:
+            index = json.load(f)
+        if index['format'] != SHARD_FORMAT or index['preprocessing'] != preprocessing():
+            raise ValueError(f"Shards in {shard_dir} were written with different preprocessing "
+                             f"({index['preprocessing']}); convert the manifest again")
+        self.shard_dir = shard_dir
+        self.shards = [shard['name'] for shard in index['shards']]
+        self.samples = index['samples']
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size if shuffle else 0
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self.resume = {}  # consumer -> batches already delivered this epoch
+        self.worker_offset = 0  # consumer slot of DataLoader worker 0 (per rank)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def consumer(self):
+        """
+        (this consumer's id, number of consumers).
+        """
+        rank, world_size = rank_and_world()
+        info = get_worker_info()
+        workers = info.num_workers if info is not None else 1
+        worker = (info.id + self.worker_offset) % workers if info is not None else 0
+        return rank * workers + worker, world_size * workers
+
+    def shard_order(self):
+        order = list(range(len(self.shards)))
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(order)
+        return order
+
+    def records(self, shards, rng):
+        """
+        Records of `shards` in order, mixed through the shuffle buffer.
+        """
+        buffer = []
+        for shard in shards:
+            for record in read_records(os.path.join(self.shard_dir, self.shards[shard])):
+                if len(buffer) < self.buffer_size:
+                    buffer.append(record)
+                    continue
+                if not buffer:
+                    yield record
+                    continue
+                k = rng.randrange(len(buffer))
+                yield buffer[k]
+                buffer[k] = record
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def batches(self, consumer, consumers):
+        """
+        Width-bucketed batches of one consumer, as lists of raw records.
+        """
+        rng = random.Random(f"{self.seed}-{self.epoch}-{consumer}")
+        pending = {}
+        for record in self.records(self.shard_order()[consumer::consumers], rng):
+            batch = pending.setdefault(bucket_width(record[1]), [])
+            batch.append(record)
+            if len(batch) == self.batch_size:
+                yield batch
+                pending[bucket_width(record[1])] = []
+        if not self.drop_last:
+            for bucket in sorted(pending):
+                if pending[bucket]:
+                    yield pending[bucket]
+
+    def __iter__(self):
+        consumer, consumers = self.consumer()
+        if consumers > len(self.shards) and consumer == 0:
+            print(f"Warning: {len(self.shards)} shards for {consumers} loader workers; some will sit idle")
+        skip = self.resume.get(consumer, 0)
+        for count, batch in enumerate(self.batches(consumer, consumers), 1):
+            if count <= skip:
+                continue
+            yield consumer, count, [decode_record(png, label) for png, _, label in batch]
+
+def _collate_tagged(batch):
+    consumer, count, items = batch
+    return consumer, count, collate_fn(items)
+
+class ShardLoader:
+    """
+    DataLoader over a ShardedDataset that records how far each consumer has
+    got, for state_dict() / load_state_dict() mid-epoch resumption. Yields
+    the same batches as the map-style loaders:
+    (images, labels, input_lengths, label_lengths, texts).
+    """
+    def __init__(self, dataset, num_workers=0):
+        self.dataset = dataset
+        self.num_workers = num_workers
+        # Not persistent: workers must pick up set_epoch() and resume
+        # positions, which only reach them when they are started
+        self.loader = DataLoader(dataset, batch_size=None, collate_fn=_collate_tagged,
+                                 num_workers=num_workers)
+        self.positions = {}
+        self.next_worker = 0  # consumer slot the DataLoader yields from next
+
+    def consumers(self):
+        return rank_and_world()[1] * max(1, self.num_workers)
+
+    def set_epoch(self, epoch):
+        self.dataset.set_epoch(epoch)
+        self.dataset.resume = {}
+        self.dataset.worker_offset = 0
+
+    def __iter__(self):
+        self.positions = dict(self.dataset.resume)
+        self.next_worker = self.dataset.worker_offset
+        workers = max(1, self.num_workers)
+        # Starting the DataLoader draws a seed from the global RNG; keep the
+        # training RNG stream independent of it (see train.train_epoch)
+        with torch.random.fork_rng(devices=[]):
+            batches = iter(self.loader)
+        for consumer, count, batch in batches:
+            self.positions[consumer] = count
+            self.next_worker = (consumer % workers + 1) % workers
+            yield batch
+        # Epoch finished: a new iteration starts from the beginning
+        self.dataset.resume = {}
+        self.dataset.worker_offset = 0
+
+    def state_dict(self):
+        return {'epoch': self.dataset.epoch, 'consumers': self.consumers(),
+                'batches': {str(consumer): count for consumer, count in self.positions.items()},
+                'next_worker': {str(rank_and_world()[0]): self.next_worker}}
+
+    def load_state_dict(self, state):
+        self.dataset.set_epoch(state['epoch'])
+        if state['consumers'] != self.consumers():
+            print(f"Warning: loader position was saved with {state['consumers']} consumers, now "
+                  f"{self.consumers()}; restarting epoch {state['epoch']} from its beginning")
+            self.dataset.resume = {}
+            self.dataset.worker_offset = 0
+            return
+        self.dataset.resume = {int(consumer): count for consumer, count in state['batches'].items()}
+        self.dataset.worker_offset = state.get('next_worker', {}).get(str(rank_and_world()[0]), 0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert manifests to sharded records")
+    parser.add_argument('--manifest', default=os.path.join(DATA_DIR, "train_manifest.txt"))
+    parser.add_argument('--output', default=None, help="Defaults to DATA_DIR/shards/<manifest name>")
+    parser.add_argument('--samples-per-shard', type=int, default=SHARD_SIZE)
+    parser.add_argument('--workers', type=int, default=None, help="Encoding threads (default: all cores)")
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(DATA_DIR, "shards", os.path.splitext(os.path.basename(args.manifest))[0])
+    start = time.perf_counter()
+    index = convert_manifest(args.manifest, output, args.samples_per_shard, args.workers)
+    size_mb = sum(os.path.getsize(os.path.join(output, shard['name'])) for shard in index['shards']) / 1e6
+    print(f"Wrote {index['samples']} samples in {len(index['shards'])} shards ({size_mb:.1f} MB) to {output} "
+          f"in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
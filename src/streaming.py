@@ -0,0 +1,199 @@
+import math
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+import torch.nn as nn
+from PIL import Image
+
+from src.utils import decode_prediction
+
+def _width(value):
+    return value[1] if isinstance(value, tuple) else value
+
+def column_geometry(model):
+    """
+    Horizontal receptive field of one CNN output column.
+    Returns (stride, left, right): feature column j depends on input columns
+    [stride * j + left, stride * j + right].
+    Assumes conv/pool layers are registered in the order they are applied.
+    """
+    layers = [
+        (_width(m.kernel_size), _width(m.stride or m.kernel_size), _width(m.padding))
+        for m in model.modules() if isinstance(m, (nn.Conv2d, nn.MaxPool2d))
+    ]
+    left, right, stride = 0, 0, 1
+    for kernel, step, padding in reversed(layers):
+        left = left * step - padding
+        right = right * step - padding + kernel - 1
+        stride *= step
+    return stride, left, right
+
+class UnknownSessionError(LookupError):
+    """
+    A delta patch arrived for a session this process does not hold (it was
+    evicted, or never started here). The client must resend a full frame.
+    """
+
+class StreamingSession:
+    def __init__(self):
+        self.canvas = None
+        self.input_tensor = None
+        self.features = None
+        self.features_model = None  # Model that computed `features`
+        self.prediction = ''
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.subscribers = []
+
+    def publish(self, event):
+        for subscriber in list(self.subscribers):
+            subscriber.put(event)
+
+class IncrementalRecognizer:
+    """
+    Live transcription of a canvas that is updated stroke by stroke.
+
+    Each session keeps the full-resolution canvas, the preprocessed input and
+    the cached conv1..conv5 activations. On an update only the feature columns
+    whose receptive field overlaps the changed input columns are recomputed
+    (on a column crop with enough context to be exact); the cached columns
+    are reused and the LSTM head is re-run over the spliced sequence.
+    """
+    def __init__(self, model, preprocess, max_sessions=256, session_ttl=300):
+        self.model = model
+        self.preprocess = preprocess
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.stride, self.left, self.right = column_geometry(model)
+
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def session(self, session_id, create=True):
+        now = time.monotonic()
+        with self._lock:
+            # Drop idle sessions, then the least recently used beyond the limit
+            for key in [k for k, s in self._sessions.items() if now - s.last_used > self.session_ttl]:
+                del self._sessions[key]
+            session = self._sessions.get(session_id)
+            if session is None and create:
+                session = self._sessions[session_id] = StreamingSession()
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            if session is not None:
+                session.last_used = now
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def adopt_sessions(self, other):
+        """
+        Take over the live sessions of another recognizer (after a model swap).
+        Canvases are kept; cached features are recomputed with this model.
+        """
+        with other._lock:
+            self._sessions = other._sessions
+            self._lock = other._lock
+
+    def close(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def dirty_columns(self, old_tensor, new_tensor):
+        """
+        Range [first, last] of input columns that changed, or None.
+        """
+        if old_tensor is None or old_tensor.shape != new_tensor.shape:
+            return 0, new_tensor.size(3) - 1
+        changed = (old_tensor != new_tensor).flatten(0, 2).any(dim=0).nonzero()
+        if changed.numel() == 0:
+            return None
+        return changed.min().item(), changed.max().item()
+
+    def update_features(self, session, input_tensor):
+        """
+        Recompute only the affected feature columns. Returns how many were recomputed.
+        """
+        if (session.features is None or session.features_model is not self.model
+                or session.input_tensor.shape != input_tensor.shape):
+            session.features = self.model.forward_features(input_tensor)
+            session.features_model = self.model
+            return session.features.size(3)
+
+        dirty = self.dirty_columns(session.input_tensor, input_tensor)
+        if dirty is None:
+            return 0
+
+        width = input_tensor.size(3)
+
+        num_columns = session.features.size(3)
+        first, last = dirty
+        col_start = max(0, math.ceil((first - self.right) / self.stride))
+        col_end = min(num_columns - 1, (last - self.left) // self.stride)
+
+        # Input crop covering the receptive field of the recomputed columns,
+        # aligned to the stride so pooling windows line up with the full image
+        crop_start = max(0, (self.stride * col_start + self.left) // self.stride * self.stride)
+        crop_end = min(width, math.ceil((self.stride * col_end + self.right + 1) / self.stride) * self.stride)
+
+        partial = self.model.forward_features(input_tensor[..., crop_start:crop_end])
+        offset = crop_start // self.stride
+        session.features[..., col_start:col_end + 1] = partial[..., col_start - offset:col_end - offset + 1]
+        return col_end - col_start + 1
+
+    def update(self, session_id, patch, x=0, y=0, canvas_size=None, reset=False):
+        """
+        Paste a PIL image patch onto the session canvas at (x, y) and return
+        the running prediction. `canvas_size` (width, height) is required when
+        a session starts or is reset; a patch at (0, 0) covering the whole
+        canvas is treated as a full frame.
+
+        Raises UnknownSessionError for a non-reset patch when the session has
+        no canvas, rather than pasting the delta onto a blank one.
+        """
+        session = self.session(session_id, create=reset)
+        if session is None:
+            raise UnknownSessionError(session_id)
+        with session.lock:
+            if not reset and session.canvas is None:
+                raise UnknownSessionError(session_id)
+            if reset:
+                if canvas_size is None:
+                    canvas_size = patch.size
+                session.canvas = Image.new('L', tuple(canvas_size), 255)
+                session.input_tensor = None
+                session.features = None
+
+            session.canvas.paste(patch.convert('L'), (int(x), int(y)))
+            input_tensor = self.preprocess(session.canvas)
+
+            with torch.no_grad():
+                recomputed = self.update_features(session, input_tensor)
+                session.input_tensor = input_tensor
+                if recomputed or not session.prediction:
+                    output = self.model.forward_sequence(session.features)
+                    session.prediction = decode_prediction(output)[0]
+
+            event = {
+                'prediction': session.prediction,
+                'recomputed_columns': recomputed,
+                'total_columns': session.features.size(3),
+            }
+            session.publish(event)
+            return event
+
+    def subscribe(self, session_id):
+        session = self.session(session_id)
+        subscriber = queue.Queue()
+        with session.lock:
+            session.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, session_id, subscriber):
+        session = self.session(session_id, create=False)
+        if session is not None:
+            with session.lock:
+                if subscriber in session.subscribers:
+                    session.subscribers.remove(subscriber)
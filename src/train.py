@@ -1,19 +1,32 @@
+import argparse
+import contextlib
 import os
+import random
 import sys
+import time
 
 # Add the project root to the python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import numpy as np
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import torch.optim as optim
+from torch.nn.parallel import DistributedDataParallel
 from torch.utils.data import DataLoader
 from tqdm import tqdm
 
 from config import *
-from src.model import HandwritingModel
-from src.dataset import HandwritingDataset, collate_fn
-from src.utils import decode_prediction, calculate_metrics
+from config import DEVICE
+from src.model import build_model, load_model, checkpoint_tier, input_widths
+from src.dataset import HandwritingDataset, PackedHandwritingDataset, BucketBatchSampler, collate_fn
+from src.utils import decode_prediction, cer_counts
+from src import distributed
+from src.checkpoints import publish_checkpoint, AsyncCheckpointer, latest_training_state, load_training_state
+from src.shards import ShardedDataset, ShardLoader
+from src.train_monitor import TrainingMonitor
+from src.augment import BatchAugmenter
 
 def load_manifest(manifest_path):
     image_paths = []
@@ -29,87 +42,434 @@ def load_manifest(manifest_path):
                 labels.append(parts[1])
     return image_paths, labels
 
-def train():
-    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+def make_dataset(manifest_path):
+    """
+    Dataset for a manifest: its packed cache under DATA_DIR/cache (built or
+    refreshed as needed) when DATASET_CACHE is on, otherwise the PNGs.
+    """
+    image_paths, labels = load_manifest(manifest_path)
+    if not DATASET_CACHE:
+        return HandwritingDataset(image_paths, labels)
+    name = os.path.splitext(os.path.basename(manifest_path))[0]
+    return PackedHandwritingDataset.open(image_paths, labels, os.path.join(DATA_DIR, "cache", name))
+
+def make_loader(manifest, num_samples, batch_size=BATCH_SIZE, num_workers=0):
+    """
+    In-order, width-bucketed DataLoader over the first `num_samples` images
+    of a manifest (all of them if falsy), for evaluation and calibration.
+    """
+    paths, labels = load_manifest(manifest)
+    if num_samples:
+        paths, labels = paths[:num_samples], labels[:num_samples]
+    dataset = HandwritingDataset(paths, labels)
+    sampler = BucketBatchSampler(dataset.widths(), batch_size, shuffle=False)
+    return DataLoader(dataset, batch_sampler=sampler, collate_fn=collate_fn,
+                      num_workers=num_workers, persistent_workers=num_workers > 0)
+
+def autocast(precision=TRAIN_PRECISION):
+    """
+    Autocast context for the forward pass: bf16 for "bf16", a no-op for "fp32".
+    """
+    return torch.autocast(device_type=DEVICE.type, dtype=torch.bfloat16, enabled=precision == "bf16")
+
+def prepare_images(images, channels_last=CHANNELS_LAST):
+    images = images.to(DEVICE)
+    if channels_last:
+        images = images.contiguous(memory_format=torch.channels_last)
+    return images
+
+def unwrap(model):
+    return model.module if isinstance(model, DistributedDataParallel) else model
+
+def rng_state():
+    state = {'python': random.getstate(), 'numpy': np.random.get_state(), 'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+def distillation_loss(student, teacher, lengths, temperature=DISTILL_TEMPERATURE):
+    """
+    Frame-level distillation for CTC: KL(teacher || student) between the
+    per-frame posteriors over all classes (blank included), averaged over
+    the frames inside each sample's length and scaled by temperature^2.
+    Both take (seq_len, batch, classes) log-probs; every tier has the same
+    frame rate, so the frames line up.
+    """
+    steps = torch.arange(student.size(0), device=student.device).unsqueeze(1)
+    valid = steps < lengths.to(student.device).unsqueeze(0)
+    student = (student[valid] / temperature).log_softmax(-1)
+    teacher = (teacher[valid].float() / temperature).log_softmax(-1)
+    return F.kl_div(student, teacher, reduction='batchmean', log_target=True) * temperature ** 2
+
+def train_epoch(model, loader, criterion, optimizer, desc=None, precision=TRAIN_PRECISION,
+                channels_last=CHANNELS_LAST, accum_steps=GRAD_ACCUM_STEPS, on_step=None, monitor=None, augment=None,
+                teacher=None, distill_alpha=DISTILL_ALPHA):
+    """
+    One pass over `loader`, stepping the optimizer every `accum_steps`
+    batches. The forward pass runs under autocast; the loss is computed in
+    fp32 and batches with a non-finite loss are skipped instead of
+    poisoning the accumulated gradients.
+    Returns {'loss', 'batches', 'samples', 'skipped', 'seconds'} for this
+    process. on_step(consumed), if given, is called after every optimizer
+    step with the number of batches taken from the loader so far. Each
+    batch is timed phase by phase on `monitor` (see src/train_monitor.py);
+    the epoch's totals are returned under 'phases'. `augment`, if given,
+    is applied to each batch on the device (see src/augment.py). With a
+    `teacher` model the loss mixes CTC with distillation_loss against its
+    posteriors on the same batch, distill_alpha weighting the latter.
+
+    With a DistributedDataParallel model, gradients are all-reduced only on
+    the batch that steps the optimizer, and all ranks stop together when
+    the first one runs out of batches, so they step the optimizer (and keep
+    its state) in lockstep. A batch is skipped on every rank when any rank
+    gets a non-finite loss for it.
+    """
+    ddp = isinstance(model, DistributedDataParallel)
+    model.train()
+    optimizer.zero_grad()
+    total_loss = 0.0
+    batches = samples = skipped = pending = consumed = 0
+    start = time.perf_counter()
+    monitor = monitor or TrainingMonitor()
+    monitor.start_epoch()
+
+    # Starting a DataLoader draws a seed from the global RNG; keep that draw
+    # out of the training RNG stream so a resumed run sees the same dropout
+    with torch.random.fork_rng(devices=[]):
+        iterator = iter(loader)
+    pbar = tqdm(distributed.lockstep(iterator) if ddp else iterator, desc=desc,
+                total=len(loader) if hasattr(loader, '__len__') else None,
+                disable=not distributed.is_main_process())
+    for batch in pbar:
+        monitor.lap('data')
+        images, labels, input_lengths, label_lengths, _ = batch
+        images = images.to(DEVICE)
+        labels = labels.to(DEVICE)
+        monitor.lap('h2d')
+        if augment is not None:
+            # Blank only the padding past each sample's width (recovered from
+            # its CTC length), not its own margin that warped ink may move into
+            images = augment(images, widths=input_widths(input_lengths))
+            monitor.lap('augment')
+        images = prepare_images(images, channels_last)
+        syncing = pending + 1 == accum_steps
+        consumed += 1
+
+        with model.no_sync() if ddp and not syncing else contextlib.nullcontext():
+            # Forward pass
+            with autocast(precision):
+                outputs = model(images, input_lengths) # (seq_len, batch_size, num_classes)
+                if teacher is not None:
+                    with torch.no_grad():
+                        teacher_outputs = teacher(images, input_lengths)
+            monitor.lap('forward')
+
+            # CTC Loss, outside autocast on fp32 log-probs
+            loss = criterion(outputs.float(), labels, input_lengths, label_lengths)
+            if teacher is not None:
+                loss = (1 - distill_alpha) * loss + distill_alpha * distillation_loss(
+                    outputs.float(), teacher_outputs, input_lengths)
+            monitor.lap('loss')
+            # Under DDP every rank skips if any rank's loss is not finite, so
+            # they all make the same backward / all-reduce calls
+            finite = torch.isfinite(loss).item()
+            if ddp:
+                finite = distributed.all_reduce_min(finite)
+            if not finite:
+                skipped += 1
+                monitor.lap('other')
+                continue
+
+            # Backward pass; gradients add up until the optimizer steps
+            (loss / accum_steps).backward()
+            monitor.lap('backward')
+        pending += 1
+        stepped = pending == accum_steps
+        if stepped:
+            optimizer.step()
+            optimizer.zero_grad()
+            pending = 0
+            monitor.lap('optimizer')
+            if on_step is not None:
+                on_step(consumed)
+
+        loss = loss.item()
+        total_loss += loss
+        batches += 1
+        samples += images.size(0)
+        pbar.set_postfix({'loss': loss})
+        monitor.end_step(images.size(0), loss, stepped, optimizer.param_groups[0]['lr'])
+    # Gradients left over at the end of the epoch were never all-reduced.
+    # Every rank joins in if any rank has some, so the weights stay in step.
+    if ddp and distributed.all_reduce_max(pending):
+        for param in model.parameters():
+            if param.grad is None:
+                param.grad = torch.zeros_like(param)
+            torch.distributed.all_reduce(param.grad)
+            param.grad /= distributed.rank_and_world()[1]
+        pending = 1
+    if pending:
+        optimizer.step()
+        optimizer.zero_grad()
+
+    return {
+        'loss': total_loss / max(batches, 1),
+        'batches': batches,
+        'samples': samples,
+        'skipped': skipped,
+        'seconds': time.perf_counter() - start,
+        'phases': dict(monitor.epoch_phases),
+    }
+
+def validate(model, loader, criterion, channels_last=CHANNELS_LAST):
+    """
+    Validation loss and corpus-level CER, in fp32 (as the model is served).
+    Under distributed training each rank scores its share of the batches
+    and the sums are all-reduced, so every rank gets the same numbers.
+    """
+    model = unwrap(model)
+    model.eval()
+    val_loss = 0
+    val_edits = 0
+    val_chars = 0
+
+    with torch.no_grad():
+        for batch in loader:
+            images, labels, input_lengths, label_lengths, texts = batch
+            labels = labels.to(DEVICE)
+
+            outputs = model(prepare_images(images, channels_last), input_lengths)
+            loss = criterion(outputs, labels, input_lengths, label_lengths)
+            val_loss += loss.item()
+
+            preds = decode_prediction(outputs, input_lengths)
+            edits, chars = cer_counts(preds, texts)
+            val_edits += edits
+            val_chars += chars
+
+    val_loss, val_batches, val_edits, val_chars = distributed.all_reduce_sum(val_loss, len(loader), val_edits, val_chars)
+    # Corpus-level CER: total edits over total characters
+    return val_loss / max(val_batches, 1), val_edits / val_chars if val_chars else 0
+
+def make_model(tier=MODEL_TIER):
+    model = build_model(tier).to(DEVICE)
+    if CHANNELS_LAST:
+        model = model.to(memory_format=torch.channels_last)
+    return model
+
+def make_teacher(checkpoint_path, tier=None):
+    """
+    Frozen model to distill from (its tier is read from the checkpoint's
+    metadata when not given, else "base").
+    """
+    if not os.path.exists(checkpoint_path):
+        raise FileNotFoundError(f"Teacher checkpoint {checkpoint_path} not found")
+    teacher = load_model(checkpoint_path, device=DEVICE, tier=tier or checkpoint_tier(checkpoint_path, default="base"))
+    if CHANNELS_LAST:
+        teacher = teacher.to(memory_format=torch.channels_last)
+    for param in teacher.parameters():
+        param.requires_grad_(False)
+    return teacher
+
+def train(resume=None, tier=MODEL_TIER, teacher=None, teacher_tier=None, checkpoint_dir=CHECKPOINT_DIR):
+    """
+    Train, in one process or, when launched by torchrun, as one rank of a
+    data-parallel job (see src/distributed.py). Only rank 0 logs and
+    publishes checkpoints.
+    resume: a training-state checkpoint to continue from, or "latest" for
+    the newest one under checkpoint_dir/training.
+    tier: the architecture to train (config.MODEL_TIERS).
+    teacher: a checkpoint to distill from instead of training on the
+    labels alone (see distillation_loss).
+    """
+    distributed.setup()
+    try:
+        _train(resume, tier, teacher, teacher_tier, checkpoint_dir)
+    finally:
+        distributed.cleanup()
+
+def _train(resume=None, tier=MODEL_TIER, teacher_path=None, teacher_tier=None, checkpoint_dir=CHECKPOINT_DIR):
+    is_main = distributed.is_main_process()
+    rank, world_size = distributed.rank_and_world()
+    os.makedirs(checkpoint_dir, exist_ok=True)
     
     # Load data
     train_manifest = os.path.join(DATA_DIR, "train_manifest.txt")
     val_manifest = os.path.join(DATA_DIR, "val_manifest.txt")
     
-    if not os.path.exists(train_manifest):
+    if not os.path.exists(val_manifest) or not (TRAIN_SHARDS or os.path.exists(train_manifest)):
         print("Data manifests not found. Please run scripts/generate_data.py first.")
         return
 
-    train_imgs, train_labels = load_manifest(train_manifest)
-    val_imgs, val_labels = load_manifest(val_manifest)
-    
-    train_dataset = HandwritingDataset(train_imgs, train_labels)
-    val_dataset = HandwritingDataset(val_imgs, val_labels)
-    
-    train_loader = DataLoader(train_dataset, batch_size=BATCH_SIZE, shuffle=True, collate_fn=collate_fn)
-    val_loader = DataLoader(val_dataset, batch_size=BATCH_SIZE, shuffle=False, collate_fn=collate_fn)
+    # Width-bucketed batches keep padding to at most one bucket step. Each
+    # rank reads its own share of the batches (or shards).
+    with distributed.main_process_first():
+        if TRAIN_SHARDS:
+            # Streamed: batches are bucketed inside the dataset
+            train_loader = ShardLoader(ShardedDataset(TRAIN_SHARDS, BATCH_SIZE, shuffle=True), num_workers=NUM_WORKERS)
+            train_sampler = train_loader
+        else:
+            train_dataset = make_dataset(train_manifest)
+            train_sampler = BucketBatchSampler(train_dataset.widths(), BATCH_SIZE, shuffle=True)
+            train_loader = DataLoader(train_dataset, batch_sampler=train_sampler, collate_fn=collate_fn,
+                                      num_workers=NUM_WORKERS)
+        val_dataset = make_dataset(val_manifest)
+    val_sampler = BucketBatchSampler(val_dataset.widths(), BATCH_SIZE, shuffle=False)
+    val_loader = DataLoader(val_dataset, batch_sampler=val_sampler, collate_fn=collate_fn)
     
     # Model, Loss, Optimizer
-    model = HandwritingModel(num_classes=NUM_CLASSES, hidden_size=HIDDEN_SIZE).to(DEVICE)
+    model = make_model(tier)
+    teacher = make_teacher(teacher_path, teacher_tier) if teacher_path else None
+    if distributed.is_distributed():
+        # Starts every rank from rank 0's weights; gradients are averaged in backward
+        model = DistributedDataParallel(model)
     criterion = nn.CTCLoss(blank=0, zero_infinity=True)
     optimizer = optim.Adam(model.parameters(), lr=LEARNING_RATE)
+    # Ranks draw different augmentations
+    augmenter = BatchAugmenter(seed=None if AUGMENT_SEED is None else AUGMENT_SEED + rank) if AUGMENT else None
+    if is_main and TRAIN_PRECISION == "bf16" and DEVICE.type == "cpu" and not torch.ops.mkldnn._is_mkldnn_bf16_supported():
+        print("Warning: this CPU has no native bf16 support; bf16 training will be slower than fp32")
+    if is_main:
+        ranks = f" on {world_size} processes ({torch.get_num_threads()} threads each)" if world_size > 1 else ""
+        print(f"Training in {TRAIN_PRECISION}{' (channels_last)' if CHANNELS_LAST else ''}{ranks}, "
+              f"effective batch size {BATCH_SIZE * GRAD_ACCUM_STEPS * world_size}"
+              f"{', with batch augmentation' if AUGMENT else ''}")
+        print(f"Model tier '{tier}': {sum(p.numel() for p in model.parameters()):,} parameters"
+              f"{f', distilled from {teacher_path}' if teacher is not None else ''}")
     
     best_val_loss = float('inf')
+    start_epoch = 0
+    step = 0
+    position = None  # where in start_epoch the loader resumes
     
-    for epoch in range(EPOCHS):
-        model.train()
-        train_loss = 0
-        
-        pbar = tqdm(train_loader, desc=f"Epoch {epoch+1}/{EPOCHS}")
-        for batch in pbar:
-            images, labels, input_lengths, label_lengths, _ = batch
-            images = images.to(DEVICE)
-            labels = labels.to(DEVICE)
-            
-            optimizer.zero_grad()
-            
-            # Forward pass
-            outputs = model(images) # (seq_len, batch_size, num_classes)
-            
-            # CTC Loss
-            loss = criterion(outputs, labels, input_lengths, label_lengths)
-            
-            # Backward pass
-            loss.backward()
-            optimizer.step()
-            
-            train_loss += loss.item()
-            pbar.set_postfix({'loss': loss.item()})
-            
-        # Validation
-        model.eval()
-        val_loss = 0
-        val_cer = 0
-        
-        with torch.no_grad():
-            for batch in val_loader:
-                images, labels, input_lengths, label_lengths, texts = batch
-                images = images.to(DEVICE)
-                labels = labels.to(DEVICE)
-                
-                outputs = model(images)
-                loss = criterion(outputs, labels, input_lengths, label_lengths)
-                val_loss += loss.item()
-                
-                preds = decode_prediction(outputs)
-                val_cer += calculate_metrics(preds, texts)
-                
-        avg_train_loss = train_loss / len(train_loader)
-        avg_val_loss = val_loss / len(val_loader)
-        avg_cer = val_cer / len(val_loader)
+    state = None
+    if resume:
+        path = latest_training_state(checkpoint_dir) if resume == "latest" else resume
+        if path is None:
+            if is_main:
+                print(f"No training state under {checkpoint_dir} to resume from; starting from scratch")
+        else:
+            state = load_training_state(path)
+            unwrap(model).load_state_dict(state['model'])
+            optimizer.load_state_dict(state['optimizer'])
+            start_epoch, step, best_val_loss = state['epoch'], state['step'], state['best_val_loss']
+            position = state['position']
+            if augmenter is not None and state.get('augment'):
+                augment_states = state['augment']
+                augmenter.load_state_dict(augment_states[rank] if len(augment_states) == world_size else augment_states[0])
+            if is_main:
+                print(f"Resuming from {path} (epoch {start_epoch + 1}, step {step})")
+    
+    # Full training state, written in the background by rank 0
+    checkpointer = AsyncCheckpointer(checkpoint_dir, keep=TRAIN_CHECKPOINT_KEEP) if is_main else None
+    
+    def save_state(epoch, position):
+        # Collective: every rank contributes its RNG state and stream position
+        rng_states = distributed.all_gather_object(rng_state())
+        augment_states = distributed.all_gather_object(augmenter.state_dict()) if augmenter is not None else None
+        if TRAIN_SHARDS and position is not None:
+            position = train_loader.state_dict()
+            gathered = distributed.all_gather_object((position['batches'], position['next_worker']))
+            position['batches'] = {consumer: count for positions, _ in gathered for consumer, count in positions.items()}
+            position['next_worker'] = {rank: slot for _, next_worker in gathered for rank, slot in next_worker.items()}
+        if is_main:
+            checkpointer.save(step, {
+                'model': unwrap(model).state_dict(),
+                'optimizer': optimizer.state_dict(),
+                'epoch': epoch,
+                'step': step,
+                'best_val_loss': best_val_loss,
+                'position': position,
+                'rng': rng_states,
+                'augment': augment_states,
+            })
+    
+    def on_step(consumed):
+        nonlocal step
+        step += 1
+        if TRAIN_CHECKPOINT_STEPS and step % TRAIN_CHECKPOINT_STEPS == 0:
+            already = position['batches'] if position is not None and not TRAIN_SHARDS else 0
+            save_state(epoch, {'epoch': epoch, 'batches': already + consumed})
+    
+    # Phase timings for every rank; rank 0 also writes them under LOG_DIR
+    run_dir = os.path.join(LOG_DIR, time.strftime("%Y%m%d-%H%M%S"))
+    monitor = TrainingMonitor(run_dir if is_main else None, step=step, sync_cuda=DEVICE.type == "cuda")
+    if is_main:
+        print(f"Logging training metrics to {run_dir}")
+    
+    if state is not None:
+        # Restored last: building the loaders and model above draws random numbers
+        rng_states = state['rng']
+        set_rng_state(rng_states[rank] if len(rng_states) == world_size else rng_states[0])
+    
+    for epoch in range(start_epoch, EPOCHS):
+        train_sampler.set_epoch(epoch)
+        if position is not None and epoch == start_epoch:
+            train_sampler.load_state_dict(position)
+        else:
+            position = None
+        stats = train_epoch(model, train_loader, criterion, optimizer, desc=f"Epoch {epoch+1}/{EPOCHS}",
+                            on_step=on_step, monitor=monitor, augment=augmenter, teacher=teacher)
+        val_start = time.perf_counter()
+        avg_val_loss, avg_cer = validate(model, val_loader, criterion)
+        val_seconds = distributed.all_reduce_max(time.perf_counter() - val_start)
         
-        print(f"Epoch {epoch+1}: Train Loss: {avg_train_loss:.4f}, Val Loss: {avg_val_loss:.4f}, Val CER: {avg_cer:.4f}")
+        loss_sum, batches, skipped = distributed.all_reduce_sum(
+            stats['loss'] * stats['batches'], stats['batches'], stats['skipped'])
+        avg_train_loss = loss_sum / max(batches, 1)
+        if is_main:
+            skipped = f", {int(skipped)} non-finite batches skipped" if skipped else ""
+            print(f"Epoch {epoch+1}: Train Loss: {avg_train_loss:.4f}, Val Loss: {avg_val_loss:.4f}, "
+                  f"Val CER: {avg_cer:.4f}{skipped}")
+        monitor.end_epoch(epoch + 1, {
+            'train_loss': avg_train_loss,
+            'val_loss': avg_val_loss,
+            'val_cer': avg_cer,
+            'val_seconds': val_seconds,
+            'lr': optimizer.param_groups[0]['lr'],
+        })
         
-        # Save best model
+        # Save best model (every rank sees the same validation numbers)
         if avg_val_loss < best_val_loss:
             best_val_loss = avg_val_loss
-            torch.save(model.state_dict(), os.path.join(CHECKPOINT_DIR, "best_model.pth"))
-            print("Checkpoint saved!")
+            if is_main:
+                # New version for running servers to pick up; also refreshes best_model.pth
+                version = publish_checkpoint(unwrap(model).state_dict(), checkpoint_dir, {
+                    'epoch': epoch + 1,
+                    'val_loss': avg_val_loss,
+                    'val_cer': avg_cer,
+                    'precision': TRAIN_PRECISION,
+                    'world_size': world_size,
+                    'tier': tier,
+                    **({'teacher': teacher_path} if teacher is not None else {}),
+                })
+                print(f"Checkpoint saved! (version {version})")
+        
+        # Resume point at the start of the next epoch
+        save_state(epoch + 1, None)
+    
+    if checkpointer is not None:
+        checkpointer.wait()
+    monitor.close()
 
 if __name__ == "__main__":
-    train()
+    parser = argparse.ArgumentParser(description="Train the handwriting recognition model")
+    parser.add_argument('--resume', nargs='?', const="latest", default=None,
+                        help="Continue from a training-state checkpoint (default: the latest in CHECKPOINT_DIR/training)")
+    parser.add_argument('--tier', default=MODEL_TIER, choices=list(MODEL_TIERS), help="Architecture to train")
+    parser.add_argument('--distill', default=None, metavar="TEACHER",
+                        help="Checkpoint of a larger model to distill from, e.g. checkpoints/best_model.pth")
+    parser.add_argument('--teacher-tier', default=None, choices=list(MODEL_TIERS),
+                        help="Teacher architecture (default: from its metadata, else base)")
+    parser.add_argument('--checkpoint-dir', default=CHECKPOINT_DIR,
+                        help="Where to publish checkpoints and keep training state; use one per tier")
+    args = parser.parse_args()
+    train(resume=args.resume, tier=args.tier, teacher=args.distill, teacher_tier=args.teacher_tier,
+          checkpoint_dir=args.checkpoint_dir)
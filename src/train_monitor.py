@@ -0,0 +1,172 @@
+import json
+import os
+import resource
+import sys
+import time
+
+import torch
+
+from config import INPUT_BOUND_THRESHOLD, LOG_EVERY_STEPS
+from src import distributed
+
+# Training instrumentation. Every batch is timed phase by phase:
+#
+#   data       waiting for the loader to hand over the batch
+#   h2d        copying it to the device
+#   augment    batch augmentation (src/augment.py)
+#   forward    model forward pass
+#   loss       CTC loss
+#   backward   backward pass (including the DDP gradient all-reduce)
+#   optimizer  optimizer step (only on batches that step it)
+#   other      bookkeeping: loss.item(), progress bar, checkpoint snapshots
+#
+# Every LOG_EVERY_STEPS optimizer steps the averages go to
+# LOG_DIR/<run>/metrics.jsonl and, if the tensorboard package is installed,
+# to TensorBoard in the same directory. Each epoch ends with a summary of
+# where the time went, flagging runs that mostly wait for data.
+
+PHASES = ('data', 'h2d', 'augment', 'forward', 'loss', 'backward', 'optimizer', 'other')
+
+def peak_memory_mb():
+    """
+    Peak memory of this process: the device allocator's peak on CUDA,
+    otherwise the peak resident set size.
+    """
+    if torch.cuda.is_available():
+        return torch.cuda.max_memory_allocated() / 2**20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+def summary_writer(log_dir):
+    try:
+        from torch.utils.tensorboard import SummaryWriter
+    except ImportError:
+        print("tensorboard is not installed; training metrics go to metrics.jsonl only")
+        return None
+    return SummaryWriter(log_dir)
+
+class TrainingMonitor:
+    """
+    Phase timer and metrics logger for the training loop. Call lap(phase)
+    after each phase of a batch (the time since the previous lap is
+    charged to it) and end_step() once the batch is done.
+    With log_dir=None nothing is written; the timings are still collected.
+    """
+    def __init__(self, log_dir=None, every=LOG_EVERY_STEPS, step=0, sync_cuda=False):
+        self.log_dir = log_dir
+        self.every = every
+        self.step = step  # optimizer steps so far (the x axis of every curve)
+        self.sync_cuda = sync_cuda and torch.cuda.is_available()
+        self.writer = None
+        self.jsonl = None
+        if log_dir is not None:
+            os.makedirs(log_dir, exist_ok=True)
+            self.jsonl = open(os.path.join(log_dir, "metrics.jsonl"), "a")
+            self.writer = summary_writer(log_dir)
+        self.start_epoch()
+
+    def start_epoch(self):
+        self.epoch_phases = dict.fromkeys(PHASES, 0.0)
+        self.epoch_samples = 0
+        self._reset_window()
+        self.last = time.perf_counter()
+
+    def _reset_window(self):
+        self.window_phases = dict.fromkeys(PHASES, 0.0)
+        self.window_batches = 0
+        self.window_samples = 0
+        self.window_loss = 0.0
+
+    def lap(self, phase):
+        if self.sync_cuda:
+            # CUDA kernels are asynchronous; wait so the time lands in the right phase
+            torch.cuda.synchronize()
+        now = time.perf_counter()
+        elapsed = now - self.last
+        self.last = now
+        self.epoch_phases[phase] += elapsed
+        self.window_phases[phase] += elapsed
+
+    def end_step(self, samples, loss, stepped, lr):
+        """
+        One batch done: `stepped` says whether it stepped the optimizer.
+        """
+        self.lap('other')
+        self.epoch_samples += samples
+        self.window_samples += samples
+        self.window_batches += 1
+        self.window_loss += loss
+        if not stepped:
+            return
+        self.step += 1
+        if self.every and self.step % self.every == 0:
+            seconds = sum(self.window_phases.values())
+            record = {
+                'step': self.step,
+                'loss': self.window_loss / self.window_batches,
+                'lr': lr,
+                'samples_per_sec': self.window_samples / seconds if seconds else 0.0,
+                'peak_memory_mb': peak_memory_mb(),
+                'time_ms': {phase: 1000.0 * t / self.window_batches for phase, t in self.window_phases.items()},
+            }
+            self.write('train', record)
+            self._reset_window()
+
+    def end_epoch(self, epoch, metrics):
+        """
+        Epoch summary (phase totals averaged over ranks, plus `metrics` such
+        as val_loss, val_cer and val_seconds); logs it and prints where the
+        time went. Collective under distributed training.
+        """
+        _, world_size = distributed.rank_and_world()
+        totals = distributed.all_reduce_sum(*[self.epoch_phases[phase] for phase in PHASES])
+        phases = {phase: total / world_size for phase, total in zip(PHASES, totals)}
+        train_seconds = sum(phases.values())
+        samples = distributed.all_reduce_sum(self.epoch_samples)[0]
+        summary = {
+            'epoch': epoch,
+            'step': self.step,
+            'train_seconds': train_seconds,
+            'samples_per_sec': samples / train_seconds if train_seconds else 0.0,
+            'phase_seconds': phases,
+            'data_wait_fraction': phases['data'] / train_seconds if train_seconds else 0.0,
+            'peak_memory_mb': distributed.all_reduce_max(peak_memory_mb()),
+            **metrics,
+        }
+        self.write('epoch', summary)
+
+        if distributed.is_main_process():
+            split = " | ".join(f"{phase} {100.0 * t / max(train_seconds, 1e-9):.0f}%" for phase, t in phases.items())
+            validation = f", {metrics['val_seconds']:.1f}s validation" if 'val_seconds' in metrics else ""
+            print(f"Epoch {epoch} time: {train_seconds:.1f}s training at {summary['samples_per_sec']:.1f} samples/s "
+                  f"({split}){validation}, peak memory {summary['peak_memory_mb']:.0f} MB")
+            if summary['data_wait_fraction'] > INPUT_BOUND_THRESHOLD:
+                print(f"Input-bound: {100.0 * summary['data_wait_fraction']:.0f}% of training time was spent waiting "
+                      f"for batches. Try more NUM_WORKERS, DATASET_CACHE or TRAIN_SHARDS.")
+        self.start_epoch()
+        return summary
+
+    def write(self, kind, record):
+        if self.jsonl is None:
+            return
+        self.jsonl.write(json.dumps({'kind': kind, 'time': time.time(), **record}) + "\n")
+        self.jsonl.flush()
+        if self.writer is not None:
+            for name, value in _flatten(record):
+                if name not in ('step', 'epoch'):
+                    self.writer.add_scalar(f"{kind}/{name}", value, record['step'])
+            self.writer.flush()
+
+    def close(self):
+        if self.jsonl is not None:
+            self.jsonl.close()
+        if self.writer is not None:
+            self.writer.close()
+
+def _flatten(record, prefix=""):
+    for key, value in record.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}/")
+        elif isinstance(value, (int, float)):
+            yield f"{prefix}{key}", value
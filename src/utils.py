@@ -1,76 +1,116 @@
+import Levenshtein
+import numpy as np
 import torch
-import os
-import base64
-from dotenv import load_dotenv
-from config import IDX_TO_CHAR
+from config import IDX_TO_CHAR, NUM_CLASSES
+from src.refine import get_refiner
 
-# Load environment variables for NSR (Neural Sequence Refinement)
-load_dotenv()
+# Label index -> character ('' for the blank), for decoding many labels at once
+CHAR_TABLE = np.array([IDX_TO_CHAR.get(i, '') for i in range(NUM_CLASSES)], dtype=object)
 
-def decode_prediction(output):
+def _best_path(output, lengths=None):
+    """
+    Argmax path of (T, B, C) log-probs, batch-major: labels and their
+    log-probs (B, T), the mask of frames inside each sequence's length, and
+    the mask of frames that emit a character (non-blank and not a repeat).
+    """
+    best, labels = output.detach().max(dim=2)
+    best, labels = best.t().float(), labels.t()
+    if lengths is None:
+        valid = torch.ones_like(labels, dtype=torch.bool)
+    else:
+        steps = torch.arange(labels.size(1), device=labels.device)
+        valid = steps[None, :] < lengths.to(labels.device)[:, None]
+    prev = torch.cat([labels.new_full((labels.size(0), 1), -1), labels[:, :-1]], dim=1)
+    emit = (labels != 0) & (labels != prev) & valid
+    return labels, best, valid, emit
+
+def _texts(labels, emit):
+    counts = emit.sum(dim=1).tolist()
+    chars = "".join(CHAR_TABLE[labels[emit].cpu().numpy()].tolist())
+    texts, start = [], 0
+    for count in counts:
+        texts.append(chars[start:start + count])
+        start += count
+    return texts
+
+def decode_prediction(output, lengths=None):
     """
     Decode CTC output using greedy search.
+    Repeats and blanks are removed with masks on the argmax tensor; frames
+    past `lengths` (if given) are ignored.
+    """
+    labels, _, _, emit = _best_path(output, lengths)
+    return _texts(labels, emit)
+
+def greedy_decode(output, lengths=None):
+    """
+    Greedy CTC decoding with confidences. Returns (texts, confidences,
+    char_confidences):
+    - char_confidences[i][k]: highest probability among the frames that emit
+      character k of sequence i
+    - confidences[i]: geometric mean of the best-path frame probabilities of
+      sequence i, blanks included (so an uncertain blank lowers it too)
+    """
+    labels, best, valid, emit = _best_path(output, lengths)
+    texts = _texts(labels, emit)
+
+    # Frames of a character: its emitting frame and the repeats that follow.
+    # Index of each character in a flat list of all characters in the batch.
+    counts = emit.sum(dim=1)
+    offsets = torch.cumsum(counts, dim=0) - counts
+    char_index = offsets[:, None] + torch.cumsum(emit, dim=1) - 1
+    in_char = (labels != 0) & valid
+    char_probs = best.new_zeros(int(counts.sum())).scatter_reduce_(
+        0, char_index[in_char], best[in_char].exp(), reduce='amax', include_self=False)
+
+    frames = valid.sum(dim=1).clamp(min=1)
+    confidences = torch.exp((best * valid).sum(dim=1) / frames).tolist()
+
+    char_probs = char_probs.tolist()
+    char_confidences = []
+    for start, count in zip(offsets.tolist(), counts.tolist()):
+        char_confidences.append(char_probs[start:start + count])
+    return texts, confidences, char_confidences
+
+def ctc_collapse(indices):
+    """
+    Best-path frame labels -> text (merge repeats, drop blanks).
     """
-    arg_maxes = torch.argmax(output, dim=2)
-    decoded_texts = []
-    for i in range(arg_maxes.size(1)):
-        indices = arg_maxes[:, i].tolist()
-        decoded = []
-        prev = -1
-        for idx in indices:
-            if idx != 0 and idx != prev:
-                decoded.append(IDX_TO_CHAR.get(idx, ''))
-            prev = idx
-        decoded_texts.append("".join(decoded))
-    return decoded_texts
+    decoded = []
+    prev = -1
+    for idx in indices:
+        if idx != 0 and idx != prev:
+            decoded.append(IDX_TO_CHAR.get(idx, ''))
+        prev = idx
+    return "".join(decoded)
 
 def refine_with_nsr(prediction, image_b64=None):
     """
     Neural Sequence Refinement (NSR).
-    Refines the raw model output using contextual awareness.
+    Refines the raw model output using contextual awareness. Returns the raw
+    prediction if refinement is disabled, busy, failing or past its deadline.
     """
-    token = os.getenv("NSR_API_KEY") or os.getenv("GEMINI_API_KEY")
-    if not token or not image_b64:
-        return prediction
+    text, _ = get_refiner().refine(prediction, image_b64)
+    return text
 
-    try:
-        # Contextual Sequence Refiner (CSR) logic
-        import importlib
-        lib = importlib.import_module('google.generativeai')
-        lib.configure(api_key=token)
-        engine = lib.GenerativeModel('gemini-2.5-flash')
-        
-        if ',' in image_b64:
-            image_b64 = image_b64.split(',')[1]
-        
-        raw_data = base64.b64decode(image_b64)
-        
-        # Probabilistic refinement prompt
-        query = [
-            f"Analyze and correct this handwriting sequence. Raw prediction: '{prediction}'. Return only corrected text.",
-            {"mime_type": "image/png", "data": raw_data}
-        ]
-        
-        result = engine.generate_content(query)
-        final_text = result.text.strip()
-        
-        return final_text if final_text else prediction
-    except:
-        return prediction
-
-def calculate_metrics(preds, targets):
+def cer_counts(preds, targets):
     """
-    Calculate Character Error Rate (CER).
+    (total edit distance, total target length) of a batch. Sum these over
+    a corpus and divide once; averaging per-batch CERs weights short
+    batches wrongly.
     """
-    import Levenshtein
-    
     total_dist = 0
     total_len = 0
     
     for p, t in zip(preds, targets):
-        dist = Levenshtein.distance(p, t)
-        total_dist += dist
+        total_dist += Levenshtein.distance(p, t)
         total_len += len(t)
-        
+    return total_dist, total_len
+
+def calculate_metrics(preds, targets):
+    """
+    Calculate Character Error Rate (CER) over all of `preds` / `targets`.
+    """
+    total_dist, total_len = cer_counts(preds, targets)
     cer = total_dist / total_len if total_len > 0 else 0
     return cer
@@ -13,6 +13,17 @@ document.addEventListener('DOMContentLoaded', () => {
     let lastX = 0;
     let lastY = 0;
 
+    // Live Streaming State
+    const sessionId = window.crypto && crypto.randomUUID
+        ? crypto.randomUUID()
+        : `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+    const STREAM_INTERVAL_MS = 150;
+    let dirtyBox = null;
+    let streamReset = true;
+    let streamPending = false;
+    let streamQueued = false;
+    let lastStreamTime = 0;
+
     // Initialize Canvas
     ctx.lineWidth = 4;
     ctx.lineJoin = 'round';
@@ -55,11 +66,95 @@ document.addEventListener('DOMContentLoaded', () => {
         ctx.moveTo(lastX, lastY);
         ctx.lineTo(e.offsetX, e.offsetY);
         ctx.stroke();
+        markDirty(lastX, lastY);
+        markDirty(e.offsetX, e.offsetY);
         [lastX, lastY] = [e.offsetX, e.offsetY];
+
+        if (Date.now() - lastStreamTime > STREAM_INTERVAL_MS) {
+            sendStrokeUpdate();
+        }
     }
 
     function stopDrawing() {
+        if (!isDrawing) return;
         isDrawing = false;
+        sendStrokeUpdate();
+    }
+
+    // Track the canvas region touched since the last streaming update
+    function markDirty(x, y) {
+        const pad = ctx.lineWidth + 2;
+        const x0 = Math.max(0, Math.floor(x - pad));
+        const y0 = Math.max(0, Math.floor(y - pad));
+        const x1 = Math.min(canvas.width, Math.ceil(x + pad));
+        const y1 = Math.min(canvas.height, Math.ceil(y + pad));
+        if (!dirtyBox) {
+            dirtyBox = { x0, y0, x1, y1 };
+        } else {
+            dirtyBox.x0 = Math.min(dirtyBox.x0, x0);
+            dirtyBox.y0 = Math.min(dirtyBox.y0, y0);
+            dirtyBox.x1 = Math.max(dirtyBox.x1, x1);
+            dirtyBox.y1 = Math.max(dirtyBox.y1, y1);
+        }
+    }
+
+    // Send only the changed patch; the server recomputes the affected columns
+    async function sendStrokeUpdate() {
+        if (streamPending) {
+            streamQueued = true;
+            return;
+        }
+        if (!dirtyBox && !streamReset) return;
+
+        const box = streamReset || !dirtyBox
+            ? { x0: 0, y0: 0, x1: canvas.width, y1: canvas.height }
+            : dirtyBox;
+        const width = box.x1 - box.x0;
+        const height = box.y1 - box.y0;
+        const patch = document.createElement('canvas');
+        patch.width = width;
+        patch.height = height;
+        patch.getContext('2d').drawImage(canvas, box.x0, box.y0, width, height, 0, 0, width, height);
+
+        const body = {
+            image: patch.toDataURL('image/png'),
+            x: box.x0,
+            y: box.y0,
+            canvas_width: canvas.width,
+            canvas_height: canvas.height,
+            reset: streamReset
+        };
+        dirtyBox = null;
+        streamReset = false;
+        streamPending = true;
+        lastStreamTime = Date.now();
+
+        try {
+            const response = await fetch(`http://localhost:5001/stream/${sessionId}`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify(body)
+            });
+            const data = await response.json();
+            if (response.ok && data.status === 'success') {
+                predictionText.innerText = data.prediction || '...';
+            } else {
+                // Session unknown (409), model not ready (503) or an error:
+                // the server canvas may be missing strokes, so resend it whole
+                streamReset = true;
+            }
+        } catch (error) {
+            // Live preview is best effort; "Recognize" still works without it
+            streamReset = true;
+        } finally {
+            streamPending = false;
+            if (streamQueued) {
+                streamQueued = false;
+                sendStrokeUpdate();
+            }
+        }
     }
 
     clearBtn.addEventListener('click', () => {
@@ -67,6 +162,8 @@ document.addEventListener('DOMContentLoaded', () => {
         ctx.fillRect(0, 0, canvas.width, canvas.height);
         predictionText.innerText = '... waiting for input';
         confidenceFill.style.width = '0%';
+        dirtyBox = null;
+        streamReset = true;
     });
 
     recognizeBtn.addEventListener('click', () => {
@@ -109,9 +206,10 @@ document.addEventListener('DOMContentLoaded', () => {
 
             if (data.status === 'success') {
                 predictionText.innerText = data.prediction || "???";
-                // Fake confidence for UI polish
-                const fakeConf = 85 + Math.random() * 10;
-                confidenceFill.style.width = `${fakeConf}%`;
+                // Sequence confidence of the raw CTC prediction (0..1)
+                const confidence = Math.round((data.confidence || 0) * 100);
+                confidenceFill.style.width = `${confidence}%`;
+                confidenceFill.title = `${confidence}%`;
             } else {
                 predictionText.innerText = 'Error';
                 confidenceFill.style.width = '0%';